@@ -0,0 +1,224 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+from app.metrics import registry
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+# Lanes in priority order: a free slot goes to the oldest interactive
+# request, and to a batch request only when no interactive one is waiting
+LANES = (INTERACTIVE, BATCH)
+
+MAX_CONCURRENCY = int(os.getenv("NB_LLM_MAX_CONCURRENCY", 4))
+QUEUE_SIZES = {
+    INTERACTIVE: int(os.getenv("NB_ADMISSION_QUEUE_SIZE", 16)),
+    BATCH: int(os.getenv("NB_ADMISSION_BATCH_QUEUE_SIZE", 16)),
+}
+# Batch requests have no deadline, and wait as long as their lane lets them
+MAX_WAITS = {
+    INTERACTIVE: float(os.getenv("NB_ADMISSION_MAX_WAIT", 10)),
+    BATCH: None,
+}
+# Weight of the latest call in the moving average of the slot hold time
+HOLD_TIME_SMOOTHING = 0.2
+
+admission_decisions = registry.counter(
+    "nb_admission_total",
+    "LLM calls by lane and admission outcome (admitted, queued, rejected "
+    "or timed_out).",
+    labelnames=("lane", "outcome"),
+)
+admission_wait = registry.histogram(
+    "nb_admission_wait_seconds",
+    "Time LLM calls waited for a slot, by lane.",
+    labelnames=("lane",),
+)
+
+
+class Overloaded(Exception):
+    """
+    Raised when an LLM call cannot be admitted: its lane is full (429), or
+    it waited too long for a slot (503).
+    """
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds the number of LLM calls in flight, queueing the others in
+    priority lanes.
+
+    Up to `max_concurrency` calls run at once. Others wait in their lane,
+    first in first out, with interactive calls served before batch ones. A
+    call arriving at a full lane is rejected right away instead of piling
+    up in Ollama's own queue, and one waiting longer than its lane allows
+    gives up. Either way, the client is told when to retry from the recent
+    time calls hold a slot and the length of the queue.
+
+    The controller is used from a single event loop.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENCY,
+        queue_sizes: Optional[Dict[str, int]] = None,
+        max_waits: Optional[Dict[str, Optional[float]]] = None,
+    ):
+        """
+        Args:
+            max_concurrency (int): Maximum number of LLM calls in flight.
+            queue_sizes (Optional[Dict[str, int]]): Maximum number of calls
+                waiting in each lane.
+            max_waits (Optional[Dict[str, Optional[float]]]): Seconds a call
+                may wait in each lane, or None to wait until admitted.
+        """
+        self.max_concurrency = max_concurrency
+        self.queue_sizes = {**QUEUE_SIZES, **(queue_sizes or {})}
+        self.max_waits = {**MAX_WAITS, **(max_waits or {})}
+        self.active = 0
+        self.hold_time = 1.0
+        self._waiters: Dict[str, Deque["asyncio.Future[None]"]] = {
+            lane: deque() for lane in LANES
+        }
+
+    def waiting(self, lane: Optional[str] = None) -> int:
+        """
+        Returns the number of calls waiting in a lane, or in every lane.
+        """
+        lanes = LANES if lane is None else (lane,)
+        return sum(len(self._waiters[lane]) for lane in lanes)
+
+    def retry_after(self) -> int:
+        """
+        Estimates the seconds until the calls in flight and in the queue are
+        done, from the recent time calls hold a slot.
+
+        Returns:
+            int: Seconds to wait before retrying, at least one.
+        """
+        rounds = (self.waiting() + self.max_concurrency) / max(
+            1, self.max_concurrency
+        )
+        return max(1, math.ceil(rounds * self.hold_time))
+
+    def check(self, lane: str = INTERACTIVE) -> None:
+        """
+        Raises Overloaded if a call in the lane would be rejected, so that a
+        response can fail before it starts streaming.
+
+        Args:
+            lane (str): The lane of the call.
+        """
+        if self._is_full(lane):
+            admission_decisions.inc(lane=lane, outcome="rejected")
+            raise Overloaded(
+                f"Too many {lane} requests waiting for the LLM",
+                status_code=429,
+                retry_after=self.retry_after(),
+            )
+
+    async def acquire(self, lane: str = INTERACTIVE) -> None:
+        """
+        Waits for a slot, which must then be passed back to `release`.
+
+        Args:
+            lane (str): The lane of the call.
+        """
+        if self.active < self.max_concurrency and not self.waiting():
+            self.active += 1
+            admission_decisions.inc(lane=lane, outcome="admitted")
+            admission_wait.observe(0.0, lane=lane)
+            return
+        self.check(lane)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(waiter)
+        admission_decisions.inc(lane=lane, outcome="queued")
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(waiter), timeout=self.max_waits[lane]
+            )
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot just as it gave up, pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters[lane].remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                admission_decisions.inc(lane=lane, outcome="timed_out")
+                raise Overloaded(
+                    f"Timed out waiting for the LLM after "
+                    f"{self.max_waits[lane]} seconds",
+                    status_code=503,
+                    retry_after=self.retry_after(),
+                )
+            raise
+        admission_decisions.inc(lane=lane, outcome="admitted")
+        admission_wait.observe(time.perf_counter() - start, lane=lane)
+
+    def release(self) -> None:
+        """
+        Hands the slot of a finished call to the next waiting call, or frees
+        it.
+        """
+        for lane in LANES:
+            waiters = self._waiters[lane]
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def admit(self, lane: str = INTERACTIVE) -> AsyncIterator[None]:
+        """
+        Holds a slot for the duration of the block.
+
+        Args:
+            lane (str): The lane of the call.
+        """
+        await self.acquire(lane)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.hold_time = (
+                HOLD_TIME_SMOOTHING * (time.perf_counter() - start)
+                + (1 - HOLD_TIME_SMOOTHING) * self.hold_time
+            )
+            self.release()
+
+    def _is_full(self, lane: str) -> bool:
+        return (
+            self.active >= self.max_concurrency
+            and len(self._waiters[lane]) >= self.queue_sizes[lane]
+        )
+
+
+admission_controller = AdmissionController()
+
+registry.register_callback(
+    "nb_admission_active",
+    "LLM calls in flight.",
+    "gauge",
+    lambda: [({}, admission_controller.active)],
+)
+registry.register_callback(
+    "nb_admission_waiting",
+    "LLM calls waiting for a slot, by lane.",
+    "gauge",
+    lambda: [
+        ({"lane": lane}, admission_controller.waiting(lane)) for lane in LANES
+    ],
+)
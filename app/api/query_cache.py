@@ -0,0 +1,193 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple, Union
+from app.metrics import registry
+from app.term_url_processing.term_url_mapper import get_vocabulary_fingerprint
+
+# Typographic variants of quotes and dashes users paste from documents
+_PUNCTUATION_VARIANTS = str.maketrans(
+    {
+        "‘": "'",
+        "’": "'",
+        "“": '"',
+        "”": '"',
+        "–": "-",
+        "—": "-",
+    }
+)
+# Sentence punctuation, except decimal points and separators inside numbers
+_SENTENCE_PUNCTUATION = re.compile(r"(?<!\d)[.,](?!\d)|[?!;:\"()\[\]]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Canonicalizes a user query so that trivially different spellings of the
+    same question share a cache entry.
+
+    Args:
+        query (str): The query provided by the user.
+
+    Returns:
+        str: The case-folded query with normalized punctuation and collapsed whitespace.
+    """
+    query = unicodedata.normalize("NFKC", query).translate(
+        _PUNCTUATION_VARIANTS
+    )
+    query = _SENTENCE_PUNCTUATION.sub(" ", query.casefold())
+    return _WHITESPACE.sub(" ", query).strip()
+
+
+class QueryCache:
+    """
+    Bounded, thread-safe LRU cache with a TTL for the responses to user
+    queries, keyed on the normalized query.
+
+    Every entry is tied to the fingerprint of the vocabularies it was
+    resolved against. When the fingerprint changes, for instance because a
+    refreshed vocabulary has new content or an abbreviation table has been
+    regenerated, the whole cache is dropped.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600.0,
+        fingerprint: Optional[Callable[[], Hashable]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._fingerprint = fingerprint
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._current_fingerprint: Optional[Hashable] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, query: str) -> Optional[str]:
+        """
+        Returns the cached response to a query.
+
+        Args:
+            query (str): The query provided by the user.
+
+        Returns:
+            Optional[str]: The cached response, or None on a miss.
+        """
+        key = normalize_query(query)
+        with self._lock:
+            self._check_fingerprint()
+            entry = self._entries.get(key)
+            if entry is None or self._clock() - entry[0] >= self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, query: str, response: str) -> None:
+        """
+        Caches the response to a query, evicting the least recently used
+        entries beyond `max_entries`.
+
+        Args:
+            query (str): The query provided by the user.
+            response (str): The URL or message returned to the user.
+        """
+        if self.max_entries <= 0:
+            return
+        key = normalize_query(query)
+        with self._lock:
+            self._check_fingerprint()
+            self._entries[key] = (self._clock(), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """
+        Drops every entry and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._current_fingerprint = None
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Returns the cache counters.
+
+        Returns:
+            Dict[str, Union[int, float]]: Size, hits, misses, hit rate, evictions and invalidations.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _check_fingerprint(self) -> None:
+        if self._fingerprint is None:
+            return
+        fingerprint = self._fingerprint()
+        if fingerprint != self._current_fingerprint:
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+            self._current_fingerprint = fingerprint
+
+
+query_cache = QueryCache(
+    max_entries=int(os.getenv("NB_QUERY_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("NB_QUERY_CACHE_TTL", 3600)),
+    fingerprint=get_vocabulary_fingerprint,
+)
+
+registry.register_stats(
+    query_cache.stats,
+    {
+        "nb_query_cache_hits_total": ("hits", "counter", "Query cache hits."),
+        "nb_query_cache_misses_total": (
+            "misses",
+            "counter",
+            "Query cache misses.",
+        ),
+        "nb_query_cache_hit_ratio": (
+            "hit_rate",
+            "gauge",
+            "Share of query cache lookups that were hits.",
+        ),
+        "nb_query_cache_entries": (
+            "size",
+            "gauge",
+            "Responses held in the query cache.",
+        ),
+        "nb_query_cache_evictions_total": (
+            "evictions",
+            "counter",
+            "Query cache entries evicted to stay within its size.",
+        ),
+        "nb_query_cache_invalidations_total": (
+            "invalidations",
+            "counter",
+            "Query cache flushes caused by vocabulary changes.",
+        ),
+    },
+)
@@ -1,7 +1,14 @@
 import json
 import os
+from collections import Counter
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
 from dotenv import load_dotenv
-from app.llm_processing.extractions import extract_information
+from starlette.concurrency import run_in_threadpool
+from app.api.query_cache import normalize_query, query_cache
+from app.deadline import RequestBudget, current_budget
+from app.metrics import stage
+from app.singleflight import SingleFlight
 from app.api.validators import (
     validate_age_order,
     validate_diagnosis_and_control,
@@ -11,125 +18,425 @@ from app.term_url_processing.term_url_mapper import (
     get_assessment_termURL,
     get_sex_termURL,
     get_image_modality_termURL,
+    aload_vocabularies,
 )
 
 load_dotenv()
 
 
-def get_api_url(user_query: str) -> str:
-    """
-    Constructs the API URL using extracted parameters from the user's query.
+NOT_FOUND_MESSAGE = "I'm sorry, but I couldn't find the information you're looking for. Could you provide more details or clarify your question?"
 
-    Args:
-        user_query (str): The query provided by the user.
+
+def get_base_api_url() -> str:
+    """
+    Returns the base URL of the Neurobagel query API.
 
     Returns:
-        str: The constructed API URL.
+        str: The value of the NB_API_QUERY_URL environment variable.
     """
     base_api_url = os.getenv("NB_API_QUERY_URL")
     if not base_api_url:
         raise RuntimeError(
             "The application was launched but could not find the NB_API_QUERY_URL environment variable."
         )
+    return base_api_url
 
-    llm_response = extract_information(user_query)
 
-    try:
-        if isinstance(llm_response, str):
-            llm_response = json.loads(llm_response)
-        if not llm_response:
-            return "Please enter a correct query"
+def build_api_url(llm_response: dict, base_api_url: str) -> str:
+    """
+    Constructs the API URL from parameters already extracted from the user's query.
 
-        params = []
-        unsupported_terms = []
+    Args:
+        llm_response (dict): The extracted parameters.
+        base_api_url (str): The base URL of the Neurobagel query API.
 
-        # Validate the response
-        age_validation_result = validate_age_order(llm_response)
-        if isinstance(age_validation_result, str):
-            return age_validation_result
+    Returns:
+        str: The constructed API URL, or a message for the user.
+    """
+    if not llm_response:
+        return "Please enter a correct query"
 
+    params = []
+    unsupported_terms = []
+
+    # Validate the response
+    with stage("validation"):
+        age_validation_result = validate_age_order(llm_response)
         diagnosis_validation_result = validate_diagnosis_and_control(
             llm_response
         )
-        if diagnosis_validation_result:
-            return diagnosis_validation_result
+    if isinstance(age_validation_result, str):
+        return age_validation_result
 
-        if "min_age" in llm_response:
-            params.append(f"min_age={llm_response['min_age']}")
+    if diagnosis_validation_result:
+        return diagnosis_validation_result
 
-        if "max_age" in llm_response:
-            params.append(f"max_age={llm_response['max_age']}")
+    if "min_age" in llm_response:
+        params.append(f"min_age={llm_response['min_age']}")
 
-        if "sex" in llm_response:
-            sex_term_url = get_sex_termURL(llm_response["sex"])
+    if "max_age" in llm_response:
+        params.append(f"max_age={llm_response['max_age']}")
 
-            if sex_term_url == "None":
-                unsupported_terms.append(f"{llm_response['sex']} sex")
-            else:
-                params.append(f"sex={sex_term_url}")
+    if "sex" in llm_response:
+        sex_term_url = get_sex_termURL(llm_response["sex"])
 
-        if "diagnosis" in llm_response:
-            diagnosis_term_url = get_diagnosis_termURL(
-                llm_response["diagnosis"]
-            )
+        if sex_term_url == "None":
+            unsupported_terms.append(f"{llm_response['sex']} sex")
+        else:
+            params.append(f"sex={sex_term_url}")
 
-            if diagnosis_term_url == "None":
-                unsupported_terms.append(
-                    f"{llm_response['diagnosis']} diagnosis"
-                )
-            else:
-                params.append(f"diagnosis={diagnosis_term_url}")
+    if "diagnosis" in llm_response:
+        diagnosis_term_url = get_diagnosis_termURL(llm_response["diagnosis"])
 
-        if "is_control" in llm_response:
-            if "diagnosis" not in llm_response:
-                params.append(
-                    f"is_control={str(llm_response['is_control']).lower()}"
-                )
+        if diagnosis_term_url == "None":
+            unsupported_terms.append(f"{llm_response['diagnosis']} diagnosis")
+        else:
+            params.append(f"diagnosis={diagnosis_term_url}")
 
-        if "min_num_imaging_sessions" in llm_response:
+    if "is_control" in llm_response:
+        if "diagnosis" not in llm_response:
             params.append(
-                f"min_num_imaging_sessions={llm_response['min_num_imaging_sessions']}"
+                f"is_control={str(llm_response['is_control']).lower()}"
             )
 
-        if "min_num_phenotypic_sessions" in llm_response:
-            params.append(
-                f"min_num_phenotypic_sessions={llm_response['min_num_phenotypic_sessions']}"
+    if "min_num_imaging_sessions" in llm_response:
+        params.append(
+            f"min_num_imaging_sessions={llm_response['min_num_imaging_sessions']}"
+        )
+
+    if "min_num_phenotypic_sessions" in llm_response:
+        params.append(
+            f"min_num_phenotypic_sessions={llm_response['min_num_phenotypic_sessions']}"
+        )
+
+    if "assessment" in llm_response:
+        assessment_term_url = get_assessment_termURL(
+            llm_response["assessment"]
+        )
+
+        if assessment_term_url == "None":
+            unsupported_terms.append(
+                f"{llm_response['assessment']} assessment"
             )
+        else:
+            params.append(f"assessment={assessment_term_url}")
 
-        if "assessment" in llm_response:
-            assessment_term_url = get_assessment_termURL(
-                llm_response["assessment"]
+    if "image_modal" in llm_response:
+        image_modal_term_url = get_image_modality_termURL(
+            llm_response["image_modal"]
+        )
+
+        if image_modal_term_url == "None":
+            unsupported_terms.append(
+                f"{llm_response['image_modal']} image modality"
             )
+        else:
+            params.append(f"image_modal={image_modal_term_url}")
+
+    # Check for unsupported terms and construct the error message if any
+    if unsupported_terms:
+        return f"Unfortunately, Neurobagel does not yet support searches for the following terms: {', '.join(unsupported_terms)}"
+
+    # Construct the full API URL by joining the base URL with the parameters
+    api_url = base_api_url + "&".join(params)
+    return api_url
+
+
+def resolve_term_url(field: str, value: Any) -> Optional[str]:
+    """
+    Maps the value of a term field to its TermURL.
+
+    Args:
+        field (str): One of "sex", "diagnosis", "assessment" or "image_modal".
+        value (Any): The extracted value of the field.
+
+    Returns:
+        Optional[str]: The TermURL, or None if the term is not supported.
+    """
+    resolvers = {
+        "sex": get_sex_termURL,
+        "diagnosis": get_diagnosis_termURL,
+        "assessment": get_assessment_termURL,
+        "image_modal": get_image_modality_termURL,
+    }
+    term_url = resolvers[field](value)
+    return None if term_url == "None" else term_url
+
+
+TERM_FIELDS = ("sex", "diagnosis", "assessment", "image_modal")
+
+
+# The LLM stack (app.llm_processing.extractions and LangChain) is imported
+# on first use rather than with this module, to keep startup fast
+
+
+def extract_information(context: str) -> Optional[Union[dict, str, None]]:
+    """
+    Extracts the query parameters with the LLM, see
+    `app.llm_processing.extractions.extract_information`.
+    """
+    from app.llm_processing.extractions import extract_information
+
+    return extract_information(context)
+
+
+async def aextract_information(
+    context: str,
+) -> Optional[Union[dict, str, None]]:
+    """
+    Async version of `extract_information`.
+    """
+    from app.llm_processing.extractions import aextract_information
+
+    return await aextract_information(context)
+
+
+# Concurrent extractions of the same normalized query share one LLM call
+extraction_flights = SingleFlight("extraction")
+
+
+def get_api_url(user_query: str) -> str:
+    """
+    Constructs the API URL using extracted parameters from the user's query.
+
+    Args:
+        user_query (str): The query provided by the user.
 
-            if assessment_term_url == "None":
-                unsupported_terms.append(
-                    f"{llm_response['assessment']} assessment"
+    Returns:
+        str: The constructed API URL.
+    """
+    base_api_url = get_base_api_url()
+
+    cached_response = query_cache.get(user_query)
+    if cached_response is not None:
+        return cached_response
+
+    # Decoded JSON, so its type is only known once validated
+    llm_response: Any = extraction_flights.do(
+        normalize_query(user_query), lambda: extract_information(user_query)
+    )
+
+    try:
+        if isinstance(llm_response, str):
+            llm_response = json.loads(llm_response)
+    except json.JSONDecodeError:
+        return NOT_FOUND_MESSAGE
+
+    api_url = build_api_url(llm_response, base_api_url)
+    query_cache.set(user_query, api_url)
+    return api_url
+
+
+async def aget_api_url(user_query: str) -> str:
+    """
+    Async version of `get_api_url`. The LLM and the vocabulary fetches are
+    awaited without blocking the event loop, and the CPU-bound term matching
+    runs in the thread pool.
+
+    Args:
+        user_query (str): The query provided by the user.
+
+    Returns:
+        str: The constructed API URL.
+    """
+    base_api_url = get_base_api_url()
+
+    cached_response = query_cache.get(user_query)
+    if cached_response is not None:
+        return cached_response
+
+    llm_response: Any = await extraction_flights.ado(
+        normalize_query(user_query), lambda: aextract_information(user_query)
+    )
+
+    try:
+        if isinstance(llm_response, str):
+            llm_response = json.loads(llm_response)
+    except json.JSONDecodeError:
+        return NOT_FOUND_MESSAGE
+
+    if llm_response:
+        await aload_vocabularies(llm_response.keys())
+    api_url = await run_in_threadpool(
+        build_api_url, llm_response, base_api_url
+    )
+    query_cache.set(user_query, api_url)
+    return api_url
+
+
+def stream_api_url(user_query: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streams the construction of the API URL of a query.
+
+    Each extracted field is sent as soon as it is decoded from the LLM
+    output, followed by its TermURL for term fields, and the API URL is sent
+    last. The LLM generation is stopped if the stream is closed early.
+
+    Args:
+        user_query (str): The query provided by the user.
+
+    Returns:
+        AsyncIterator[Dict[str, Any]]: Events with an "event" name ("field",
+        "term_url" or "url") and their "data".
+    """
+    # Fail before anything is streamed back if the service is misconfigured
+    base_api_url = get_base_api_url()
+    return _astream_api_url(user_query, base_api_url)
+
+
+async def _astream_api_url(
+    user_query: str, base_api_url: str
+) -> AsyncIterator[Dict[str, Any]]:
+    cached_response = query_cache.get(user_query)
+    if cached_response is not None:
+        yield {"event": "url", "data": {"response": cached_response}}
+        return
+
+    from app.llm_processing.extractions import (
+        format_response,
+        get_extraction_engine,
+    )
+
+    budget = current_budget() or RequestBudget(timeout=None)
+    raw_response: Dict[str, Any] = {}
+    # Fields already sent cannot be taken back, so the stream is not
+    # retried, but each step is cut off at the deadline of the request
+    stream = get_extraction_engine().astream_extract(user_query)
+    async with aclosing(stream):
+        while True:
+            try:
+                field, value = await budget.run(stream.__anext__())
+            except StopAsyncIteration:
+                break
+            raw_response[field] = value
+            formatted_value = format_response({field: value}).get(field)
+            if formatted_value is None:
+                continue
+            yield {
+                "event": "field",
+                "data": {"name": field, "value": formatted_value},
+            }
+
+            if field in TERM_FIELDS:
+                await budget.run(aload_vocabularies([field]))
+                term_url = await budget.run(
+                    run_in_threadpool(resolve_term_url, field, formatted_value)
                 )
-            else:
-                params.append(f"assessment={assessment_term_url}")
+                yield {
+                    "event": "term_url",
+                    "data": {"name": field, "term_url": term_url},
+                }
+
+    llm_response = format_response(raw_response)
+    if llm_response:
+        await aload_vocabularies(llm_response.keys())
+    api_url = await run_in_threadpool(
+        build_api_url, llm_response, base_api_url
+    )
+    query_cache.set(user_query, api_url)
+    yield {"event": "url", "data": {"response": api_url}}
+
+
+def generate_api_urls(
+    user_queries: List[str], max_concurrency: int = 4
+) -> AsyncIterator[Dict[str, str]]:
+    """
+    Constructs the API URLs of many queries at once.
 
-        if "image_modal" in llm_response:
-            image_modal_term_url = get_image_modality_termURL(
-                llm_response["image_modal"]
+    Identical queries (after normalization) are only resolved once. The
+    queries are processed in chunks so that only the results of one chunk,
+    plus those of duplicates still to come, are held in memory.
+
+    Args:
+        user_queries (List[str]): The queries provided by the user.
+        max_concurrency (int): Maximum number of LLM calls in flight.
+
+    Returns:
+        AsyncIterator[Dict[str, str]]: For each query, in order, its "query" and
+        either its "response" or the "error" raised while resolving it.
+    """
+    # Fail before anything is streamed back if the service is misconfigured
+    base_api_url = get_base_api_url()
+    return _agenerate_api_urls(user_queries, base_api_url, max_concurrency)
+
+
+async def _agenerate_api_urls(
+    user_queries: List[str], base_api_url: str, max_concurrency: int
+) -> AsyncIterator[Dict[str, str]]:
+    keys = [normalize_query(user_query) for user_query in user_queries]
+    remaining = Counter(keys)
+    resolved: Dict[str, Dict[str, str]] = {}
+    chunk_size = max(1, max_concurrency) * 4
+
+    for start in range(0, len(user_queries), chunk_size):
+        chunk = list(
+            zip(
+                user_queries[start : start + chunk_size],
+                keys[start : start + chunk_size],
             )
+        )
+        unresolved: Dict[str, str] = {}
+        for user_query, key in chunk:
+            if key not in resolved:
+                unresolved.setdefault(key, user_query)
+        outcomes = await _aresolve_queries(
+            list(unresolved.values()), base_api_url, max_concurrency
+        )
+        resolved.update(zip(unresolved.keys(), outcomes))
 
-            if image_modal_term_url == "None":
-                unsupported_terms.append(
-                    f"{llm_response['image_modal']} image modality"
-                )
-            else:
-                params.append(f"image_modal={image_modal_term_url}")
+        for user_query, key in chunk:
+            outcome = resolved[key]
+            remaining[key] -= 1
+            if not remaining[key]:
+                del resolved[key]
+            yield {"query": user_query, **outcome}
 
-        # Check for unsupported terms and construct the error message if any
-        if unsupported_terms:
-            return f"Unfortunately, Neurobagel does not yet support searches for the following terms: {', '.join(unsupported_terms)}"
 
-        # Construct the full API URL by joining the base URL with the parameters
-        api_url = base_api_url + "&".join(params)
-        return api_url
+async def _aresolve_queries(
+    user_queries: List[str], base_api_url: str, max_concurrency: int
+) -> List[Dict[str, str]]:
+    outcomes: List[Dict[str, str]] = [{} for _ in user_queries]
+    pending = []
+    for position, user_query in enumerate(user_queries):
+        cached_response = query_cache.get(user_query)
+        if cached_response is not None:
+            outcomes[position] = {"response": cached_response}
+        else:
+            pending.append(position)
+    if not pending:
+        return outcomes
 
-    except json.JSONDecodeError:
-        return "I'm sorry, but I couldn't find the information you're looking for. Could you provide more details or clarify your question?"
+    from app.llm_processing.extractions import get_extraction_engine
+
+    llm_responses = await get_extraction_engine().aextract_batch(
+        [user_queries[position] for position in pending], max_concurrency
+    )
+
+    # Load every vocabulary the batch needs once, up front
+    await aload_vocabularies(
+        {
+            attribute
+            for llm_response in llm_responses
+            if isinstance(llm_response, dict)
+            for attribute in llm_response
+        }
+    )
+
+    def build_all() -> None:
+        for position, llm_response in zip(pending, llm_responses):
+            if isinstance(llm_response, Exception):
+                outcomes[position] = {"error": str(llm_response)}
+                continue
+            try:
+                api_url = build_api_url(llm_response, base_api_url)
+            except Exception as e:
+                outcomes[position] = {"error": str(e)}
+                continue
+            query_cache.set(user_queries[position], api_url)
+            outcomes[position] = {"response": api_url}
+
+    await run_in_threadpool(build_all)
+    return outcomes
 
 
 def main():
@@ -0,0 +1,245 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, Iterator, Optional, TypeVar
+from app.admission import Overloaded
+from app.metrics import registry
+from tenacity import (
+    RetryCallState,
+    retry_if_not_exception_type,
+    wait_random_exponential,
+)
+
+T = TypeVar("T")
+
+DEFAULT_TIMEOUT = float(os.getenv("NB_REQUEST_TIMEOUT", 30))
+MAX_TIMEOUT = float(os.getenv("NB_REQUEST_TIMEOUT_MAX", 120))
+MIN_TIMEOUT = float(os.getenv("NB_REQUEST_TIMEOUT_MIN", 1))
+DEFAULT_RETRY_BUDGET = int(os.getenv("NB_RETRY_BUDGET", 2))
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a request runs past its deadline.
+    """
+
+
+class RetryStats:
+    """
+    Process-wide, thread-safe counters of retries and deadline overruns.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.budget_exhausted = 0
+        self.deadline_exceeded = 0
+
+    def increment(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "retries": self.retries,
+                "budget_exhausted": self.budget_exhausted,
+                "deadline_exceeded": self.deadline_exceeded,
+            }
+
+
+retry_stats = RetryStats()
+
+registry.register_stats(
+    retry_stats.snapshot,
+    {
+        "nb_retries_total": (
+            "retries",
+            "counter",
+            "Retries of failed stages, drawn from request budgets.",
+        ),
+        "nb_retry_budget_exhausted_total": (
+            "budget_exhausted",
+            "counter",
+            "Requests that failed after using up their retry budget.",
+        ),
+        "nb_deadline_exceeded_total": (
+            "deadline_exceeded",
+            "counter",
+            "Requests that ran past their deadline.",
+        ),
+    },
+)
+
+
+class RequestBudget:
+    """
+    The time and retries a single request may spend.
+
+    Every stage of the request reads the same budget through
+    `current_budget()`: the deadline bounds each LLM call and network
+    fetch, and all retries, whichever stage they happen in, are drawn from
+    one shared allowance instead of multiplying across layers.
+    """
+
+    def __init__(
+        self,
+        timeout: Optional[float] = DEFAULT_TIMEOUT,
+        max_retries: int = DEFAULT_RETRY_BUDGET,
+    ):
+        """
+        Starts the budget clock.
+
+        Args:
+            timeout (Optional[float]): Seconds the request may take, or None for no deadline.
+            max_retries (int): Number of retries shared by every stage of the request.
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retries = 0
+        self.deadline = (
+            time.monotonic() + timeout if timeout is not None else None
+        )
+
+    def remaining(self) -> Optional[float]:
+        """
+        Returns the seconds left before the deadline, or None without one.
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expired(self) -> bool:
+        """
+        Returns True once the deadline has passed.
+        """
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def check(self) -> None:
+        """
+        Raises DeadlineExceeded if the deadline has passed.
+        """
+        if self.expired():
+            retry_stats.increment("deadline_exceeded")
+            raise DeadlineExceeded(
+                f"Request did not complete within {self.timeout} seconds"
+            )
+
+    def bound(self, timeout: float) -> float:
+        """
+        Caps a stage timeout so that it does not outlive the deadline.
+
+        Args:
+            timeout (float): The timeout the stage would use on its own.
+
+        Returns:
+            float: The smaller of the stage timeout and the remaining time.
+        """
+        remaining = self.remaining()
+        return timeout if remaining is None else min(timeout, remaining)
+
+    async def run(self, awaitable: Awaitable[T]) -> T:
+        """
+        Awaits a stage, cancelling it when the deadline is reached.
+
+        Args:
+            awaitable (Awaitable[T]): The stage to run.
+
+        Returns:
+            T: The result of the stage.
+        """
+        self.check()
+        try:
+            return await asyncio.wait_for(awaitable, timeout=self.remaining())
+        except asyncio.TimeoutError:
+            retry_stats.increment("deadline_exceeded")
+            raise DeadlineExceeded(
+                f"Request did not complete within {self.timeout} seconds"
+            )
+
+    def retry_policy(self) -> Dict[str, Any]:
+        """
+        Returns tenacity keyword arguments that retry with jittered
+        exponential backoff while the budget allows it.
+
+        Returns:
+            Dict[str, Any]: Arguments for tenacity's Retrying or AsyncRetrying.
+        """
+        backoff = wait_random_exponential(multiplier=0.25, max=4)
+
+        def stop(retry_state: RetryCallState) -> bool:
+            if self.expired():
+                return True
+            if self.retries >= self.max_retries:
+                retry_stats.increment("budget_exhausted")
+                return True
+            self.retries += 1
+            retry_stats.increment("retries")
+            return False
+
+        def wait(retry_state: RetryCallState) -> float:
+            return self.bound(backoff(retry_state))
+
+        return {
+            "stop": stop,
+            "wait": wait,
+            # Retrying would only add to the load that got the call refused
+            "retry": retry_if_not_exception_type(
+                (DeadlineExceeded, Overloaded)
+            ),
+            "reraise": True,
+        }
+
+
+_current_budget: ContextVar[Optional[RequestBudget]] = ContextVar(
+    "request_budget", default=None
+)
+
+
+def current_budget() -> Optional[RequestBudget]:
+    """
+    Returns the budget of the request being served, if any.
+    """
+    return _current_budget.get()
+
+
+@contextmanager
+def request_budget(
+    timeout: Optional[float] = DEFAULT_TIMEOUT,
+    max_retries: int = DEFAULT_RETRY_BUDGET,
+) -> Iterator[RequestBudget]:
+    """
+    Makes a new budget the current one for the duration of the block.
+
+    Args:
+        timeout (Optional[float]): Seconds the request may take, or None for no deadline.
+        max_retries (int): Number of retries shared by every stage of the request.
+
+    Yields:
+        RequestBudget: The new budget.
+    """
+    budget = RequestBudget(timeout=timeout, max_retries=max_retries)
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+def resolve_timeout(requested: Optional[float]) -> float:
+    """
+    Returns the deadline to use for a request, honouring a timeout
+    requested by the client within the configured minimum and maximum.
+
+    Args:
+        requested (Optional[float]): The timeout requested by the client, in seconds.
+
+    Returns:
+        float: The timeout of the request, in seconds.
+    """
+    if requested is None or requested <= 0:
+        return DEFAULT_TIMEOUT
+    return max(MIN_TIMEOUT, min(requested, MAX_TIMEOUT))
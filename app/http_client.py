@@ -0,0 +1,179 @@
+import asyncio
+import os
+import threading
+import weakref
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    import httpx
+    import requests
+
+CONNECT_TIMEOUT = float(os.getenv("NB_HTTP_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("NB_HTTP_READ_TIMEOUT", 30))
+MAX_RETRIES = int(os.getenv("NB_HTTP_MAX_RETRIES", 2))
+MAX_CONNECTIONS = int(os.getenv("NB_HTTP_MAX_CONNECTIONS", 10))
+
+HEADERS = {
+    "Accept": "application/json",
+    "Accept-Encoding": "gzip, deflate",
+    "User-Agent": "neurobagel-query-tool-ai",
+}
+
+_session: Optional["requests.Session"] = None
+_session_lock = threading.Lock()
+# httpx clients are bound to the event loop they are first used in
+_async_clients: (
+    "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]"
+) = weakref.WeakKeyDictionary()
+_llm_clients: (
+    "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]"
+) = weakref.WeakKeyDictionary()
+
+
+def get_session() -> "requests.Session":
+    """
+    Returns the process-wide HTTP session, creating it on first use.
+
+    The session keeps up to `MAX_CONNECTIONS` keep-alive connections per
+    host, asks for compressed responses, and retries idempotent requests up
+    to `MAX_RETRIES` times on connection errors and on 502, 503 and 504
+    responses, with exponential backoff and honoring Retry-After.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # Imported on first use, to keep startup fast
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                adapter = HTTPAdapter(
+                    pool_maxsize=MAX_CONNECTIONS,
+                    max_retries=Retry(
+                        total=MAX_RETRIES,
+                        backoff_factor=0.25,
+                        status_forcelist=(502, 503, 504),
+                        allowed_methods=("GET", "HEAD"),
+                        raise_on_status=False,
+                    ),
+                )
+                session = requests.Session()
+                session.headers.update(HEADERS)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def get(url: str, **kwargs: Any) -> "requests.Response":
+    """
+    Sends a GET request through the shared session.
+
+    Args:
+        url (str): The URL to fetch.
+        **kwargs: Arguments of `requests.Session.get`. The timeout defaults
+            to `CONNECT_TIMEOUT` to connect and `READ_TIMEOUT` to read.
+
+    Returns:
+        requests.Response: The response.
+    """
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    return get_session().get(url, **kwargs)
+
+
+def get_async_client() -> "httpx.AsyncClient":
+    """
+    Returns the async HTTP client of the running event loop, creating it
+    on first use, with the same pooling, timeouts and headers as the
+    session. Connection errors are retried, HTTP errors are not.
+
+    Returns:
+        httpx.AsyncClient: The shared client of the running loop.
+    """
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            # The client ignores its own limits when given a transport
+            transport=httpx.AsyncHTTPTransport(
+                retries=MAX_RETRIES,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_CONNECTIONS,
+                ),
+            ),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def get_llm_client() -> "httpx.AsyncClient":
+    """
+    Returns the async HTTP client of the running event loop for LLM
+    generations, creating it on first use.
+
+    Generations hold their connection for as long as they stream, so they
+    get a client of their own rather than taking the connections of the
+    Neurobagel API client. Their concurrency is bounded by admission
+    control, not by the client: it keeps as many keep-alive connections as
+    generations may run at once, and opens more if needed.
+
+    Returns:
+        httpx.AsyncClient: The LLM client of the running loop.
+    """
+    import httpx
+    from app.admission import MAX_CONCURRENCY
+
+    loop = asyncio.get_running_loop()
+    client = _llm_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            transport=httpx.AsyncHTTPTransport(
+                retries=MAX_RETRIES,
+                limits=httpx.Limits(
+                    max_connections=None,
+                    max_keepalive_connections=MAX_CONCURRENCY,
+                ),
+            ),
+        )
+        _llm_clients[loop] = client
+    return client
+
+
+async def aget(url: str, **kwargs: Any) -> "httpx.Response":
+    """
+    Async version of `get`, through the client of the running event loop.
+
+    Args:
+        url (str): The URL to fetch.
+        **kwargs: Arguments of `httpx.AsyncClient.get`.
+
+    Returns:
+        httpx.Response: The response.
+    """
+    return await get_async_client().get(url, **kwargs)
+
+
+async def aclose() -> None:
+    """
+    Closes the session and the async clients of the running event loop.
+    """
+    global _session
+    with _session_lock:
+        session, _session = _session, None
+    if session is not None:
+        session.close()
+    loop = asyncio.get_running_loop()
+    for clients in (_async_clients, _llm_clients):
+        client = clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
@@ -0,0 +1,280 @@
+import requests
+from contextlib import aclosing
+from typing import (
+    Any,
+    AsyncGenerator,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+from langchain_community.chat_models import ChatOllama
+from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.pydantic_v1 import PrivateAttr
+from app import http_client
+from app.llm_processing.ollama_pool import OllamaPool
+from app.metrics import record_tokens
+
+
+class PooledChatOllama(ChatOllama):
+    """
+    ChatOllama that keeps a persistent HTTP connection to the Ollama server.
+
+    The upstream implementation sends every generation through a bare
+    `requests.post`, or a new aiohttp session when async, which opens a new
+    connection each time. This subclass sends sync generations through a
+    `requests.Session` owned by the model instance, and async ones through
+    the LLM httpx client of the running event loop (see app.http_client),
+    so a long-lived model reuses pooled keep-alive connections.
+
+    `format` also accepts a JSON schema, which Ollama 0.5 and later use to
+    constrain the generation, in addition to "json".
+
+    Given an OllamaPool, generations are spread across its backends instead
+    of all going to `base_url`.
+
+    This overrides private methods of ChatOllama and builds requests the way
+    they do, which is why langchain-community is pinned to an exact version
+    in requirements.txt. The tests check both against upstream, so they
+    fail when an upgrade changes them.
+    """
+
+    # Widens the "json"-only field of ChatOllama
+    format: Optional[Union[str, Dict[str, Any]]] = None  # type: ignore[assignment]
+
+    _session: requests.Session = PrivateAttr(default_factory=requests.Session)
+    _pool: Optional[OllamaPool] = PrivateAttr(default=None)
+
+    def __init__(self, pool: Optional[OllamaPool] = None, **kwargs: Any):
+        """
+        Args:
+            pool (Optional[OllamaPool]): The backends to send generations to.
+            **kwargs: ChatOllama fields.
+        """
+        super().__init__(**kwargs)
+        self._pool = pool
+
+    @property
+    def pool(self) -> Optional[OllamaPool]:
+        return self._pool
+
+    def _create_stream(
+        self,
+        api_url: str,
+        payload: Any,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Iterator[str]:
+        if self._pool is None:
+            return self._post_stream(api_url, payload, stop, **kwargs)
+        path = api_url[len(self.base_url) :]
+        return self._pool.stream(
+            lambda base_url: self._post_stream(
+                f"{base_url}{path}", payload, stop, **kwargs
+            )
+        )
+
+    async def _acreate_stream(
+        self,
+        api_url: str,
+        payload: Any,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> AsyncGenerator[str, None]:
+        stream: AsyncGenerator[str, None]
+        if self._pool is None:
+            stream = self._apost_stream(api_url, payload, stop, **kwargs)
+        else:
+            path = api_url[len(self.base_url) :]
+            stream = self._pool.astream(
+                lambda base_url: self._apost_stream(
+                    f"{base_url}{path}", payload, stop, **kwargs
+                )
+            )
+        async with aclosing(stream):
+            async for line in stream:
+                yield line
+
+    def _request(
+        self,
+        payload: Any,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        # The headers and body of a generation, as built upstream
+        if self.stop is not None and stop is not None:
+            raise ValueError(
+                "`stop` found in both the input and default params."
+            )
+        elif self.stop is not None:
+            stop = self.stop
+
+        params = self._default_params
+
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{
+                    k: v
+                    for k, v in kwargs.items()
+                    if k not in self._default_params
+                },
+            }
+
+        if payload.get("messages"):
+            request_payload = {
+                "messages": payload.get("messages", []),
+                **params,
+            }
+        else:
+            request_payload = {
+                "prompt": payload.get("prompt"),
+                "images": payload.get("images", []),
+                **params,
+            }
+        headers = {
+            "Content-Type": "application/json",
+            **(self.headers if isinstance(self.headers, dict) else {}),
+        }
+        return headers, request_payload
+
+    def _check_status(self, status_code: int, text: str) -> None:
+        if status_code == 404:
+            raise OllamaEndpointNotFoundError(
+                "Ollama call failed with status code 404. "
+                "Maybe your model is not found "
+                f"and you should pull the model with `ollama pull {self.model}`."
+            )
+        if status_code != 200:
+            raise ValueError(
+                f"Ollama call failed with status code {status_code}."
+                f" Details: {text}"
+            )
+
+    def _post_stream(
+        self,
+        api_url: str,
+        payload: Any,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Iterator[str]:
+        headers, request_payload = self._request(payload, stop, **kwargs)
+        response = self._session.post(
+            url=api_url,
+            headers=headers,
+            json=request_payload,
+            stream=True,
+            timeout=self.timeout,
+        )
+        response.encoding = "utf-8"
+        if response.status_code != 200:
+            self._check_status(response.status_code, response.text)
+        return response.iter_lines(decode_unicode=True)
+
+    async def _apost_stream(
+        self,
+        api_url: str,
+        payload: Any,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> AsyncGenerator[str, None]:
+        import httpx
+
+        headers, request_payload = self._request(payload, stop, **kwargs)
+        async with http_client.get_llm_client().stream(
+            "POST",
+            api_url,
+            headers=headers,
+            json=request_payload,
+            # Generations are bounded by the request deadlines instead
+            timeout=httpx.Timeout(
+                self.timeout, connect=http_client.CONNECT_TIMEOUT
+            ),
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                self._check_status(response.status_code, response.text)
+            async for line in response.aiter_lines():
+                yield line
+
+    def load(self, keep_alive: Optional[Union[int, str]] = None) -> None:
+        """
+        Loads the model into memory on the Ollama server without generating
+        anything, so that the first generation does not pay for it.
+
+        With a pool, the model is loaded on every backend, and only an error
+        of the last one is raised if none could load it: the others are
+        left for the health checks to re-admit.
+
+        Args:
+            keep_alive (Optional[Union[int, str]]): How long the model stays
+                loaded, defaults to the `keep_alive` of this client.
+        """
+        payload: Dict[str, Any] = {"model": self.model}
+        keep_alive = keep_alive if keep_alive is not None else self.keep_alive
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        if self._pool is None:
+            self._load(self.base_url, payload)
+            return
+
+        error: Optional[Exception] = None
+        loaded = False
+        for backend in self._pool.backends:
+            try:
+                self._load(backend.base_url, payload)
+                loaded = True
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"Loading {self.model} on {backend.base_url}: {e}")
+                error = e
+        if not loaded and error is not None:
+            raise error
+
+    def _load(self, base_url: str, payload: Dict[str, Any]) -> None:
+        response = self._session.post(
+            url=f"{base_url}/api/generate",
+            json=payload,
+            timeout=self.timeout,
+        )
+        if response.status_code != 200:
+            raise ValueError(
+                f"Loading {self.model} failed with status code {response.status_code}."
+                f" Details: {response.text}"
+            )
+
+    def close(self) -> None:
+        """
+        Closes the pooled connections to the Ollama server.
+        """
+        self._session.close()
+
+
+class OllamaTokenUsage(BaseCallbackHandler):
+    """
+    Callback handler recording the prompt and completion tokens reported by
+    Ollama at the end of every generation (see app.metrics.record_tokens).
+    """
+
+    run_inline = True
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                info = generation.generation_info or {}
+                if "eval_count" in info or "prompt_eval_count" in info:
+                    # Ollama omits the prompt count when the prompt is cached
+                    record_tokens(
+                        info.get("prompt_eval_count", 0),
+                        info.get("eval_count", 0),
+                    )
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, Dict, Optional
+from app.api.query_cache import normalize_query
+from app.metrics import registry
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
+DEFAULT_MAX_ENTRIES = 100_000
+# Seconds SQLite waits for another worker's write before giving up
+SQLITE_BUSY_TIMEOUT = 5.0
+# Seconds between two updates of the time an entry was last read, so that
+# most hits are plain reads
+READ_AT_RESOLUTION = 60.0
+# Share of the cache written between two checks of its size, so that most
+# writes do not count the table
+EVICTION_BATCH = 0.01
+# Share of the cache evicted beyond its size once it is full, so that the
+# next writes do not evict again
+EVICTION_MARGIN = 0.1
+
+extraction_cache_lookups = registry.counter(
+    "nb_extraction_cache_lookups_total",
+    "Lookups of LLM extractions in the persistent cache, by outcome (hit, "
+    "miss or error).",
+    labelnames=("outcome",),
+)
+
+
+def extraction_cache_key(query: str, model: str, prompt_hash: str) -> str:
+    """
+    Builds the cache key of an extraction, which only depends on the
+    normalized query, the model and the prompt.
+
+    Args:
+        query (str): The query provided by the user.
+        model (str): The name of the model.
+        prompt_hash (str): Identifies the prompt and how its output is used.
+
+    Returns:
+        str: A SHA-256 hex digest.
+    """
+    key = json.dumps([normalize_query(query), model, prompt_hash])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class ExtractionCacheBackend(ABC):
+    """
+    Storage of post-processed extractions by cache key.
+
+    Backends must be safe to use from several threads, and should be shared
+    by every worker. Failing to read or write must not fail the extraction:
+    errors are reported and treated as misses.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the extraction cached under a key, or None on a miss.
+        """
+
+    @abstractmethod
+    def set(self, key: str, extraction: Dict[str, Any]) -> None:
+        """
+        Caches an extraction under a key, evicting others to stay within
+        the size of the cache.
+        """
+
+    @abstractmethod
+    def clear(self) -> None:
+        """
+        Drops every cached extraction.
+        """
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    def close(self) -> None:
+        """
+        Releases the resources held by the backend.
+        """
+
+
+class SQLiteExtractionCache(ExtractionCacheBackend):
+    """
+    Extraction cache in an SQLite file, shared by every worker of the host
+    and kept across restarts.
+
+    The database is in WAL mode, so that reads never wait for writes. Hits
+    update the time the entry was last read, at most once a minute. The size
+    of the cache is checked after every 1% of `max_entries` written, and
+    once beyond `max_entries`, the least recently read entries are evicted
+    in one batch down to 90% of it. The cache may thus briefly hold a few
+    more entries than `max_entries`.
+    """
+
+    def __init__(self, url: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            url (str): SQLAlchemy URL of the database, e.g.
+                "sqlite:////data/extractions.db".
+            max_entries (int): Maximum number of cached extractions.
+        """
+        # Imported on first use, to keep startup fast
+        from sqlalchemy import (
+            Column,
+            Float,
+            MetaData,
+            String,
+            Table,
+            Text,
+            create_engine,
+            event,
+        )
+
+        self.max_entries = max_entries
+        self._check_interval = max(1, int(max_entries * EVICTION_BATCH))
+        self._writes = 0
+        self._engine: "Engine" = create_engine(
+            url, connect_args={"timeout": SQLITE_BUSY_TIMEOUT}
+        )
+        event.listen(self._engine, "connect", self._configure_connection)
+        metadata = MetaData()
+        self._table = Table(
+            "extractions",
+            metadata,
+            Column("key", String(64), primary_key=True),
+            Column("extraction", Text, nullable=False),
+            Column("read_at", Float, nullable=False, index=True),
+        )
+        metadata.create_all(self._engine)
+        self._write_lock = threading.Lock()
+
+    @staticmethod
+    def _configure_connection(connection: Any, _: Any) -> None:
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        from sqlalchemy import select, update
+        from sqlalchemy.exc import SQLAlchemyError
+
+        table = self._table
+        extraction = None
+        try:
+            with self._engine.connect() as connection:
+                row = connection.execute(
+                    select(table.c.extraction, table.c.read_at).where(
+                        table.c.key == key
+                    )
+                ).first()
+                if row is not None:
+                    extraction, read_at = row
+                    now = time.time()
+                    if now - read_at >= READ_AT_RESOLUTION:
+                        connection.execute(
+                            update(table)
+                            .where(table.c.key == key)
+                            .values(read_at=now)
+                        )
+                        connection.commit()
+        except SQLAlchemyError as e:
+            print(f"Failed to read the extraction cache: {e}")
+            extraction_cache_lookups.inc(outcome="error")
+            return None
+        extraction_cache_lookups.inc(
+            outcome="miss" if extraction is None else "hit"
+        )
+        return None if extraction is None else json.loads(extraction)
+
+    def set(self, key: str, extraction: Dict[str, Any]) -> None:
+        from sqlalchemy.dialects.sqlite import insert
+        from sqlalchemy.exc import SQLAlchemyError
+
+        table = self._table
+        values = {"extraction": json.dumps(extraction), "read_at": time.time()}
+        try:
+            # Writers of one process queue here rather than on SQLite's lock
+            with self._write_lock, self._engine.begin() as connection:
+                connection.execute(
+                    insert(table)
+                    .values(key=key, **values)
+                    .on_conflict_do_update(index_elements=["key"], set_=values)
+                )
+                self._writes += 1
+                if self._writes >= self._check_interval:
+                    self._writes = 0
+                    self._evict(connection)
+        except SQLAlchemyError as e:
+            print(f"Failed to write to the extraction cache: {e}")
+
+    def _evict(self, connection: Any) -> None:
+        from sqlalchemy import delete, func, select
+
+        table = self._table
+        size = connection.scalar(select(func.count()).select_from(table)) or 0
+        if size <= self.max_entries:
+            return
+        excess = size - self.max_entries
+        excess += int(self.max_entries * EVICTION_MARGIN)
+        connection.execute(
+            delete(table).where(
+                table.c.key.in_(
+                    select(table.c.key).order_by(table.c.read_at).limit(excess)
+                )
+            )
+        )
+
+    def clear(self) -> None:
+        from sqlalchemy import delete
+
+        with self._write_lock, self._engine.begin() as connection:
+            connection.execute(delete(self._table))
+
+    def __len__(self) -> int:
+        from sqlalchemy import func, select
+
+        with self._engine.connect() as connection:
+            return (
+                connection.scalar(
+                    select(func.count()).select_from(self._table)
+                )
+                or 0
+            )
+
+    def close(self) -> None:
+        self._engine.dispose()
+
+
+def extraction_cache_from_env() -> Optional[ExtractionCacheBackend]:
+    """
+    Builds the extraction cache configured by the NB_EXTRACTION_CACHE_URL
+    and NB_EXTRACTION_CACHE_SIZE environment variables.
+
+    Returns:
+        Optional[ExtractionCacheBackend]: The cache, or None if disabled.
+    """
+    url = os.getenv("NB_EXTRACTION_CACHE_URL")
+    max_entries = int(
+        os.getenv("NB_EXTRACTION_CACHE_SIZE", DEFAULT_MAX_ENTRIES)
+    )
+    if not url or max_entries <= 0:
+        return None
+    return SQLiteExtractionCache(url, max_entries=max_entries)
@@ -1,9 +1,55 @@
-from langchain_community.chat_models import ChatOllama
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from contextlib import aclosing, nullcontext
+from langchain_core.exceptions import OutputParserException
+from langchain_core.language_models import BaseChatModel
 from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import PromptTemplate
-from typing import Optional, Union
-from tenacity import retry, stop_after_attempt
+from typing import (
+    Any,
+    AsyncContextManager,
+    AsyncGenerator,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
+from starlette.concurrency import run_in_threadpool
+from tenacity import AsyncRetrying, Retrying
+from app.admission import (
+    BATCH,
+    INTERACTIVE,
+    MAX_CONCURRENCY,
+    AdmissionController,
+    admission_controller,
+)
+from app.deadline import RequestBudget, current_budget
+from app.llm_processing.chat_ollama import OllamaTokenUsage, PooledChatOllama
+from app.llm_processing.extraction_cache import (
+    ExtractionCacheBackend,
+    extraction_cache_from_env,
+    extraction_cache_key,
+)
+from app.llm_processing.ollama_pool import OllamaPool, get_ollama_pool
+from app.llm_processing.template_cache import (
+    TemplateCache,
+    template_cache_from_env,
+)
+from app.metrics import stage
+from app.llm_processing.rule_extractor import (
+    RuleExtraction,
+    coverage_stats,
+    extract_with_rules,
+    is_empty,
+    merge_extractions,
+)
 
 
 class Parameters(BaseModel):
@@ -49,91 +95,599 @@ class Parameters(BaseModel):
     image_modal: Optional[str] = Field(description="image modal", default=None)
 
 
-@retry(stop=stop_after_attempt(3))
-def extract_information(context: str) -> Optional[Union[dict, str, None]]:
+PROMPT_TEMPLATE = "Just extract the information as specified.\n{format_instructions}\n{context}\nIf not mentioned, put null."
+
+# Output formats where Ollama constrains the generation to valid JSON
+OUTPUT_FORMATS = ("json", "schema")
+
+# Token budget of the compact prompt: the answer is a flat JSON object of
+# nine short fields, and the prompt is a few hundred tokens at most
+COMPACT_NUM_PREDICT = 256
+COMPACT_NUM_CTX = 1024
+
+
+def compact_prompt() -> PromptTemplate:
     """
-    Extract information using LangChain pipeline with retry mechanism.
+    Builds a prompt listing the fields to extract by name and description,
+    instead of the full JSON schema of Parameters.
+
+    Returns:
+        PromptTemplate: A prompt with a single `context` input variable.
+    """
+    fields = ", ".join(
+        f"{name} ({field.field_info.description})"
+        for name, field in Parameters.__fields__.items()
+    )
+    return PromptTemplate(
+        template="Extract these fields from the query as a JSON object: {fields}. Use null for fields not mentioned.\nQuery: {context}\n",
+        input_variables=["context"],
+        partial_variables={"fields": fields},
+    )
+
+
+def format_response(response: dict) -> dict:
+    """
+    Post-processes a raw extraction into the shape expected downstream.
 
     Args:
-        context (str): Input context from which information is to be extracted.
+        response (dict): Raw extraction structured according to Parameters schema.
 
     Returns:
-        dict or str: Extracted information structured according to Parameters schema,
-                    or error message if validation fails.
+        dict: The extracted parameters in Parameters order, without empty values,
+              with numeric fields cast and free-text fields lowercased.
     """
+    # Ensure the order of keys matches the Parameters model
+    ordered_response = {
+        field: response.get(field, None)
+        for field in Parameters.__fields__.keys()
+    }
 
-    # Return empty dictionary if context is empty string
-    if context == "":
-        return {}
+    # Filter out keys where the value is None or 'None' (string)
+    filtered_ordered_response = {
+        k: (
+            float(v)
+            if k in ["min_age", "max_age"] and v is not None
+            else (
+                int(v)
+                if k
+                in [
+                    "min_num_phenotypic_sessions",
+                    "min_num_imaging_sessions",
+                ]
+                and v is not None
+                else (
+                    v.lower()
+                    if isinstance(v, str)
+                    and k in ["diagnosis", "assessment", "image_modal", "sex"]
+                    else v
+                )
+            )
+        )
+        for k, v in ordered_response.items()
+        if v is not None and v != "None"
+    }
 
-    # Initialize LLM (ChatOllama)
-    llm = ChatOllama(model="mistral")
+    if "diagnosis" in filtered_ordered_response:
+        if "is_control" not in filtered_ordered_response:
+            filtered_ordered_response["is_control"] = False
 
-    # Initialize JSON output parser
-    parser = JsonOutputParser(pydantic_object=Parameters)
+    return filtered_ordered_response
 
-    # Define prompt template
-    prompt = PromptTemplate(
-        template="Just extract the information as specified.\n{format_instructions}\n{context}\nIf not mentioned, put null.",
-        input_variables=["context"],
-        partial_variables={
-            "format_instructions": parser.get_format_instructions()
-        },
-    )
 
-    try:
-        # Create extraction chain
-        chain = prompt | llm | parser
+class ExtractionEngine:
+    """
+    Long-lived LangChain extraction pipeline shared by every request.
 
-        # Invoke chain with provided context
-        response = chain.invoke({"context": context})
+    The LLM client, output parser, prompt (with its format instructions
+    rendered once) and the composed chain are built when the engine is
+    created and reused for every extraction. LangChain runnables keep no
+    per-call state, so a single engine can be used from several threads.
+    """
 
-        # Ensure the order of keys matches the Parameters model
-        ordered_response = {
-            field: response.get(field, None)
-            for field in Parameters.__fields__.keys()
-        }
+    def __init__(
+        self,
+        model: str = "mistral",
+        base_url: Optional[str] = None,
+        llm: Optional[BaseChatModel] = None,
+        rule_fast_path: bool = True,
+        output_format: Optional[str] = None,
+        pool: Optional[OllamaPool] = None,
+        admission: Optional[AdmissionController] = None,
+        cache: Optional[ExtractionCacheBackend] = None,
+        template_cache: Optional[TemplateCache] = None,
+        **options: Any,
+    ):
+        """
+        Builds the extraction chain.
 
-        # Filter out keys where the value is None or 'None' (string)
-        filtered_ordered_response = {
-            k: (
-                float(v)
-                if k in ["min_age", "max_age"] and v is not None
-                else (
-                    int(v)
-                    if k
-                    in [
-                        "min_num_phenotypic_sessions",
-                        "min_num_imaging_sessions",
-                    ]
-                    and v is not None
-                    else (
-                        v.lower()
-                        if isinstance(v, str)
-                        and k
-                        in ["diagnosis", "assessment", "image_modal", "sex"]
-                        else v
-                    )
+        Args:
+            model (str): Name of the Ollama model.
+            base_url (Optional[str]): Base URL of the Ollama server, defaults to the local one.
+            llm (Optional[BaseChatModel]): Chat model to use instead of an Ollama client.
+            rule_fast_path (bool): Extract the numeric, sex and control fields with
+                patterns first, and only send what they do not cover to the LLM.
+            output_format (Optional[str]): "json" to have Ollama generate valid JSON,
+                or "schema" to constrain it to the Parameters JSON schema (Ollama
+                0.5 and later). Both use a compact prompt and cap the predicted
+                tokens and the context window. None sends the full format
+                instructions and lets the model generate freely.
+            pool (Optional[OllamaPool]): Ollama servers to spread the generations
+                across, instead of sending them all to `base_url`.
+            admission (Optional[AdmissionController]): Bounds the async LLM calls in
+                flight, queueing single extractions in the interactive lane and
+                batches in the batch lane.
+            cache (Optional[ExtractionCacheBackend]): Where to keep the extractions
+                made by the LLM, keyed on the normalized context, the model and
+                the prompt hash.
+            template_cache (Optional[TemplateCache]): Where to keep the extractions
+                made by the LLM by query template, to serve queries that only
+                differ in their numbers. Must not be shared with another engine.
+            **options: Additional ChatOllama options (e.g. temperature, num_ctx, keep_alive).
+        """
+        if output_format is not None and output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+
+        if llm is None:
+            if base_url:
+                options["base_url"] = base_url
+            if output_format is not None:
+                options.setdefault(
+                    "format",
+                    (
+                        Parameters.schema()
+                        if output_format == "schema"
+                        else "json"
+                    ),
                 )
+                options.setdefault("num_predict", COMPACT_NUM_PREDICT)
+                options.setdefault("num_ctx", COMPACT_NUM_CTX)
+            llm = PooledChatOllama(pool=pool, model=model, **options)
+
+        self.model = model
+        self.llm = llm
+        self.rule_fast_path = rule_fast_path
+        self.output_format = output_format
+        self.admission = admission
+        self.parser = JsonOutputParser(pydantic_object=Parameters)
+        if output_format is None:
+            self.prompt = PromptTemplate(
+                template=PROMPT_TEMPLATE,
+                input_variables=["context"],
+                partial_variables={
+                    "format_instructions": self.parser.get_format_instructions()
+                },
             )
-            for k, v in ordered_response.items()
-            if v is not None and v != "None"
-        }
+        else:
+            self.prompt = compact_prompt()
+        self.chain = (self.prompt | self.llm | self.parser).with_config(
+            callbacks=[OllamaTokenUsage()]
+        )
+        self.cache = cache
+        self.template_cache = template_cache
+        self.prompt_hash = self._hash_prompt()
 
-        if "diagnosis" in filtered_ordered_response:
-            if "is_control" not in filtered_ordered_response:
-                filtered_ordered_response["is_control"] = False
+    def extract(self, context: str) -> dict:
+        """
+        Extracts the query parameters from the given context.
 
-        # Return the filtered ordered information as a dictionary
-        return filtered_ordered_response
+        Args:
+            context (str): Input context from which information is to be extracted.
 
-    except Exception:
-        raise  # This will trigger the retry
+        Returns:
+            dict: Extracted information structured according to Parameters schema.
+        """
+        # Return empty dictionary if context is empty string
+        if context == "":
+            return {}
 
-    print(
-        "Sorry the model failed to understand the query. Could you be more precise?"
-    )
-    return {}
+        rule_extraction = self.extract_with_rules(context)
+        if rule_extraction.covered:
+            return format_response(rule_extraction.parameters)
+
+        cached = self._cache_get(context)
+        if cached is not None:
+            return cached
+
+        with stage("llm"):
+            response = self.chain.invoke({"context": context})
+        extraction = format_response(
+            merge_extractions(rule_extraction.parameters, response)
+        )
+        self._cache_set(context, extraction)
+        return extraction
+
+    async def aextract(self, context: str) -> dict:
+        """
+        Async version of `extract`, awaiting the LLM without blocking the
+        event loop.
+
+        Args:
+            context (str): Input context from which information is to be extracted.
+
+        Returns:
+            dict: Extracted information structured according to Parameters schema.
+        """
+        if context == "":
+            return {}
+
+        rule_extraction = self.extract_with_rules(context)
+        if rule_extraction.covered:
+            return format_response(rule_extraction.parameters)
+
+        cached = await self._acache_get(context)
+        if cached is not None:
+            return cached
+
+        async with self._admit(INTERACTIVE):
+            with stage("llm"):
+                response = await self.chain.ainvoke({"context": context})
+        extraction = format_response(
+            merge_extractions(rule_extraction.parameters, response)
+        )
+        await self._acache_set(context, extraction)
+        return extraction
+
+    async def awarm_up(self, context: str) -> dict:
+        """
+        Runs the context through the LLM alone, so that the model and the
+        JSON parsing are exercised on every start.
+
+        Unlike `aextract`, the fast path and the extraction caches are
+        skipped, so nothing is read from or stored in them and their metrics
+        are left untouched.
+
+        Args:
+            context (str): Input context from which information is to be extracted.
+
+        Returns:
+            dict: Extracted information structured according to Parameters schema.
+        """
+        response = await self.chain.ainvoke({"context": context})
+        return format_response(response)
+
+    async def astream_extract(
+        self, context: str
+    ) -> AsyncGenerator[Tuple[str, Any], None]:
+        """
+        Streams the raw value of each field as soon as it is fully decoded.
+
+        A query covered by the fast path is answered by its fields alone.
+        Otherwise, the LLM output is parsed as partial JSON while it is
+        generated, and each field is yielded once the LLM has moved on to the
+        next one. The fields recognized by the fast path follow, for those
+        the LLM left empty. Closing the stream stops the generation.
+
+        Args:
+            context (str): Input context from which information is to be extracted.
+
+        Yields:
+            Tuple[str, Any]: The name and raw value of each extracted field,
+            as passed to `format_response`.
+        """
+        if context == "":
+            return
+
+        rule_extraction = self.extract_with_rules(context)
+        rule_parameters = rule_extraction.parameters
+        if rule_extraction.covered:
+            for field, value in rule_parameters.items():
+                yield field, value
+            return
+
+        cached = await self._acache_get(context)
+        if cached is not None:
+            for field, value in cached.items():
+                yield field, value
+            return
+
+        def pending(field: str, value: Any) -> bool:
+            # Empty fields the rules recognized are yielded at the end
+            return (
+                field in Parameters.__fields__
+                and field not in emitted
+                and not (is_empty(value) and field in rule_parameters)
+            )
+
+        emitted: Set[str] = set()
+        latest: Optional[dict] = None
+        # The chain streams through an async generator, which aclosing needs
+        stream = cast(
+            AsyncGenerator[Any, None],
+            self.chain.astream({"context": context}),
+        )
+        async with self._admit(INTERACTIVE), aclosing(stream):
+            async for partial in stream:
+                if not isinstance(partial, dict):
+                    continue
+                latest = partial
+                # Every field but the last one is complete
+                for field in list(partial)[:-1]:
+                    if pending(field, partial[field]):
+                        emitted.add(field)
+                        yield field, partial[field]
+
+        if latest is None:
+            raise OutputParserException("Invalid json output from the LLM")
+        for field, value in latest.items():
+            if pending(field, value):
+                emitted.add(field)
+                yield field, value
+        for field, value in rule_parameters.items():
+            if field not in emitted:
+                yield field, value
+        await self._acache_set(
+            context,
+            format_response(merge_extractions(rule_parameters, latest)),
+        )
+
+    async def aextract_batch(
+        self, contexts: List[str], max_concurrency: int = 4
+    ) -> List[Union[dict, Exception]]:
+        """
+        Extracts the query parameters of many contexts, sending the ones the
+        fast path does not cover to the LLM with bounded concurrency, in the
+        batch lane of the admission controller.
+
+        Args:
+            contexts (List[str]): Input contexts from which information is to be extracted.
+            max_concurrency (int): Maximum number of LLM calls in flight.
+
+        Returns:
+            List[Union[dict, Exception]]: The extracted information of each context,
+            in order, or the exception raised while extracting it.
+        """
+        results: List[Union[dict, Exception]] = [{} for _ in contexts]
+        pending = []
+        for position, context in enumerate(contexts):
+            if context == "":
+                continue
+            rule_extraction = self.extract_with_rules(context)
+            if rule_extraction.covered:
+                results[position] = format_response(rule_extraction.parameters)
+            else:
+                pending.append((position, context, rule_extraction))
+
+        if pending and self._caching:
+            cached = await run_in_threadpool(
+                lambda: [self._cache_get(context) for _, context, _ in pending]
+            )
+            for (position, _, _), extraction in zip(pending, cached):
+                if extraction is not None:
+                    results[position] = extraction
+            pending = [
+                item
+                for item, extraction in zip(pending, cached)
+                if extraction is None
+            ]
+
+        if pending:
+            semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+            async def invoke(context: str):
+                async with semaphore, self._admit(BATCH):
+                    return await self.chain.ainvoke({"context": context})
+
+            with stage("llm"):
+                responses = await asyncio.gather(
+                    *(invoke(context) for _, context, _ in pending),
+                    return_exceptions=True,
+                )
+            for (position, _, rule_extraction), response in zip(
+                pending, responses
+            ):
+                if isinstance(response, BaseException):
+                    if not isinstance(response, Exception):
+                        raise response
+                    results[position] = response
+                    continue
+                try:
+                    results[position] = format_response(
+                        merge_extractions(rule_extraction.parameters, response)
+                    )
+                except Exception as e:
+                    results[position] = e
+            if self._caching:
+                extractions = []
+                for position, context, _ in pending:
+                    result = results[position]
+                    if isinstance(result, dict):
+                        extractions.append((context, result))
+                await run_in_threadpool(self._cache_set_many, extractions)
+        return results
+
+    def extract_with_rules(self, context: str) -> RuleExtraction:
+        """
+        Runs the pattern-based fast path on the context, if it is enabled.
+
+        Args:
+            context (str): Input context from which information is to be extracted.
+
+        Returns:
+            RuleExtraction: The fields recognized by the patterns.
+        """
+        if not self.rule_fast_path:
+            return RuleExtraction()
+        with stage("rules"):
+            rule_extraction = extract_with_rules(context)
+        coverage_stats.record(rule_extraction)
+        return rule_extraction
+
+    def _hash_prompt(self) -> str:
+        # Changes whenever the prompt, or what is sent to the LLM, changes
+        prompt = json.dumps(
+            [
+                self.prompt.template,
+                self.prompt.partial_variables,
+                self.output_format,
+                self.rule_fast_path,
+            ],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    @property
+    def _caching(self) -> bool:
+        return self.cache is not None or self.template_cache is not None
+
+    def _cache_get(self, context: str) -> Optional[Dict[str, Any]]:
+        extraction = None
+        if self.cache is not None:
+            extraction = self.cache.get(
+                extraction_cache_key(context, self.model, self.prompt_hash)
+            )
+        if extraction is None and self.template_cache is not None:
+            extraction = self.template_cache.get(context)
+        return extraction
+
+    def _cache_set(self, context: str, extraction: Dict[str, Any]) -> None:
+        if self.cache is not None:
+            self.cache.set(
+                extraction_cache_key(context, self.model, self.prompt_hash),
+                extraction,
+            )
+        if self.template_cache is not None:
+            self.template_cache.set(context, extraction)
+
+    def _cache_set_many(
+        self, extractions: List[Tuple[str, Dict[str, Any]]]
+    ) -> None:
+        for context, extraction in extractions:
+            self._cache_set(context, extraction)
+
+    async def _acache_get(self, context: str) -> Optional[Dict[str, Any]]:
+        if self.cache is None:
+            # The template cache is in memory
+            return self._cache_get(context)
+        return await run_in_threadpool(self._cache_get, context)
+
+    async def _acache_set(
+        self, context: str, extraction: Dict[str, Any]
+    ) -> None:
+        if self.cache is None:
+            self._cache_set(context, extraction)
+        else:
+            await run_in_threadpool(self._cache_set, context, extraction)
+
+    def _admit(self, lane: str) -> AsyncContextManager[Any]:
+        if self.admission is None:
+            return nullcontext()
+        return self.admission.admit(lane)
+
+    def close(self) -> None:
+        """
+        Releases the connections held by the LLM client.
+        """
+        if isinstance(self.llm, PooledChatOllama):
+            self.llm.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+_engine: Optional[ExtractionEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_extraction_engine() -> ExtractionEngine:
+    """
+    Returns the process-wide extraction engine, building it on first use.
+
+    The engine is configured from the OLLAMA_MODEL, OLLAMA_OPTIONS (JSON
+    object of ChatOllama options), NB_MODEL_KEEP_ALIVE, NB_RULE_FAST_PATH
+    and NB_LLM_OUTPUT_FORMAT environment variables, and sends generations
+    to the shared pool of Ollama backends (see get_ollama_pool) through the
+    shared admission controller, unless NB_LLM_MAX_CONCURRENCY is 0. The
+    extractions are cached as configured by NB_EXTRACTION_CACHE_URL (see
+    extraction_cache_from_env), and by query template as configured by
+    NB_TEMPLATE_CACHE_SIZE (see template_cache_from_env).
+
+    Returns:
+        ExtractionEngine: The shared extraction engine.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                pool = get_ollama_pool()
+                _engine = ExtractionEngine(
+                    model=os.getenv("OLLAMA_MODEL", "mistral"),
+                    base_url=pool.backends[0].base_url,
+                    rule_fast_path=os.getenv(
+                        "NB_RULE_FAST_PATH", "true"
+                    ).lower()
+                    != "false",
+                    output_format=os.getenv("NB_LLM_OUTPUT_FORMAT") or None,
+                    pool=pool,
+                    admission=(
+                        admission_controller if MAX_CONCURRENCY > 0 else None
+                    ),
+                    cache=extraction_cache_from_env(),
+                    template_cache=template_cache_from_env(),
+                    **{
+                        "keep_alive": os.getenv("NB_MODEL_KEEP_ALIVE", "1h"),
+                        **json.loads(os.getenv("OLLAMA_OPTIONS", "{}")),
+                    },
+                )
+    return _engine
+
+
+def set_extraction_engine(engine: Optional[ExtractionEngine]) -> None:
+    """
+    Replaces the process-wide extraction engine.
+
+    Args:
+        engine (Optional[ExtractionEngine]): The new engine, or None to rebuild it
+            from the environment on next use.
+    """
+    global _engine
+    with _engine_lock:
+        previous, _engine = _engine, engine
+    if previous is not None and previous is not engine:
+        previous.close()
+
+
+def extract_information(context: str) -> Optional[Union[dict, str, None]]:
+    """
+    Extract information using LangChain pipeline with retry mechanism.
+
+    Retries draw from the budget of the current request (see app.deadline),
+    with jittered exponential backoff. Outside of a request, up to the
+    default number of retries are made without a deadline.
+
+    Args:
+        context (str): Input context from which information is to be extracted.
+
+    Returns:
+        dict or str: Extracted information structured according to Parameters schema,
+                    or error message if validation fails.
+    """
+    budget = current_budget() or RequestBudget(timeout=None)
+    for attempt in Retrying(**budget.retry_policy()):
+        with attempt:
+            budget.check()
+            return get_extraction_engine().extract(context)
+    return None
+
+
+async def aextract_information(
+    context: str,
+) -> Optional[Union[dict, str, None]]:
+    """
+    Async version of `extract_information`. The LLM call is cancelled as
+    soon as the deadline of the current request is reached.
+
+    Args:
+        context (str): Input context from which information is to be extracted.
+
+    Returns:
+        dict or str: Extracted information structured according to Parameters schema,
+                    or error message if validation fails.
+    """
+    budget = current_budget() or RequestBudget(timeout=None)
+    async for attempt in AsyncRetrying(**budget.retry_policy()):
+        with attempt:
+            return await budget.run(get_extraction_engine().aextract(context))
+    return None
 
 
 def main():
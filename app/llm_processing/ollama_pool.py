@@ -0,0 +1,369 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import aclosing
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TypeVar,
+)
+from app import http_client
+from app.metrics import registry
+
+T = TypeVar("T")
+
+DEFAULT_BASE_URL = "http://localhost:11434"
+
+HEALTH_INTERVAL = float(os.getenv("NB_OLLAMA_HEALTH_INTERVAL", 10))
+FAILURE_THRESHOLD = int(os.getenv("NB_OLLAMA_FAILURE_THRESHOLD", 3))
+EJECTION_SECONDS = float(os.getenv("NB_OLLAMA_EJECTION_SECONDS", 30))
+# Seconds a health check may take before the backend is considered down
+HEALTH_TIMEOUT = 5.0
+# Weight of the latest request in the moving average of the latency
+LATENCY_SMOOTHING = 0.2
+
+ollama_requests = registry.counter(
+    "nb_ollama_requests_total",
+    "Requests sent to each Ollama backend, by outcome (ok or error).",
+    labelnames=("backend", "outcome"),
+)
+ollama_request_duration = registry.histogram(
+    "nb_ollama_request_duration_seconds",
+    "Time for each Ollama backend to complete a generation.",
+    labelnames=("backend",),
+)
+
+
+class OllamaBackend:
+    """
+    An Ollama server of the pool, with its load, health and latency.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        # Consecutive failed requests, reset by any success
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.latency_average = 0.0
+
+    def available(self, now: float) -> bool:
+        """
+        Whether the backend may be sent requests: it is healthy, or its
+        ejection has ended and it is given another chance.
+        """
+        return self.healthy or now >= self.ejected_until
+
+    def stats(self) -> Dict[str, Any]:
+        completed = self.requests - self.errors
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "mean_latency": (
+                round(self.latency_total / completed, 3) if completed else None
+            ),
+            "moving_average_latency": (
+                round(self.latency_average, 3) if completed else None
+            ),
+        }
+
+
+class OllamaPool:
+    """
+    Routes LLM requests across several Ollama servers.
+
+    Each request goes to the available backend with the fewest requests in
+    flight, the fastest one on a tie. A backend is ejected for
+    `ejection_seconds` after `failure_threshold` consecutive failed requests
+    or a failed health check, and re-admitted by a successful health check
+    or, once its ejection has ended, a successful request. When every
+    backend is ejected, requests go to the one whose ejection ends first
+    rather than failing outright.
+    """
+
+    def __init__(
+        self,
+        base_urls: Sequence[str],
+        model: Optional[str] = None,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        ejection_seconds: float = EJECTION_SECONDS,
+    ):
+        """
+        Args:
+            base_urls (Sequence[str]): The base URLs of the Ollama servers.
+            model (Optional[str]): A model that healthy backends must have
+                pulled, if any.
+            failure_threshold (int): Consecutive failures ejecting a backend.
+            ejection_seconds (float): How long an ejected backend is left out.
+        """
+        if not base_urls:
+            raise ValueError("An Ollama pool needs at least one backend")
+        self.backends = [OllamaBackend(base_url) for base_url in base_urls]
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.ejection_seconds = ejection_seconds
+        self._lock = threading.Lock()
+
+    def acquire(self) -> OllamaBackend:
+        """
+        Picks the backend of the next request and counts the request as
+        outstanding on it, until it is passed to `release`.
+
+        Returns:
+            OllamaBackend: The least loaded available backend.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                backend for backend in self.backends if backend.available(now)
+            ] or [min(self.backends, key=lambda b: b.ejected_until)]
+            backend = min(
+                candidates, key=lambda b: (b.outstanding, b.latency_average)
+            )
+            backend.outstanding += 1
+        return backend
+
+    def release(
+        self,
+        backend: OllamaBackend,
+        elapsed: float,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """
+        Records the outcome of a request sent to a backend.
+
+        Args:
+            backend (OllamaBackend): The backend returned by `acquire`.
+            elapsed (float): Seconds the request took.
+            error (Optional[BaseException]): The error of a failed request.
+        """
+        with self._lock:
+            backend.outstanding -= 1
+            backend.requests += 1
+            if error is None:
+                backend.failures = 0
+                backend.healthy = True
+                backend.latency_total += elapsed
+                backend.latency_average = (
+                    elapsed
+                    if backend.requests - backend.errors == 1
+                    else LATENCY_SMOOTHING * elapsed
+                    + (1 - LATENCY_SMOOTHING) * backend.latency_average
+                )
+            else:
+                backend.errors += 1
+                backend.failures += 1
+                if backend.failures >= self.failure_threshold:
+                    self._eject(backend)
+        if error is None:
+            ollama_requests.inc(backend=backend.base_url, outcome="ok")
+            ollama_request_duration.observe(elapsed, backend=backend.base_url)
+        else:
+            ollama_requests.inc(backend=backend.base_url, outcome="error")
+            print(f"Ollama backend {backend.base_url} failed: {error}")
+
+    def stream(self, open_stream: Callable[[str], Iterator[T]]) -> Iterator[T]:
+        """
+        Sends a streamed request to the next backend, which counts as
+        outstanding until the stream is exhausted or closed.
+
+        Args:
+            open_stream (Callable[[str], Iterator[T]]): Sends the request to
+                the given base URL.
+
+        Yields:
+            T: The items of the stream.
+        """
+        backend = self.acquire()
+        start = time.perf_counter()
+        try:
+            yield from open_stream(backend.base_url)
+        except Exception as e:
+            self.release(backend, time.perf_counter() - start, e)
+            raise
+        except BaseException:
+            # Closed by the caller, the backend is not to blame
+            self._abandon(backend)
+            raise
+        self.release(backend, time.perf_counter() - start)
+
+    async def astream(
+        self, open_stream: Callable[[str], AsyncGenerator[T, None]]
+    ) -> AsyncGenerator[T, None]:
+        """
+        Async version of `stream`.
+
+        Args:
+            open_stream (Callable[[str], AsyncGenerator[T, None]]): Sends the
+                request to the given base URL.
+
+        Yields:
+            T: The items of the stream.
+        """
+        backend = self.acquire()
+        start = time.perf_counter()
+        try:
+            async with aclosing(open_stream(backend.base_url)) as stream:
+                async for item in stream:
+                    yield item
+        except Exception as e:
+            self.release(backend, time.perf_counter() - start, e)
+            raise
+        except BaseException:
+            self._abandon(backend)
+            raise
+        self.release(backend, time.perf_counter() - start)
+
+    async def check(self, backend: OllamaBackend) -> bool:
+        """
+        Checks that a backend answers, and has the model of the pool, by
+        listing its models. A failed check ejects the backend, a successful
+        one re-admits it.
+
+        Args:
+            backend (OllamaBackend): The backend to check.
+
+        Returns:
+            bool: Whether the backend is healthy.
+        """
+        try:
+            response = await http_client.aget(
+                f"{backend.base_url}/api/tags", timeout=HEALTH_TIMEOUT
+            )
+            response.raise_for_status()
+            healthy = self.model is None or self._has_model(
+                response.json(), self.model
+            )
+        except Exception as e:
+            print(f"Health check of Ollama backend {backend.base_url}: {e}")
+            healthy = False
+        with self._lock:
+            if healthy:
+                backend.healthy = True
+                backend.failures = 0
+            elif backend.healthy or time.monotonic() >= backend.ejected_until:
+                self._eject(backend)
+        return healthy
+
+    async def check_all(self) -> List[bool]:
+        """
+        Checks every backend concurrently.
+
+        Returns:
+            List[bool]: Whether each backend is healthy.
+        """
+        return list(
+            await asyncio.gather(
+                *(self.check(backend) for backend in self.backends)
+            )
+        )
+
+    async def run_health_checks(
+        self, interval: float = HEALTH_INTERVAL
+    ) -> None:
+        """
+        Checks every backend every `interval` seconds, until cancelled.
+
+        Args:
+            interval (float): Seconds between two rounds of checks.
+        """
+        while True:
+            await self.check_all()
+            await asyncio.sleep(interval)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """
+        Returns the load, health and latency of every backend.
+        """
+        with self._lock:
+            return [backend.stats() for backend in self.backends]
+
+    def _eject(self, backend: OllamaBackend) -> None:
+        # Called with the lock held
+        backend.healthy = False
+        backend.ejected_until = time.monotonic() + self.ejection_seconds
+
+    def _abandon(self, backend: OllamaBackend) -> None:
+        with self._lock:
+            backend.outstanding -= 1
+
+    def _has_model(self, tags: Dict[str, Any], model: str) -> bool:
+        # Models are listed with their tag, e.g. "mistral:latest"
+        names = {listed.get("name") for listed in tags.get("models", [])}
+        wanted = model if ":" in model else f"{model}:latest"
+        return model in names or wanted in names
+
+
+_pool: Optional[OllamaPool] = None
+_pool_lock = threading.Lock()
+
+
+def ollama_base_urls() -> List[str]:
+    """
+    Returns the base URLs of the Ollama servers, from the comma-separated
+    OLLAMA_BASE_URLS, or else OLLAMA_BASE_URL, environment variables.
+
+    Returns:
+        List[str]: The base URLs, the local server by default.
+    """
+    base_urls = os.getenv("OLLAMA_BASE_URLS") or os.getenv("OLLAMA_BASE_URL")
+    return [
+        base_url.strip()
+        for base_url in (base_urls or DEFAULT_BASE_URL).split(",")
+        if base_url.strip()
+    ]
+
+
+def get_ollama_pool() -> OllamaPool:
+    """
+    Returns the process-wide pool of Ollama backends, building it from the
+    environment on first use.
+
+    Returns:
+        OllamaPool: The shared pool.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = OllamaPool(
+                    ollama_base_urls(), model=os.getenv("OLLAMA_MODEL")
+                )
+    return _pool
+
+
+def _backend_samples(attribute: str) -> List[Any]:
+    if _pool is None:
+        return []
+    return [
+        ({"backend": stats["base_url"]}, float(stats[attribute]))
+        for stats in _pool.snapshot()
+    ]
+
+
+registry.register_callback(
+    "nb_ollama_backend_outstanding",
+    "Requests in flight on each Ollama backend.",
+    "gauge",
+    lambda: _backend_samples("outstanding"),
+)
+registry.register_callback(
+    "nb_ollama_backend_healthy",
+    "Whether each Ollama backend receives requests (1) or is ejected (0).",
+    "gauge",
+    lambda: _backend_samples("healthy"),
+)
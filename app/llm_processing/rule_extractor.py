@@ -0,0 +1,310 @@
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Pattern, Tuple
+from app.metrics import registry
+
+_NUMBER_WORDS = {
+    "one": "1",
+    "two": "2",
+    "three": "3",
+    "four": "4",
+    "five": "5",
+    "six": "6",
+    "seven": "7",
+    "eight": "8",
+    "nine": "9",
+    "ten": "10",
+}
+_NUMBER = r"(\d+(?:\.\d+)?|" + "|".join(_NUMBER_WORDS) + r")"
+_AGE_UNIT = r"(?:years?|yrs?\.?|y/?o)(?:\s+(?:old|of\s+age))?"
+_NOT_SESSIONS = r"(?!\s*(?:imaging|phenotypic|sessions?|\.\d))"
+
+# Each rule maps a pattern to the Parameters fields filled by its groups
+_RULES: List[Tuple[Pattern[str], Tuple[str, ...]]] = [
+    (
+        re.compile(
+            rf"\b(?:at\s+least\s+|a\s+minimum\s+of\s+|min(?:imum)?\s+(?:of\s+)?)?{_NUMBER}\s+imaging\s+sessions?\b"
+        ),
+        ("min_num_imaging_sessions",),
+    ),
+    (
+        re.compile(
+            rf"\b(?:at\s+least\s+|a\s+minimum\s+of\s+|min(?:imum)?\s+(?:of\s+)?)?{_NUMBER}\s+phenotypic\s+sessions?\b"
+        ),
+        ("min_num_phenotypic_sessions",),
+    ),
+    (
+        re.compile(
+            rf"\b(?:aged?s?\s+)?(?:between|from)\s+{_NUMBER}\s*(?:and|to|-)\s*{_NUMBER}\s*{_AGE_UNIT}"
+        ),
+        ("min_age", "max_age"),
+    ),
+    (
+        re.compile(
+            rf"\baged?s?\s+(?:between\s+|from\s+)?{_NUMBER}\s*(?:and|to|-)\s*{_NUMBER}(?:\s*{_AGE_UNIT})?{_NOT_SESSIONS}"
+        ),
+        ("min_age", "max_age"),
+    ),
+    (
+        re.compile(rf"\b{_NUMBER}\s*(?:to|-)\s*{_NUMBER}\s*{_AGE_UNIT}"),
+        ("min_age", "max_age"),
+    ),
+    (
+        re.compile(
+            rf"\bmin(?:imum)?\.?\s+age\s*(?:of|is|=|:)?\s*{_NUMBER}(?:\s*{_AGE_UNIT})?"
+        ),
+        ("min_age",),
+    ),
+    (
+        re.compile(
+            rf"\bmax(?:imum)?\.?\s+age\s*(?:of|is|=|:)?\s*{_NUMBER}(?:\s*{_AGE_UNIT})?"
+        ),
+        ("max_age",),
+    ),
+    # Bare comparatives only bound the age next to an age word or unit, so
+    # that e.g. "IQ over 100" is left to the LLM
+    (
+        re.compile(
+            rf"\baged?\s+(?:over|above|older\s+than|at\s+least)\s+{_NUMBER}(?:\s*{_AGE_UNIT})?{_NOT_SESSIONS}"
+            rf"|\b(?:over|above|at\s+least)\s+{_NUMBER}\s*{_AGE_UNIT}"
+            rf"|\bolder\s+than\s+{_NUMBER}(?:\s*{_AGE_UNIT})?{_NOT_SESSIONS}"
+        ),
+        ("min_age",),
+    ),
+    (
+        re.compile(
+            rf"\baged?\s+{_NUMBER}\s*(?:{_AGE_UNIT}\s*)?(?:and|or)\s+(?:over|above|older)\b"
+            rf"|\b{_NUMBER}\s*{_AGE_UNIT}\s*(?:and|or)\s+(?:over|above|older)\b"
+            rf"|\b{_NUMBER}\s*(?:and|or)\s+older\b"
+        ),
+        ("min_age",),
+    ),
+    (
+        re.compile(
+            rf"\baged?\s+(?:under|below|younger\s+than|at\s+most|up\s+to)\s+{_NUMBER}(?:\s*{_AGE_UNIT})?{_NOT_SESSIONS}"
+            rf"|\b(?:under|below|at\s+most|up\s+to)\s+{_NUMBER}\s*{_AGE_UNIT}"
+            rf"|\byounger\s+than\s+{_NUMBER}(?:\s*{_AGE_UNIT})?{_NOT_SESSIONS}"
+        ),
+        ("max_age",),
+    ),
+    (
+        re.compile(
+            rf"\baged?\s+{_NUMBER}\s*(?:{_AGE_UNIT}\s*)?(?:and|or)\s+(?:under|below|younger)\b"
+            rf"|\b{_NUMBER}\s*{_AGE_UNIT}\s*(?:and|or)\s+(?:under|below|younger)\b"
+            rf"|\b{_NUMBER}\s*(?:and|or)\s+younger\b"
+        ),
+        ("max_age",),
+    ),
+]
+# A match within a few words after a negation, e.g. "not male" or "no more
+# than 2 imaging sessions", is left to the LLM
+_NEGATION = re.compile(
+    r"\b(?:not|no|non|never|without|excluding|except)\W+(?:[\w']+\W+){0,2}$"
+)
+
+_SEX_PATTERNS = {
+    "male": re.compile(r"\b(?:males?|men|man|boys?)\b"),
+    "female": re.compile(r"\b(?:females?|women|woman|girls?)\b"),
+}
+_CONTROL_PATTERN = re.compile(
+    r"\bhealthy\s+(?:controls?|subjects|participants|volunteers)\b"
+    r"|\bcontrols?\s+(?:subjects|participants|group)\b"
+)
+
+# Words that carry no information once the fields above are extracted
+_FILLER_WORDS = frozenset(
+    """
+    a all an and any are at available cohort count data datasets do does
+    find for from get give had has have how i in individuals is list many
+    me number of old on or participants patients people please query show
+    subjects that the there those total were what which who whose with
+    within
+    """.split()
+)
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+@dataclass
+class RuleExtraction:
+    """
+    Result of the pattern-based extraction of a query.
+
+    Attributes:
+        parameters (Dict[str, object]): Raw field values, in the same form as the LLM output.
+        remainder (str): The query with the recognized spans removed.
+        covered (bool): True if nothing but filler words is left for the LLM.
+    """
+
+    parameters: Dict[str, object] = field(default_factory=dict)
+    remainder: str = ""
+    covered: bool = False
+
+
+def _to_number(value: str) -> str:
+    return _NUMBER_WORDS.get(value, value)
+
+
+def _mask(text: str, spans: List[Tuple[int, int]]) -> str:
+    for start, end in spans:
+        text = text[:start] + " " * (end - start) + text[end:]
+    return text
+
+
+def _is_negated(text: str, start: int) -> bool:
+    return _NEGATION.search(text, 0, start) is not None
+
+
+def extract_with_rules(query: str) -> RuleExtraction:
+    """
+    Extracts the numeric, sex and control fields of a query with patterns.
+
+    Fields with conflicting matches (e.g. both male and female terms), and
+    matches following a negation, are left for the LLM.
+
+    Args:
+        query (str): The query provided by the user.
+
+    Returns:
+        RuleExtraction: The extracted fields and the uncovered remainder.
+    """
+    text = query.lower()
+    candidates: Dict[str, List[Tuple[object, Tuple[int, int]]]] = {}
+
+    for pattern, fields in _RULES:
+        for match in pattern.finditer(text):
+            if not _is_negated(text, match.start()):
+                # Only the groups of the alternative that matched are set
+                groups = [value for value in match.groups() if value]
+                for field_name, value in zip(fields, groups):
+                    candidates.setdefault(field_name, []).append(
+                        (_to_number(value), match.span())
+                    )
+            # Do not let a weaker rule match the same span again
+            text = _mask(text, [match.span()])
+
+    for sex, pattern in _SEX_PATTERNS.items():
+        for match in pattern.finditer(text):
+            if not _is_negated(text, match.start()):
+                candidates.setdefault("sex", []).append((sex, match.span()))
+
+    for match in _CONTROL_PATTERN.finditer(text):
+        if not _is_negated(text, match.start()):
+            candidates.setdefault("is_control", []).append(
+                (True, match.span())
+            )
+
+    parameters: Dict[str, object] = {}
+    recognized_spans: List[Tuple[int, int]] = []
+    for field_name, values in candidates.items():
+        if len({value for value, _ in values}) == 1:
+            parameters[field_name] = values[0][0]
+            recognized_spans.extend(span for _, span in values)
+
+    remainder = _mask(query.lower(), recognized_spans)
+    leftover_words = [
+        word for word in _WORD.findall(remainder) if word not in _FILLER_WORDS
+    ]
+    return RuleExtraction(
+        parameters=parameters,
+        remainder=" ".join(remainder.split()),
+        covered=bool(parameters) and not leftover_words,
+    )
+
+
+class RuleCoverageStats:
+    """
+    Thread-safe counters of how much of the traffic the rules handle alone.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.full = 0
+        self.partial = 0
+        self.none = 0
+        self.fields: Dict[str, int] = {}
+
+    def record(self, extraction: RuleExtraction) -> None:
+        """
+        Records the outcome of one extraction.
+
+        Args:
+            extraction (RuleExtraction): The extraction to record.
+        """
+        with self._lock:
+            if extraction.covered:
+                self.full += 1
+            elif extraction.parameters:
+                self.partial += 1
+            else:
+                self.none += 1
+            for field_name in extraction.parameters:
+                self.fields[field_name] = self.fields.get(field_name, 0) + 1
+
+    def snapshot(self) -> Dict[str, object]:
+        """
+        Returns the counters.
+
+        Returns:
+            Dict[str, object]: Counts of fully, partially and not covered queries,
+            the share of queries that skipped the LLM, and per-field counts.
+        """
+        with self._lock:
+            total = self.full + self.partial + self.none
+            return {
+                "full": self.full,
+                "partial": self.partial,
+                "none": self.none,
+                "llm_skipped_rate": self.full / total if total else 0.0,
+                "fields": dict(self.fields),
+            }
+
+    def reset(self) -> None:
+        """
+        Resets every counter.
+        """
+        with self._lock:
+            self.full = self.partial = self.none = 0
+            self.fields = {}
+
+
+coverage_stats = RuleCoverageStats()
+
+registry.register_callback(
+    "nb_rule_fast_path_queries_total",
+    "Queries by how much of them the rule fast path extracted.",
+    "counter",
+    lambda: [
+        ({"coverage": coverage}, getattr(coverage_stats, coverage))
+        for coverage in ("full", "partial", "none")
+    ],
+)
+
+
+def merge_extractions(
+    rule_parameters: Dict[str, object], llm_response: Optional[dict]
+) -> dict:
+    """
+    Merges the rule-based fields of a partially covered query into the LLM
+    response. The LLM sees the whole query, so its values take precedence,
+    and the rules only fill the fields it left empty.
+
+    Args:
+        rule_parameters (Dict[str, object]): Fields extracted with patterns.
+        llm_response (Optional[dict]): Fields extracted by the LLM from the query.
+
+    Returns:
+        dict: The merged raw extraction.
+    """
+    merged = dict(llm_response or {})
+    for field_name, value in rule_parameters.items():
+        if is_empty(merged.get(field_name)):
+            merged[field_name] = value
+    return merged
+
+
+def is_empty(value: object) -> bool:
+    """
+    Returns True for the values of fields that were not extracted.
+    """
+    return value is None or value == "None"
@@ -0,0 +1,219 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from app.api.query_cache import normalize_query
+from app.metrics import registry
+
+# Stands for a numeric literal in a query template
+SLOT = "#"
+# Standalone numbers only, so that "t1w" or "3t" stay part of the template
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+# Fields filled from numbers in the query, and how they are cast
+NUMERIC_FIELDS = {
+    "min_age": float,
+    "max_age": float,
+    "min_num_imaging_sessions": int,
+    "min_num_phenotypic_sessions": int,
+}
+
+template_cache_lookups = registry.counter(
+    "nb_template_cache_lookups_total",
+    "Lookups of query templates, by outcome (hit, miss, or rejected when "
+    "the numbers of the query do not fit the template).",
+    labelnames=("outcome",),
+)
+template_cache_stores = registry.counter(
+    "nb_template_cache_stores_total",
+    "LLM extractions offered to the template cache, by outcome (stored, or "
+    "ambiguous when the numbers cannot be traced to the fields they fed).",
+    labelnames=("outcome",),
+)
+
+
+def query_template(query: str) -> Tuple[str, List[str]]:
+    """
+    Replaces the numbers of a normalized query with slots.
+
+    Args:
+        query (str): The query provided by the user.
+
+    Returns:
+        Tuple[str, List[str]]: The template, and the number in each slot.
+    """
+    query = normalize_query(query)
+    return _NUMBER.sub(SLOT, query), _NUMBER.findall(query)
+
+
+def learn_template(
+    slots: List[str], extraction: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """
+    Traces the numeric fields of an extraction back to the slots of its
+    query.
+
+    The template is ambiguous unless the value of every numeric field is
+    the number of exactly one slot, every slot feeds a numeric field, and
+    no slot number shows up in a text field, e.g. a "type 2" diagnosis.
+    Otherwise other numbers could change the extraction in ways the slots
+    do not capture.
+
+    Args:
+        slots (List[str]): The numbers of the query, in order.
+        extraction (Dict[str, Any]): The post-processed extraction.
+
+    Returns:
+        Optional[Dict[str, Any]]: The template entry, with the slot feeding
+        each numeric field, or None if the template is ambiguous.
+    """
+    if not slots:
+        return None
+    fields = {}
+    for field in NUMERIC_FIELDS:
+        if field not in extraction:
+            continue
+        value = float(extraction[field])
+        feeding = [
+            position
+            for position, number in enumerate(slots)
+            if float(number) == value
+        ]
+        if len(feeding) != 1:
+            return None
+        fields[field] = feeding[0]
+    if set(fields.values()) != set(range(len(slots))):
+        return None
+    for value in extraction.values():
+        if isinstance(value, str) and set(_NUMBER.findall(value)) & set(slots):
+            return None
+    return {"slots": len(slots), "fields": fields, "extraction": extraction}
+
+
+def fill_template(
+    entry: Dict[str, Any], slots: List[str]
+) -> Optional[Dict[str, Any]]:
+    """
+    Substitutes the numbers of a query into a template entry.
+
+    Args:
+        entry (Dict[str, Any]): The template entry, see `learn_template`.
+        slots (List[str]): The numbers of the query, in order.
+
+    Returns:
+        Optional[Dict[str, Any]]: The extraction of the query, or None if
+        its numbers do not fit the fields, e.g. a decimal number of sessions
+        or a minimum age above the maximum.
+    """
+    if len(slots) != entry["slots"]:
+        return None
+    numbers = {}
+    for field, position in entry["fields"].items():
+        number = slots[position]
+        if NUMERIC_FIELDS[field] is int and not number.isdigit():
+            return None
+        numbers[field] = NUMERIC_FIELDS[field](number)
+    if numbers.get("min_age", 0) > numbers.get("max_age", float("inf")):
+        return None
+    return {
+        field: numbers.get(field, value)
+        for field, value in entry["extraction"].items()
+    }
+
+
+class TemplateCache:
+    """
+    Bounded, thread-safe LRU cache of LLM extractions keyed on the query
+    with its numbers replaced by slots.
+
+    Queries that only differ in their numbers, e.g. the ages or the number
+    of sessions asked for, share a template. The first one is extracted by
+    the LLM, and records which numeric field each slot fed; the others get
+    their numbers substituted into that extraction instead of calling the
+    LLM. Extractions whose numbers cannot be traced unambiguously are not
+    cached, and queries whose numbers do not fit the template fall back to
+    the LLM.
+
+    The cache belongs to one extraction engine, so its entries are only
+    valid for the model and prompt of that engine.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the extraction of a query from the template it fits.
+
+        Args:
+            query (str): The query provided by the user.
+
+        Returns:
+            Optional[Dict[str, Any]]: The extraction, or None on a miss.
+        """
+        template, slots = query_template(query)
+        if not slots:
+            return None
+        with self._lock:
+            entry = self._entries.get(template)
+            if entry is not None:
+                self._entries.move_to_end(template)
+        if entry is None:
+            template_cache_lookups.inc(outcome="miss")
+            return None
+        extraction = fill_template(entry, slots)
+        template_cache_lookups.inc(
+            outcome="rejected" if extraction is None else "hit"
+        )
+        return extraction
+
+    def set(self, query: str, extraction: Dict[str, Any]) -> None:
+        """
+        Caches the template of a query extracted by the LLM, unless it is
+        ambiguous, evicting the least recently used templates beyond
+        `max_entries`.
+
+        Args:
+            query (str): The query provided by the user.
+            extraction (Dict[str, Any]): The post-processed extraction.
+        """
+        template, slots = query_template(query)
+        if not slots or self.max_entries <= 0:
+            return
+        entry = learn_template(slots, extraction)
+        template_cache_stores.inc(
+            outcome="ambiguous" if entry is None else "stored"
+        )
+        if entry is None:
+            return
+        with self._lock:
+            self._entries[template] = entry
+            self._entries.move_to_end(template)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Drops every template.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def template_cache_from_env() -> Optional[TemplateCache]:
+    """
+    Builds the template cache configured by the NB_TEMPLATE_CACHE_SIZE
+    environment variable.
+
+    Returns:
+        Optional[TemplateCache]: The cache, or None if disabled.
+    """
+    max_entries = int(os.getenv("NB_TEMPLATE_CACHE_SIZE", 1024))
+    if max_entries <= 0:
+        return None
+    return TemplateCache(max_entries=max_entries)
@@ -1,13 +1,59 @@
+import asyncio
 import os
-from fastapi import FastAPI
+import sys
+from contextlib import asynccontextmanager, suppress
+from fastapi import FastAPI, Response, status
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
+from app import http_client
+from app.llm_processing.ollama_pool import HEALTH_INTERVAL, get_ollama_pool
+from app.metrics import CONTENT_TYPE, ServerTimingMiddleware, registry
 from app.router import routes
+from app.term_url_processing.term_index_file import load_term_index_file
+from app.term_url_processing.vocabulary_snapshot import (
+    load_vocabulary_snapshot,
+)
+from app.warmup import WARMUP_ENABLED, warm_up, warmup_state
 from fastapi.middleware.cors import CORSMiddleware
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve the vocabularies from the offline snapshot, if one is configured
+    load_vocabulary_snapshot()
+    # Resolve terms against the term index file shared by every worker, if
+    # one is configured and already written
+    load_term_index_file()
+    # Build the extraction engine and warm up in the background, /ready
+    # reports when it is done. Without warm-up, the engine and the LLM stack
+    # it needs are loaded by the first request
+    warmup_task = None
+    if WARMUP_ENABLED:
+        warmup_task = asyncio.create_task(warm_up())
+    else:
+        warmup_state.status = "ready"
+    # Eject and re-admit Ollama backends as they go down and come back up
+    health_task = None
+    if HEALTH_INTERVAL > 0:
+        health_task = asyncio.create_task(
+            get_ollama_pool().run_health_checks(HEALTH_INTERVAL)
+        )
+    yield
+    for task in (warmup_task, health_task):
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+    extractions = sys.modules.get("app.llm_processing.extractions")
+    if extractions is not None:
+        extractions.set_extraction_engine(None)
+    await http_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(routes.router)
 
@@ -17,7 +63,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-LLM-Tokens", "Retry-After"],
 )
+app.add_middleware(ServerTimingMiddleware)
 
 
 @app.get("/")
@@ -25,6 +73,28 @@ async def root():
     return {"message": "Welcome to the Neurobagel Query Tool AI API"}
 
 
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    return JSONResponse(
+        warmup_state.snapshot(),
+        status_code=(
+            status.HTTP_200_OK
+            if warmup_state.ready
+            else status.HTTP_503_SERVICE_UNAVAILABLE
+        ),
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     import uvicorn
 
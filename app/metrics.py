@@ -0,0 +1,443 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def _format_labels(labels: Mapping[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+        for value in labels.values()
+    )
+    pairs = ",".join(
+        f'{name}="{value}"' for name, value in zip(labels, escaped)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """
+    Monotonically increasing, thread-safe counter with optional labels.
+    """
+
+    metric_type = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """
+        Increments the counter of the given labels.
+
+        Args:
+            amount (float): The increment.
+            **labels (str): A value for each label name.
+        """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        """
+        Returns the counter of the given labels.
+        """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """
+    Thread-safe histogram with cumulative buckets and optional labels.
+    """
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label values: count of each bucket, sum and count
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Records an observation.
+
+        Args:
+            value (float): The observed value.
+            **labels (str): A value for each label name.
+        """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self._values.items()
+            }
+        for key, (counts, total, count) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield (
+                    f"{self.name}_bucket",
+                    {**labels, "le": _format_value(bound)},
+                    cumulative,
+                )
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class _Callback:
+    """
+    Metric whose samples are read from a callback at scrape time.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        metric_type: str,
+        callback: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self._callback = callback
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        for labels, value in self._callback():
+            yield self.name, labels, value
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        """
+        Registers a counter.
+        """
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """
+        Registers a histogram.
+        """
+        return self._register(
+            Histogram(name, documentation, labelnames, buckets)
+        )
+
+    def register_stats(
+        self,
+        snapshot: Callable[[], Mapping[str, Any]],
+        metrics: Mapping[str, Tuple[str, str, str]],
+    ) -> None:
+        """
+        Exposes the values of an existing stats snapshot, read at scrape
+        time.
+
+        Args:
+            snapshot (Callable[[], Mapping[str, Any]]): Returns the current stats.
+            metrics (Mapping[str, Tuple[str, str, str]]): For each metric name, the
+                key of its value in the snapshot, its type ("counter" or "gauge")
+                and its documentation.
+        """
+
+        def sample(key: str) -> Callable[[], List[Tuple[Dict[str, str], Any]]]:
+            return lambda: [({}, snapshot()[key])]
+
+        for name, (key, metric_type, documentation) in metrics.items():
+            self._register(
+                _Callback(name, documentation, metric_type, sample(key))
+            )
+
+    def register_callback(
+        self,
+        name: str,
+        documentation: str,
+        metric_type: str,
+        callback: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+    ) -> None:
+        """
+        Exposes labelled samples returned by a callback at scrape time.
+
+        Args:
+            name (str): The metric name.
+            documentation (str): The metric documentation.
+            metric_type (str): "counter" or "gauge".
+            callback (Callable[[], Iterable[Tuple[Dict[str, str], float]]]): Returns
+                the labels and value of every sample.
+        """
+        self._register(_Callback(name, documentation, metric_type, callback))
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition, one sample per line.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            for name, labels, value in metric.samples():
+                lines.append(
+                    f"{name}{_format_labels(labels)} {_format_value(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: Any) -> Any:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Duplicate metric: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+
+registry = MetricsRegistry()
+
+stage_duration = registry.histogram(
+    "nb_stage_duration_seconds",
+    "Time spent in each stage of query processing.",
+    labelnames=("stage",),
+)
+http_request_duration = registry.histogram(
+    "nb_http_request_duration_seconds",
+    "Time to respond to HTTP requests, until the response starts.",
+    labelnames=("method", "path", "status"),
+)
+term_resolutions = registry.counter(
+    "nb_term_resolutions_total",
+    "Term URL lookups, by attribute and by the tier that resolved them.",
+    labelnames=("attribute", "tier"),
+)
+llm_tokens = registry.histogram(
+    "nb_llm_tokens",
+    "Tokens of each LLM call, by kind (prompt or completion).",
+    labelnames=("kind",),
+    buckets=TOKEN_BUCKETS,
+)
+
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "request_timings", default=None
+)
+_request_tokens: ContextVar[Optional[Dict[str, int]]] = ContextVar(
+    "request_tokens", default=None
+)
+
+
+def current_timings() -> Optional[Dict[str, float]]:
+    """
+    Returns the stage durations of the request being served, if any.
+    """
+    return _request_timings.get()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Times a stage of query processing, recording it in the stage histogram
+    and adding it to the timings of the current request.
+
+    Args:
+        name (str): The name of the stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_duration.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def current_tokens() -> Optional[Dict[str, int]]:
+    """
+    Returns the LLM tokens used by the request being served, if any.
+    """
+    return _request_tokens.get()
+
+
+def record_tokens(prompt: int, completion: int) -> None:
+    """
+    Records the tokens of an LLM call in the token histogram, and adds them
+    to the tokens of the current request.
+
+    Args:
+        prompt (int): Number of tokens of the prompt.
+        completion (int): Number of generated tokens.
+    """
+    llm_tokens.observe(prompt, kind="prompt")
+    llm_tokens.observe(completion, kind="completion")
+    tokens = _request_tokens.get()
+    if tokens is not None:
+        tokens["prompt"] = tokens.get("prompt", 0) + prompt
+        tokens["completion"] = tokens.get("completion", 0) + completion
+
+
+def format_server_timing(timings: Mapping[str, float]) -> str:
+    """
+    Formats stage durations as a Server-Timing header value.
+
+    Args:
+        timings (Mapping[str, float]): Durations in seconds, by stage.
+
+    Returns:
+        str: The header value, with durations in milliseconds.
+    """
+    return ", ".join(
+        f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()
+    )
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware collecting the stage durations of each request into a
+    Server-Timing response header, and recording the request latency. The
+    LLM tokens used by the request, if any, are reported in an X-LLM-Tokens
+    header.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: Dict[str, float] = {}
+        tokens: Dict[str, int] = {}
+        timings_token = _request_timings.set(timings)
+        tokens_token = _request_tokens.set(tokens)
+        start = time.perf_counter()
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter() - start
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    format_server_timing({**timings, "total": elapsed}),
+                )
+                if tokens:
+                    headers.append(
+                        "X-LLM-Tokens",
+                        ", ".join(f"{k}={v}" for k, v in tokens.items()),
+                    )
+                route = scope.get("route")
+                http_request_duration.observe(
+                    elapsed,
+                    method=scope["method"],
+                    # Route templates keep the number of label values bounded
+                    path=getattr(route, "path", "unmatched"),
+                    status=str(message["status"]),
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(timings_token)
+            _request_tokens.reset(tokens_token)
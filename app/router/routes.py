@@ -1,28 +1,125 @@
-from fastapi import APIRouter, HTTPException, status
+import json
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional
+from fastapi import APIRouter, Header, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.api.url_generator import get_api_url
+from app.admission import BATCH, INTERACTIVE, Overloaded, admission_controller
+from app.api.url_generator import (
+    aget_api_url,
+    generate_api_urls,
+    stream_api_url,
+)
+from app.deadline import DeadlineExceeded, request_budget, resolve_timeout
 
 
 router = APIRouter()
 
+BATCH_MAX_CONCURRENCY = int(os.getenv("NB_BATCH_MAX_CONCURRENCY", 4))
+BATCH_STREAM_THRESHOLD = int(os.getenv("NB_BATCH_STREAM_THRESHOLD", 100))
+
 
 class QueryRequest(BaseModel):
     query: str
 
 
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+
+
+def _overloaded(e: Overloaded, **headers: str) -> HTTPException:
+    return HTTPException(
+        status_code=e.status_code,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after), **headers},
+    )
+
+
+def _format_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _server_sent_events(
+    events: AsyncIterator[Dict[str, Any]], timeout: float
+) -> AsyncIterator[str]:
+    # The response has already started, so errors are reported as events
+    with request_budget(timeout=timeout):
+        try:
+            async for event in events:
+                yield _format_event(event["event"], event["data"])
+        except Exception as e:
+            yield _format_event("error", {"detail": str(e)})
+
+
 @router.post("/generate_url/")
-async def generate_url(request: QueryRequest):
-    max_retries = 3
-    for attempt in range(max_retries):
+async def generate_url(
+    request: QueryRequest,
+    response: Response,
+    http_request: Request,
+    x_request_timeout: Optional[float] = Header(default=None),
+):
+    # Stream the extracted fields as server-sent events if asked to
+    if "text/event-stream" in http_request.headers.get("accept", ""):
         try:
-            api_url = get_api_url(request.query)
-            return {"response": api_url}
+            # Refused before the response starts, with a status code
+            admission_controller.check(INTERACTIVE)
+            events = stream_api_url(request.query)
+        except Overloaded as e:
+            raise _overloaded(e)
+        except RuntimeError as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=str(e),
+            )
+        return StreamingResponse(
+            _server_sent_events(events, resolve_timeout(x_request_timeout)),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    with request_budget(timeout=resolve_timeout(x_request_timeout)) as budget:
+        try:
+            api_url = await aget_api_url(request.query)
+        except DeadlineExceeded as e:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail=str(e),
+                headers={"X-Retry-Count": str(budget.retries)},
+            )
+        except Overloaded as e:
+            raise _overloaded(e, **{"X-Retry-Count": str(budget.retries)})
         except Exception as e:
-            if (
-                attempt < max_retries - 1
-            ):  # If not the last attempt, wait and retry
-                continue
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed after {max_retries} attempts: {str(e)}",
+                detail=f"Failed after {budget.retries + 1} attempts: {str(e)}",
+                headers={"X-Retry-Count": str(budget.retries)},
             )
+
+    response.headers["X-Retry-Count"] = str(budget.retries)
+    return {"response": api_url}
+
+
+@router.post("/generate_urls/")
+async def generate_urls(request: BatchQueryRequest, http_request: Request):
+    try:
+        admission_controller.check(BATCH)
+        results = generate_api_urls(
+            request.queries, max_concurrency=BATCH_MAX_CONCURRENCY
+        )
+    except Overloaded as e:
+        raise _overloaded(e)
+    except RuntimeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e),
+        )
+
+    # Large batches are streamed back as NDJSON, one result per line
+    accept = http_request.headers.get("accept", "")
+    stream = len(request.queries) > BATCH_STREAM_THRESHOLD
+    if stream or "application/x-ndjson" in accept:
+        return StreamingResponse(
+            (json.dumps(result) + "\n" async for result in results),
+            media_type="application/x-ndjson",
+        )
+    return {"responses": [result async for result in results]}
@@ -0,0 +1,182 @@
+import asyncio
+import threading
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+from app.deadline import RequestBudget, current_budget, request_budget
+from app.metrics import registry
+
+T = TypeVar("T")
+
+singleflight_calls = registry.counter(
+    "nb_singleflight_calls_total",
+    "Calls to coalesced work, by group, either executed or coalesced into "
+    "an identical call already in flight.",
+    labelnames=("group", "outcome"),
+)
+
+
+class _Flight:
+    """
+    A call in flight in a thread, and its outcome once done.
+    """
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _AsyncFlight:
+    """
+    A call in flight as a task, the budget it runs with, and the number of
+    callers awaiting it.
+    """
+
+    __slots__ = ("task", "budget", "waiters")
+
+    def __init__(
+        self, task: "asyncio.Task[Any]", budget: RequestBudget
+    ) -> None:
+        self.task = task
+        self.budget = budget
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into one execution.
+
+    The first caller of a key runs the work, and every caller arriving with
+    the same key while it is in flight waits for it and gets the same result
+    or exception. Nothing is kept once the work completes, so a later call
+    runs it again: this deduplicates concurrent work, it is not a cache.
+
+    Async calls run as a task shared by their callers, with a request budget
+    of its own. Each caller stops waiting at its own deadline, or when it is
+    cancelled, without affecting the others, and the task is only cancelled
+    once no caller is left waiting for it.
+    """
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name (str): The group label of the coalescing counters.
+        """
+        self.name = name
+        self.executed = 0
+        self.coalesced = 0
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._async_flights: Dict[
+            Tuple[asyncio.AbstractEventLoop, Hashable], _AsyncFlight
+        ] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """
+        Runs `fn`, unless a call with the same key is already in flight in
+        another thread, in which case its outcome is shared.
+
+        Args:
+            key (Hashable): Identifies identical calls.
+            fn (Callable[[], T]): The work to run.
+
+        Returns:
+            T: The result of the work.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+        self._count("executed" if leader else "coalesced")
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Async version of `do`. The work runs as a task without the deadline
+        of any one caller, so that a caller with a short deadline does not
+        fail the others, and each caller waits for it within its own
+        deadline. The retries of the work count towards the budget of every
+        caller.
+
+        Args:
+            key (Hashable): Identifies identical calls.
+            fn (Callable[[], Awaitable[T]]): Returns the work to await.
+
+        Returns:
+            T: The result of the work.
+        """
+        # Tasks can only be awaited from the loop that runs them
+        flight_key = (asyncio.get_running_loop(), key)
+        flight = self._async_flights.get(flight_key)
+        if flight is None:
+            # The task copies the current context, and with it this budget
+            with request_budget(timeout=None) as shared:
+                task = asyncio.ensure_future(fn())
+            flight = self._async_flights[flight_key] = _AsyncFlight(
+                task, shared
+            )
+            task.add_done_callback(self._async_callback(flight_key, flight))
+            self._count("executed")
+        else:
+            self._count("coalesced")
+
+        budget = current_budget()
+        flight.waiters += 1
+        try:
+            waiting = asyncio.shield(flight.task)
+            return await (budget.run(waiting) if budget else waiting)
+        finally:
+            if budget is not None:
+                budget.retries += flight.budget.retries
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Every caller has given up, nobody needs the result
+                self._end_async(flight_key, flight)
+                flight.task.cancel()
+
+    def _async_callback(
+        self,
+        flight_key: Tuple[asyncio.AbstractEventLoop, Hashable],
+        flight: _AsyncFlight,
+    ) -> Callable[["asyncio.Task[Any]"], None]:
+        return lambda _: self._end_async(flight_key, flight)
+
+    def _end_async(
+        self,
+        flight_key: Tuple[asyncio.AbstractEventLoop, Hashable],
+        flight: _AsyncFlight,
+    ) -> None:
+        if self._async_flights.get(flight_key) is flight:
+            del self._async_flights[flight_key]
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        singleflight_calls.inc(group=self.name, outcome=outcome)
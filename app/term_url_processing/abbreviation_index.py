@@ -0,0 +1,101 @@
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+from app.term_url_processing.term_index import TermIndex, normalize_label
+
+
+class AbbreviationIndex:
+    """
+    Immutable inverted index from normalized abbreviation to the labels it
+    may stand for, built once from an abbreviation table.
+
+    An abbreviation shared by several labels (e.g. "BIS") keeps its
+    candidates in table order, and is resolved to the first candidate the
+    vocabulary knows about, so the result does not depend on anything but
+    the table and the vocabulary snapshot.
+    """
+
+    __slots__ = ("_labels",)
+
+    def __init__(self, table: Iterable[Dict]):
+        """
+        Builds the index.
+
+        Args:
+            table (Iterable[Dict]): Items with a "label" and its "abbreviations".
+        """
+        labels: Dict[str, List[str]] = {}
+        for item in table:
+            label = normalize_label(item["label"])
+            for abbreviation in item["abbreviations"]:
+                candidates = labels.setdefault(
+                    normalize_label(abbreviation), []
+                )
+                if label not in candidates:
+                    candidates.append(label)
+        self._labels: Mapping[str, Tuple[str, ...]] = {
+            abbreviation: tuple(candidates)
+            for abbreviation, candidates in labels.items()
+        }
+
+    @classmethod
+    def from_table(
+        cls, labels: Mapping[str, Tuple[str, ...]]
+    ) -> "AbbreviationIndex":
+        """
+        Wraps an inverted index built beforehand, e.g. memory-mapped from a
+        term index file (see term_index_file).
+
+        Args:
+            labels (Mapping[str, Tuple[str, ...]]): The candidate labels of
+                each normalized abbreviation.
+
+        Returns:
+            AbbreviationIndex: The index.
+        """
+        abbreviation_index = cls.__new__(cls)
+        abbreviation_index._labels = labels
+        return abbreviation_index
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def items(self) -> Iterator[Tuple[str, Tuple[str, ...]]]:
+        """
+        Returns the normalized abbreviations and their candidate labels.
+        """
+        return iter(self._labels.items())
+
+    def labels(self, abbreviation: object) -> Tuple[str, ...]:
+        """
+        Returns the labels an abbreviation may stand for.
+
+        Args:
+            abbreviation (object): The abbreviation to expand.
+
+        Returns:
+            Tuple[str, ...]: The normalized candidate labels, in table order.
+        """
+        return self._labels.get(normalize_label(abbreviation), ())
+
+    def resolve(
+        self,
+        abbreviation: object,
+        term_index: TermIndex,
+        cutoff: float = 0.6,
+    ) -> Optional[str]:
+        """
+        Resolves an abbreviation to a TermURL against a vocabulary snapshot.
+
+        Args:
+            abbreviation (object): The abbreviation to resolve.
+            term_index (TermIndex): The term index of the vocabulary.
+            cutoff (float): Minimum similarity ratio for a candidate label to match.
+
+        Returns:
+            Optional[str]: The TermURL of the first candidate label found in the
+            vocabulary, or None.
+        """
+        for label in self.labels(abbreviation):
+            term_url = term_index.match(label, cutoff)
+            if term_url is not None:
+                return term_url
+        return None
@@ -1,12 +1,16 @@
 import argparse
+import hashlib
 import json
-import re
 import os
-import requests
-from typing import List, Dict
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Optional
 from langchain_community.chat_models import ChatOllama
+from langchain_core.language_models import BaseChatModel
 from langchain_core.prompts import PromptTemplate
-from app.fetch_termURLs.termURL_mappings import (
+from app import http_client
+from app.term_url_processing.term_url_mappings import (
     sex_mapping,
     diagnosis_url,
     assessment_url,
@@ -24,7 +28,7 @@ def fetch_diagnosis_labels(url: str) -> List[str]:
     Returns:
         List[str]: A list of diagnosis terms.
     """
-    response = requests.get(url)
+    response = http_client.get(url)
     if response.status_code != 200:
         raise Exception(
             f"Failed to fetch data from {url} with status code {response.status_code}"
@@ -48,7 +52,7 @@ def fetch_assessment_labels(url: str) -> List[str]:
     Returns:
         List[str]: A list of assessment terms.
     """
-    response = requests.get(url)
+    response = http_client.get(url)
     if response.status_code != 200:
         raise Exception(
             f"Failed to fetch data from {url} with status code {response.status_code}"
@@ -88,17 +92,7 @@ def fetch_image_modality_labels(mapping: List[Dict[str, str]]) -> List[str]:
     return [item["label"] for item in mapping]
 
 
-def generate_abbreviations(input_terms: List[str], output_file: str) -> None:
-    """
-    Generates abbreviations for a list of terms using ChatOllama model and saves them in a Python file.
-
-    Args:
-        input_terms (List[str]): List of terms for which abbreviations are generated.
-        output_file (str): Output Python file to save abbreviations.
-    """
-    llm = ChatOllama(model="llama3")
-    prompt = PromptTemplate(
-        template="""Please respond with abbreviations most commonly used for the
+PROMPT_TEMPLATE = """Please respond with abbreviations most commonly used for the
 following term: {term}.
 Give only the abbreviations as output and prefer the ones used in research
 data and papers.
@@ -108,69 +102,213 @@ Output:'DM', 'DM2', 'DM1'.
 Do Not Give any explanation in the output.
 Input: "{term}"
 Output= <abbreviations>
-    """,
-        input_variables=["term"],
+    """
+
+
+def parse_abbreviations(content: str) -> List[str]:
+    """
+    Parses the comma-separated abbreviations returned by the model.
+
+    Args:
+        content (str): The content of the model response.
+
+    Returns:
+        List[str]: The abbreviations, without surrounding quotes.
+    """
+    abbreviations = (
+        abbr.strip().strip("'\".").strip() for abbr in content.split(",")
     )
-    chain = prompt | llm
+    return [abbr for abbr in abbreviations if abbr]
 
-    abbreviations_list = []
-    for term in input_terms:
-        if not term:
-            continue
-
-        response = chain.invoke({"term": term})
-        response = str(response)
-        match = re.search(r"content='(.*?)'", response)
-
-        if match:
-            content_part = match.group(1)
-        else:
-            content_part = ""
-        abbreviations = (
-            [abbr.strip() for abbr in content_part.split(",")]
-            if content_part
-            else []
-        )
-        abbreviations_dict = {"label": term, "abbreviations": abbreviations}
-        abbreviations_list.append(abbreviations_dict)
+
+def term_fingerprint(term: str, model: str) -> str:
+    """
+    Identifies the generation of a term, so that a checkpointed result is
+    reused only for the same term, model and prompt.
+
+    Args:
+        term (str): The term abbreviations are generated for.
+        model (str): The name of the model.
+
+    Returns:
+        str: A hex digest of the term, model and prompt.
+    """
+    return hashlib.sha256(
+        "\0".join((term, model, PROMPT_TEMPLATE)).encode("utf-8")
+    ).hexdigest()
+
+
+def load_checkpoint(checkpoint_path: str) -> Dict[str, List[str]]:
+    """
+    Reads the abbreviations already generated, by term fingerprint.
+
+    Args:
+        checkpoint_path (str): Path of the JSONL checkpoint file.
+
+    Returns:
+        Dict[str, List[str]]: The checkpointed abbreviations.
+    """
+    if not os.path.exists(checkpoint_path):
+        return {}
+
+    checkpoint = {}
+    with open(checkpoint_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                checkpoint[entry["fingerprint"]] = entry["abbreviations"]
+            except (ValueError, KeyError):
+                # A line cut short by an interrupted run
+                continue
+    return checkpoint
+
+
+def generate_abbreviations(
+    input_terms: List[str],
+    output_file: str,
+    workers: int = 4,
+    llm: Optional[BaseChatModel] = None,
+) -> Dict[str, float]:
+    """
+    Generates abbreviations for a list of terms using ChatOllama model and saves them in a Python file.
+
+    Terms are generated concurrently, and every result is appended to a JSONL
+    checkpoint next to the output file as soon as it arrives. Terms already
+    in the checkpoint for the same model and prompt are not generated again,
+    so an interrupted or repeated run only generates new or changed terms.
+
+    Args:
+        input_terms (List[str]): List of terms for which abbreviations are generated.
+        output_file (str): Output Python file to save abbreviations.
+        workers (int): Number of terms generated concurrently.
+        llm (Optional[BaseChatModel]): The chat model, llama3 through ChatOllama by default.
+
+    Returns:
+        Dict[str, float]: Counts of generated, reused and failed terms, and the
+        generation throughput in terms per second. Failed terms are left out
+        of the output file, and listed so that they can be retried.
+    """
+    llm = llm or ChatOllama(model="llama3")
+    model = getattr(llm, "model", type(llm).__name__)
+    prompt = PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["term"])
+    chain = prompt | llm
 
     script_dir = os.path.dirname(os.path.abspath(__file__))
     output_path = os.path.join(script_dir, output_file)
-
+    checkpoint_path = f"{os.path.splitext(output_path)[0]}.checkpoint.jsonl"
+
+    terms = list(dict.fromkeys(term for term in input_terms if term))
+    fingerprints = {term: term_fingerprint(term, model) for term in terms}
+    checkpoint = load_checkpoint(checkpoint_path)
+    pending = [term for term in terms if fingerprints[term] not in checkpoint]
+
+    failed: List[str] = []
+    start = time.perf_counter()
+    with open(checkpoint_path, "a") as checkpoint_file, ThreadPoolExecutor(
+        max_workers=workers
+    ) as executor:
+        futures = {
+            executor.submit(chain.invoke, {"term": term}): term
+            for term in pending
+        }
+        for future in as_completed(futures):
+            term = futures[future]
+            try:
+                abbreviations = parse_abbreviations(
+                    str(future.result().content)
+                )
+            except Exception as e:
+                print(f"Failed to generate abbreviations for {term!r}: {e}")
+                failed.append(term)
+                continue
+            checkpoint[fingerprints[term]] = abbreviations
+            checkpoint_file.write(
+                json.dumps(
+                    {
+                        "fingerprint": fingerprints[term],
+                        "label": term,
+                        "abbreviations": abbreviations,
+                    }
+                )
+                + "\n"
+            )
+            checkpoint_file.flush()
+    elapsed = time.perf_counter() - start
+
+    abbreviations_list = [
+        {"label": term, "abbreviations": checkpoint[fingerprints[term]]}
+        for term in terms
+        if fingerprints[term] in checkpoint
+    ]
     with open(output_path, "w") as py_file:
         py_file.write(
             f"{os.path.splitext(os.path.basename(output_file))[0]} = {json.dumps(abbreviations_list, indent=4)}\n"
         )
 
-    print(f"Abbreviations saved to {output_path}")
+    generated = len(pending) - len(failed)
+    stats = {
+        "generated": generated,
+        "reused": len(terms) - len(pending),
+        "failed": len(failed),
+        "terms_per_second": generated / elapsed if elapsed > 0 else 0.0,
+    }
+    print(
+        f"Abbreviations saved to {output_path}: {stats['generated']} generated"
+        f" ({stats['terms_per_second']:.2f} terms/s), {stats['reused']} reused"
+        f" from checkpoint, {stats['failed']} failed"
+    )
+    if failed:
+        # In input order, as the summary of what is missing from the output
+        print(
+            "Terms left out of the output, re-run to retry: "
+            + ", ".join(repr(term) for term in terms if term in failed)
+        )
+    return stats
 
 
-def main(output_file_prefix: str) -> None:
+def main(output_file_prefix: str, workers: int = 4) -> int:
     """
     Main function to fetch labels and generate abbreviations for diagnosis, assessment, sex, and image modality terms.
     Saves each type of labels in a separate Python file.
 
     Args:
         output_file_prefix (str): Prefix for output Python files.
+        workers (int): Number of terms generated concurrently.
+
+    Returns:
+        int: The number of terms whose generation failed.
     """
 
     diagnosis_terms = fetch_diagnosis_labels(diagnosis_url)
-    generate_abbreviations(
-        diagnosis_terms, f"{output_file_prefix}_diagnosis.py"
-    )
+    stats = [
+        generate_abbreviations(
+            diagnosis_terms, f"{output_file_prefix}_diagnosis.py", workers
+        )
+    ]
 
     assessment_terms = fetch_assessment_labels(assessment_url)
-    generate_abbreviations(
-        assessment_terms, f"{output_file_prefix}_assessment.py"
+    stats.append(
+        generate_abbreviations(
+            assessment_terms, f"{output_file_prefix}_assessment.py", workers
+        )
     )
 
     sex_terms = fetch_sex_labels(sex_mapping)
-    generate_abbreviations(sex_terms, f"{output_file_prefix}_sex.py")
+    stats.append(
+        generate_abbreviations(
+            sex_terms, f"{output_file_prefix}_sex.py", workers
+        )
+    )
 
     image_modality_terms = fetch_image_modality_labels(image_modality_mapping)
-    generate_abbreviations(
-        image_modality_terms, f"{output_file_prefix}_image_modality.py"
+    stats.append(
+        generate_abbreviations(
+            image_modality_terms,
+            f"{output_file_prefix}_image_modality.py",
+            workers,
+        )
     )
+    return int(sum(stat["failed"] for stat in stats))
 
 
 if __name__ == "__main__":
@@ -181,5 +319,12 @@ if __name__ == "__main__":
         default="abbreviations",
         help="The prefix for output Python files to save abbreviations.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="The number of terms to generate abbreviations for concurrently.",
+    )
     args = parser.parse_args()
-    main(args.output_prefix)
+    # A non-zero status tells scripted runs that some terms are missing
+    sys.exit(1 if main(args.output_prefix, args.workers) else 0)
@@ -0,0 +1,254 @@
+import heapq
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+
+def normalize_label(label: object) -> str:
+    """
+    Normalizes a label the same way the term URL lookups compare labels.
+
+    Args:
+        label (object): The label to normalize.
+
+    Returns:
+        str: The normalized label.
+    """
+    return str(label).lower()
+
+
+def label_trigrams(label: str) -> List[str]:
+    """
+    Returns the padded character trigrams of an already normalized label.
+
+    Args:
+        label (str): The normalized label.
+
+    Returns:
+        List[str]: The trigrams, padded so that short labels still have some.
+    """
+    padded = f"  {label} "
+    return [padded[i : i + 3] for i in range(len(padded) - 2)]
+
+
+class TermIndex:
+    """
+    Immutable lookup index over the labels of a single vocabulary.
+
+    The index maps every normalized label to its TermURL for O(1) exact
+    lookups, and keeps a character-trigram inverted index so that fuzzy
+    matching only scores the labels whose trigrams overlap the most with
+    those of the query, instead of the whole vocabulary. The fuzzy scoring itself is the
+    same as `difflib.get_close_matches`, so the cutoff keeps its meaning.
+
+    With `vector_dims`, the candidates are instead the labels with the most
+    similar hashed trigram vectors (see VectorMatcher), found with one
+    matrix-vector product over the whole vocabulary.
+    """
+
+    __slots__ = (
+        "labels",
+        "_term_urls",
+        "_postings",
+        "_sizes",
+        "_vectors",
+        "max_candidates",
+    )
+
+    def __init__(
+        self,
+        entries: Iterable[Tuple[object, Optional[str]]],
+        max_candidates: int = 64,
+        vector_dims: Optional[int] = None,
+    ):
+        """
+        Builds the index.
+
+        Args:
+            entries (Iterable[Tuple[object, Optional[str]]]): Pairs of label and TermURL.
+                When several entries share a normalized label, the first one wins.
+            max_candidates (int): Maximum number of labels scored per fuzzy lookup.
+            vector_dims (Optional[int]): Number of hash buckets of the trigram
+                vectors used to select candidates, or None to use the trigram
+                inverted index.
+        """
+        term_urls: Dict[str, Optional[str]] = {}
+        for label, term_url in entries:
+            term_urls.setdefault(normalize_label(label), term_url)
+
+        postings: Dict[str, List[int]] = {}
+        sizes: List[int] = []
+        labels = tuple(term_urls)
+        for position, label in enumerate(labels):
+            trigrams = set(label_trigrams(label))
+            for trigram in trigrams:
+                postings.setdefault(trigram, []).append(position)
+            sizes.append(len(trigrams))
+
+        self.labels: Sequence[str] = labels
+        self._term_urls: Mapping[str, Optional[str]] = term_urls
+        self._postings: Mapping[str, Sequence[int]] = {
+            trigram: tuple(positions)
+            for trigram, positions in postings.items()
+        }
+        self._sizes: Sequence[int] = tuple(sizes)
+        self._vectors = None
+        if vector_dims:
+            # Imported here so that NumPy is only loaded when it is used
+            from app.term_url_processing.vector_matcher import VectorMatcher
+
+            self._vectors = VectorMatcher(labels, dims=vector_dims)
+        self.max_candidates = max_candidates
+
+    @classmethod
+    def from_tables(
+        cls,
+        labels: Sequence[str],
+        term_urls: Mapping[str, Optional[str]],
+        postings: Mapping[str, Sequence[int]],
+        sizes: Sequence[int],
+        vectors: Optional[Any] = None,
+        max_candidates: int = 64,
+    ) -> "TermIndex":
+        """
+        Wraps lookup tables built beforehand, e.g. memory-mapped from a term
+        index file (see term_index_file), instead of building them.
+
+        Args:
+            labels (Sequence[str]): The normalized labels.
+            term_urls (Mapping[str, Optional[str]]): The TermURL of each label.
+            postings (Mapping[str, Sequence[int]]): The positions in `labels` of
+                the labels containing each trigram.
+            sizes (Sequence[int]): The number of distinct trigrams of each label.
+            vectors (Optional[VectorMatcher]): Trigram vectors of `labels`, if
+                the candidates are selected by vector similarity.
+            max_candidates (int): Maximum number of labels scored per fuzzy lookup.
+
+        Returns:
+            TermIndex: The index.
+        """
+        term_index = cls.__new__(cls)
+        term_index.labels = labels
+        term_index._term_urls = term_urls
+        term_index._postings = postings
+        term_index._sizes = sizes
+        term_index._vectors = vectors
+        term_index.max_candidates = max_candidates
+        return term_index
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def items(self) -> Iterator[Tuple[str, Optional[str]]]:
+        """
+        Returns the normalized labels and their TermURLs.
+        """
+        return iter(self._term_urls.items())
+
+    def __contains__(self, term: object) -> bool:
+        return normalize_label(term) in self._term_urls
+
+    def get(self, term: object) -> Optional[str]:
+        """
+        Returns the TermURL of the label exactly matching the term.
+
+        Args:
+            term (object): The term to look up.
+
+        Returns:
+            Optional[str]: The TermURL, or None if no label matches.
+        """
+        return self._term_urls.get(normalize_label(term))
+
+    def candidates(self, term: object) -> List[str]:
+        """
+        Returns the labels whose trigrams overlap the most with those of the
+        term.
+
+        The overlap is the Dice coefficient of the trigram sets, so that long
+        labels containing the words of the term do not crowd out the short
+        labels closely matching it, as difflib's ratio is length-normalized
+        too.
+
+        Args:
+            term (object): The term to find candidates for.
+
+        Returns:
+            List[str]: At most `max_candidates` labels, best first.
+        """
+        if self._vectors is not None:
+            return [
+                label
+                for label, score in self._vectors.top_k(
+                    term, self.max_candidates
+                )
+                if score > 0
+            ]
+        trigrams = set(label_trigrams(normalize_label(term)))
+        counts: Counter = Counter()
+        for trigram in trigrams:
+            counts.update(self._postings.get(trigram, ()))
+        scores = {
+            position: 2 * shared / (len(trigrams) + self._sizes[position])
+            for position, shared in counts.items()
+        }
+        best = heapq.nlargest(
+            self.max_candidates, scores, key=scores.__getitem__
+        )
+        return [self.labels[position] for position in best]
+
+    def closest(self, term: object, cutoff: float = 0.6) -> Optional[str]:
+        """
+        Returns the candidate label most similar to the term.
+
+        Args:
+            term (object): The term to match.
+            cutoff (float): Minimum `difflib` similarity ratio to accept a match.
+
+        Returns:
+            Optional[str]: The best matching normalized label, or None.
+        """
+        term = normalize_label(term)
+        matcher = SequenceMatcher()
+        matcher.set_seq2(term)
+        best: Optional[Tuple[float, str]] = None
+        for label in self.candidates(term):
+            matcher.set_seq1(label)
+            if (
+                matcher.real_quick_ratio() >= cutoff
+                and matcher.quick_ratio() >= cutoff
+            ):
+                score = matcher.ratio()
+                # Ties are broken like difflib.get_close_matches
+                if score >= cutoff and (best is None or (score, label) > best):
+                    best = (score, label)
+        return best[1] if best else None
+
+    def match(self, term: object, cutoff: float = 0.6) -> Optional[str]:
+        """
+        Returns the TermURL of the exactly or closely matching label.
+
+        Args:
+            term (object): The term to match.
+            cutoff (float): Minimum `difflib` similarity ratio to accept a fuzzy match.
+
+        Returns:
+            Optional[str]: The TermURL, or None if nothing matches.
+        """
+        term_url = self.get(term)
+        if term_url is not None:
+            return term_url
+        closest_label = self.closest(term, cutoff)
+        if closest_label is not None:
+            return self._term_urls[closest_label]
+        return None
@@ -0,0 +1,576 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from app.term_url_processing import term_url_mapper
+from app.term_url_processing.abbreviation_index import AbbreviationIndex
+from app.term_url_processing.term_index import TermIndex, label_trigrams
+from app.term_url_processing.term_url_mappings import term_index_path
+
+# File layout: the magic number, the length of a JSON header, the header,
+# then every section, aligned on 8 bytes. The header gives the offset,
+# length and array type code of each section, relative to the end of the
+# header. Strings are stored as the concatenation of their UTF-8 encodings
+# and an array of the n + 1 offsets delimiting them.
+MAGIC = b"NBTERMS\x00"
+FORMAT_VERSION = 2
+ALIGNMENT = 8
+_HEADER_LENGTH = struct.Struct("<I")
+
+
+def _encode(string: str) -> bytes:
+    return string.encode("utf-8")
+
+
+class _Strings(Sequence):
+    """
+    Read-only sequence of strings over a string section. `find` assumes the
+    strings are sorted by their UTF-8 encoding.
+    """
+
+    __slots__ = ("_offsets", "_data")
+
+    def __init__(self, offsets: memoryview, data: memoryview):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, position: Any) -> Any:
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return self._bytes(position).decode("utf-8")
+
+    def find(self, string: str) -> int:
+        """
+        Returns the position of a string, or -1, by binary search.
+        """
+        key = _encode(string)
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and self._bytes(low) == key:
+            return low
+        return -1
+
+    def _bytes(self, position: int) -> bytes:
+        return bytes(
+            self._data[self._offsets[position] : self._offsets[position + 1]]
+        )
+
+
+class _TermURLs(Mapping):
+    """
+    The TermURL of each label, in the order of the sorted labels.
+    """
+
+    __slots__ = ("_labels", "_term_urls", "_has_term_url")
+
+    def __init__(
+        self, labels: _Strings, term_urls: _Strings, has_term_url: memoryview
+    ):
+        self._labels = labels
+        self._term_urls = term_urls
+        self._has_term_url = has_term_url
+
+    def __getitem__(self, label: str) -> Optional[str]:
+        position = self._labels.find(label)
+        if position < 0:
+            raise KeyError(label)
+        if not self._has_term_url[position]:
+            return None
+        return self._term_urls[position]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._labels)
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+
+class _Postings(Mapping):
+    """
+    The positions of the labels containing each trigram.
+    """
+
+    __slots__ = ("_keys", "_offsets", "_positions")
+
+    def __init__(
+        self, keys: _Strings, offsets: memoryview, positions: memoryview
+    ):
+        self._keys = keys
+        self._offsets = offsets
+        self._positions = positions
+
+    def __getitem__(self, key: str) -> memoryview:
+        position = self._keys.find(key)
+        if position < 0:
+            raise KeyError(key)
+        return self._positions[
+            self._offsets[position] : self._offsets[position + 1]
+        ]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class _Candidates(Mapping):
+    """
+    The candidate labels of each abbreviation.
+    """
+
+    __slots__ = ("_keys", "_offsets", "_labels")
+
+    def __init__(self, keys: _Strings, offsets: memoryview, labels: _Strings):
+        self._keys = keys
+        self._offsets = offsets
+        self._labels = labels
+
+    def __getitem__(self, key: str) -> Tuple[str, ...]:
+        position = self._keys.find(key)
+        if position < 0:
+            raise KeyError(key)
+        return tuple(
+            self._labels[i]
+            for i in range(
+                self._offsets[position], self._offsets[position + 1]
+            )
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class _Writer:
+    """
+    Lays out the sections of a term index file.
+    """
+
+    def __init__(self) -> None:
+        self.sections: Dict[str, Tuple[int, int, str]] = {}
+        self._chunks: List[bytes] = []
+        self._size = 0
+
+    def add(self, name: str, data: Union[bytes, array]) -> None:
+        typecode = data.typecode if isinstance(data, array) else "B"
+        raw = data.tobytes() if isinstance(data, array) else data
+        self.sections[name] = (self._size, len(raw), typecode)
+        padding = -len(raw) % ALIGNMENT
+        self._chunks.append(raw + b"\x00" * padding)
+        self._size += len(raw) + padding
+
+    def add_strings(self, name: str, strings: List[str]) -> None:
+        offsets = array("I", [0])
+        encoded = [_encode(string) for string in strings]
+        for string in encoded:
+            offsets.append(offsets[-1] + len(string))
+        self.add(f"{name}.offsets", offsets)
+        self.add(f"{name}.data", b"".join(encoded))
+
+    def data(self) -> bytes:
+        return b"".join(self._chunks)
+
+
+def _add_term_index(
+    writer: _Writer, name: str, term_index: TermIndex, vector_dims: int
+) -> None:
+    entries = sorted(term_index.items(), key=lambda item: _encode(item[0]))
+    labels = [label for label, _ in entries]
+    writer.add_strings(f"{name}.labels", labels)
+    writer.add_strings(
+        f"{name}.term_urls", [term_url or "" for _, term_url in entries]
+    )
+    writer.add(
+        f"{name}.has_term_url",
+        bytes(term_url is not None for _, term_url in entries),
+    )
+
+    postings: Dict[str, List[int]] = {}
+    sizes = array("I")
+    for position, label in enumerate(labels):
+        label_set = set(label_trigrams(label))
+        for trigram in label_set:
+            postings.setdefault(trigram, []).append(position)
+        sizes.append(len(label_set))
+    trigrams = sorted(postings, key=_encode)
+    offsets = array("I", [0])
+    positions = array("I")
+    for trigram in trigrams:
+        positions.extend(postings[trigram])
+        offsets.append(len(positions))
+    writer.add_strings(f"{name}.trigrams", trigrams)
+    writer.add(f"{name}.postings.offsets", offsets)
+    writer.add(f"{name}.postings", positions)
+    writer.add(f"{name}.sizes", sizes)
+
+    if vector_dims:
+        from app.term_url_processing.vector_matcher import VectorMatcher
+
+        matrix = VectorMatcher(labels, dims=vector_dims).matrix
+        writer.add(f"{name}.vectors", matrix.tobytes())
+
+
+def _add_abbreviation_index(
+    writer: _Writer, name: str, abbreviation_index: AbbreviationIndex
+) -> None:
+    entries = sorted(
+        abbreviation_index.items(), key=lambda item: _encode(item[0])
+    )
+    offsets = array("I", [0])
+    labels: List[str] = []
+    for _, candidates in entries:
+        labels.extend(candidates)
+        offsets.append(len(labels))
+    writer.add_strings(
+        f"abbreviations.{name}.keys", [key for key, _ in entries]
+    )
+    writer.add(f"abbreviations.{name}.offsets", offsets)
+    writer.add_strings(f"abbreviations.{name}.labels", labels)
+
+
+def write_term_index_file(
+    path: str,
+    term_indexes: Dict[str, TermIndex],
+    abbreviation_indexes: Dict[str, AbbreviationIndex],
+    vector_dims: int = 0,
+) -> Dict[str, Any]:
+    """
+    Serializes term and abbreviation indexes, replacing any existing file
+    atomically.
+
+    Args:
+        path (str): Path of the file.
+        term_indexes (Dict[str, TermIndex]): The term indexes, by vocabulary.
+        abbreviation_indexes (Dict[str, AbbreviationIndex]): The abbreviation
+            indexes, by vocabulary.
+        vector_dims (int): Number of hash buckets of the trigram vectors to
+            store, or 0 to store none.
+
+    Returns:
+        Dict[str, Any]: The header of the file.
+    """
+    writer = _Writer()
+    for name, term_index in term_indexes.items():
+        _add_term_index(writer, name, term_index, vector_dims)
+    for name, abbreviation_index in abbreviation_indexes.items():
+        _add_abbreviation_index(writer, name, abbreviation_index)
+    data = writer.data()
+
+    header = {
+        "format": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "checksum": "sha256:" + hashlib.sha256(data).hexdigest(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "term_indexes": {
+            name: len(term_index) for name, term_index in term_indexes.items()
+        },
+        "abbreviation_indexes": sorted(abbreviation_indexes),
+        "vector_dims": vector_dims,
+        "sections": writer.sections,
+    }
+    encoded_header = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    encoded_header += b" " * (
+        -(len(MAGIC) + _HEADER_LENGTH.size + len(encoded_header)) % ALIGNMENT
+    )
+
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LENGTH.pack(len(encoded_header)))
+        f.write(encoded_header)
+        f.write(data)
+    os.replace(temporary_path, path)
+    return header
+
+
+class TermIndexFile:
+    """
+    Term and abbreviation indexes memory-mapped read-only from a file.
+
+    The lookup tables are read in place from the mapping, so the pages of
+    the file are shared by every process mapping it, through the page cache,
+    instead of each one holding its own copy. Mapping the file checks its
+    sections fit in it and verifies its checksum, which reads it once.
+    """
+
+    def __init__(self, path: str):
+        """
+        Maps the file.
+
+        Args:
+            path (str): Path of the file.
+
+        Raises:
+            ValueError: If the file is not a term index file this version can
+                read, or it is truncated or corrupt.
+        """
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        start = len(MAGIC) + _HEADER_LENGTH.size
+        if len(buffer) < start or bytes(buffer[: len(MAGIC)]) != MAGIC:
+            raise ValueError(f"Not a term index file: {path}")
+        (header_length,) = _HEADER_LENGTH.unpack_from(buffer, len(MAGIC))
+        self.header: Dict[str, Any] = json.loads(
+            bytes(buffer[start : start + header_length])
+        )
+        if self.header.get("format") != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported term index file format: {self.header.get('format')}"
+            )
+        if self.header["byteorder"] != sys.byteorder:
+            raise ValueError(
+                f"Term index file written on a {self.header['byteorder']}-endian machine"
+            )
+        self.path = path
+        self._data_start = start + header_length
+        self._buffer = buffer
+        self._check_sections()
+        checksum = hashlib.sha256(buffer[self._data_start :]).hexdigest()
+        if f"sha256:{checksum}" != self.checksum:
+            raise ValueError(f"Term index file checksum mismatch: {path}")
+
+        self._term_indexes = {
+            name: self._load_term_index(name)
+            for name in self.header["term_indexes"]
+        }
+        self._abbreviation_indexes = {
+            name: AbbreviationIndex.from_table(
+                _Candidates(
+                    self._strings(f"abbreviations.{name}.keys"),
+                    self._view(f"abbreviations.{name}.offsets"),
+                    self._strings(f"abbreviations.{name}.labels"),
+                )
+            )
+            for name in self.header["abbreviation_indexes"]
+        }
+
+    @property
+    def checksum(self) -> str:
+        return self.header["checksum"]
+
+    def term_index(self, name: str) -> Optional[TermIndex]:
+        """
+        Returns the term index of a vocabulary, or None if the file has none.
+        """
+        return self._term_indexes.get(name)
+
+    def abbreviation_index(self, name: str) -> Optional[AbbreviationIndex]:
+        """
+        Returns the abbreviation index of a vocabulary, or None if the file
+        has none.
+        """
+        return self._abbreviation_indexes.get(name)
+
+    def _check_sections(self) -> None:
+        # Raised here rather than as a TypeError or IndexError on lookup
+        sections = self.header["sections"]
+        for name, (offset, length, typecode) in sections.items():
+            end = self._data_start + offset + length
+            if offset < 0 or length < 0 or end > len(self._buffer):
+                raise ValueError(f"Term index file is truncated: {name}")
+            if length % array(typecode).itemsize:
+                raise ValueError(f"Term index file section is corrupt: {name}")
+
+    def _view(self, name: str) -> memoryview:
+        offset, length, typecode = self.header["sections"][name]
+        start = self._data_start + offset
+        section = self._buffer[start : start + length]
+        return section if typecode == "B" else section.cast(typecode)
+
+    def _strings(self, name: str) -> _Strings:
+        return _Strings(
+            self._view(f"{name}.offsets"), self._view(f"{name}.data")
+        )
+
+    def _load_term_index(self, name: str) -> TermIndex:
+        labels = self._strings(f"{name}.labels")
+        vectors = None
+        if f"{name}.vectors" in self.header["sections"]:
+            import numpy as np
+            from app.term_url_processing.vector_matcher import VectorMatcher
+
+            offset, _, _ = self.header["sections"][f"{name}.vectors"]
+            matrix = np.frombuffer(
+                self._mmap,
+                dtype=np.float32,
+                count=len(labels) * self.header["vector_dims"],
+                offset=self._data_start + offset,
+            ).reshape(len(labels), self.header["vector_dims"])
+            vectors = VectorMatcher.from_matrix(labels, matrix)
+        return TermIndex.from_tables(
+            labels,
+            _TermURLs(
+                labels,
+                self._strings(f"{name}.term_urls"),
+                self._view(f"{name}.has_term_url"),
+            ),
+            _Postings(
+                self._strings(f"{name}.trigrams"),
+                self._view(f"{name}.postings.offsets"),
+                self._view(f"{name}.postings"),
+            ),
+            self._view(f"{name}.sizes"),
+            vectors,
+        )
+
+
+def save_term_index_file(path: str) -> Dict[str, int]:
+    """
+    Writes the term indexes of the vocabularies held in memory, and those
+    of the abbreviation tables, to a file, fetching the vocabularies if
+    needed.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        Dict[str, int]: The number of labels indexed for each vocabulary.
+
+    Raises:
+        RuntimeError: If a vocabulary is unavailable.
+    """
+    indexes = {
+        "diagnosis": term_url_mapper.get_diagnosis_index(),
+        "assessment": term_url_mapper.get_assessment_index(),
+        "sex": term_url_mapper.get_sex_index(),
+        "image_modality": term_url_mapper.get_image_modality_index(),
+    }
+    unavailable = [name for name, index in indexes.items() if not index]
+    if unavailable:
+        raise RuntimeError(
+            f"Vocabularies unavailable: {', '.join(unavailable)}"
+        )
+    term_indexes = {name: index for name, index in indexes.items() if index}
+    abbreviation_indexes = {
+        name: term_url_mapper.get_abbreviation_index(name, table)
+        for name, table in term_url_mapper.abbreviation_tables().items()
+    }
+    header = write_term_index_file(
+        path,
+        term_indexes,
+        abbreviation_indexes,
+        vector_dims=term_url_mapper.VECTOR_MATCHER_DIMS,
+    )
+    return header["term_indexes"]
+
+
+def load_term_index_file(
+    path: Optional[str] = term_index_path,
+) -> Optional[TermIndexFile]:
+    """
+    Maps the configured term index file, if any, and resolves terms
+    against it from then on.
+
+    Args:
+        path (Optional[str]): Path of the file, or None if none is configured.
+
+    Returns:
+        Optional[TermIndexFile]: The mapped file, or None if no file is
+        configured or it could not be mapped.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        term_index_file = TermIndexFile(path)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Error loading term index file: {e}")
+        return None
+    print(
+        f"Using term index file {path}, created at "
+        f"{term_index_file.header['created_at']}"
+    )
+    term_url_mapper.use_term_index_file(term_index_file)
+    return term_index_file
+
+
+def prepare_term_index_file(
+    path: Optional[str] = term_index_path,
+) -> Dict[str, int]:
+    """
+    Maps the term index file, writing it first from the vocabularies if it
+    does not exist yet, e.g. on the first start of the first worker.
+
+    Args:
+        path (Optional[str]): Path of the file, or None if none is configured.
+
+    Returns:
+        Dict[str, int]: The number of labels indexed for each vocabulary.
+    """
+    if not path:
+        return {}
+    term_index_file = term_url_mapper.get_term_index_file()
+    if term_index_file is None:
+        term_index_file = load_term_index_file(path)
+    if term_index_file is None:
+        save_term_index_file(path)
+        term_index_file = load_term_index_file(path)
+    return term_index_file.header["term_indexes"] if term_index_file else {}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Manage the term index file shared by the workers."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser(
+        "build",
+        help="Build the file from the vocabularies (see NB_VOCABULARY_SNAPSHOT).",
+    )
+    build_parser.add_argument("path", help="Path of the file.")
+    show_parser = subparsers.add_parser(
+        "show", help="Print the metadata of the file."
+    )
+    show_parser.add_argument("path", help="Path of the file.")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        from app.term_url_processing.vocabulary_snapshot import (
+            load_vocabulary_snapshot,
+        )
+
+        load_vocabulary_snapshot()
+        try:
+            save_term_index_file(args.path)
+        except (OSError, RuntimeError) as e:
+            print(f"Error building term index file: {e}")
+            return 1
+    try:
+        term_index_file = TermIndexFile(args.path)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Invalid term index file: {e}")
+        return 1
+
+    header = term_index_file.header
+    print(f"Checksum: {header['checksum']}")
+    print(f"Created at: {header['created_at']}")
+    print(f"Size: {os.path.getsize(args.path)} bytes")
+    for name, labels in header["term_indexes"].items():
+        print(f"{name}: {labels} labels")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
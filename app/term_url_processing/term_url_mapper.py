@@ -1,12 +1,27 @@
-import requests
-from typing import Optional, Dict, Any
-import difflib
+import asyncio
+import os
+from typing import (
+    TYPE_CHECKING,
+    Optional,
+    Dict,
+    Any,
+    Callable,
+    Iterable,
+    List,
+    Tuple,
+)
 from app.term_url_processing.term_url_mappings import (
     sex_mapping,
     diagnosis_url,
     assessment_url,
     image_modality_mapping,
 )
+from app import http_client
+from app.metrics import stage, term_resolutions
+from app.singleflight import SingleFlight
+from app.term_url_processing.abbreviation_index import AbbreviationIndex
+from app.term_url_processing.term_index import TermIndex
+from app.term_url_processing.vocabulary_store import vocabulary_store
 from app.term_url_processing.abbreviations.abbreviations_diagnosis import (
     abbreviations_diagnosis,
 )
@@ -20,6 +35,12 @@ from app.term_url_processing.abbreviations.abbreviations_image_modality import (
     abbreviations_image_modality,
 )
 
+if TYPE_CHECKING:
+    from app.term_url_processing.term_index_file import TermIndexFile
+
+
+_fetch_flights = SingleFlight("vocabulary_fetch")
+
 
 def fetch_termURL_mappings(url: str) -> Optional[Dict[str, Any]]:
     """
@@ -32,8 +53,15 @@ def fetch_termURL_mappings(url: str) -> Optional[Dict[str, Any]]:
         Optional[Dict[str, Any]]: The JSON response containing the term URL mappings,
         or None if an error occurred during the request.
     """
+    # Concurrent downloads of the same vocabulary share one request
+    return _fetch_flights.do(url, lambda: _fetch_termURL_mappings(url))
+
+
+def _fetch_termURL_mappings(url: str) -> Optional[Dict[str, Any]]:
+    import requests
+
     try:
-        response = requests.get(url)
+        response = http_client.get(url)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -41,91 +69,346 @@ def fetch_termURL_mappings(url: str) -> Optional[Dict[str, Any]]:
         return None
 
 
-def get_diagnosis_termURL(diagnosis: str) -> Optional[str]:
+# Number of hash buckets of the NumPy trigram vectors used to select fuzzy
+# match candidates, or 0 to select them with the trigram inverted index
+VECTOR_MATCHER_DIMS = int(os.getenv("NB_VECTOR_MATCHER_DIMS", 0))
+
+_term_indexes: Dict[str, Tuple[Any, TermIndex]] = {}
+
+# Indexes memory-mapped from a term index file, which take precedence over
+# the vocabularies and abbreviation tables they were built from
+_term_index_file: Optional["TermIndexFile"] = None
+
+
+def use_term_index_file(term_index_file: Optional["TermIndexFile"]) -> None:
     """
-    Retrieves the TermURL for a given diagnosis.
+    Resolves terms against the indexes of a term index file, instead of
+    indexes built from the vocabularies, which are then not fetched.
 
     Args:
-        diagnosis (str): The diagnosis label to search for.
+        term_index_file (Optional[TermIndexFile]): The mapped file, or None to
+            go back to building the indexes.
+    """
+    global _term_index_file
+    _term_index_file = term_index_file
+    # The indexes built so far are not needed anymore
+    _term_indexes.clear()
+    _abbreviation_indexes.clear()
+
+
+def get_term_index_file() -> Optional["TermIndexFile"]:
+    """
+    Returns the term index file terms are resolved against, if any.
+    """
+    return _term_index_file
+
+
+def _mapped_term_index(name: str) -> Optional[TermIndex]:
+    if _term_index_file is None:
+        return None
+    return _term_index_file.term_index(name)
+
+
+def get_term_index(
+    name: str,
+    source: Any,
+    entries: Callable[[], Iterable[Tuple[object, Optional[str]]]],
+) -> TermIndex:
+    """
+    Returns the term index for a vocabulary, building it only when the
+    vocabulary snapshot it was built from has been replaced.
+
+    Args:
+        name (str): The name of the vocabulary.
+        source (Any): The vocabulary snapshot the index is built from.
+        entries (Callable[[], Iterable[Tuple[object, Optional[str]]]]): Produces the
+            (label, TermURL) pairs of the snapshot.
 
     Returns:
-        str: The TermURL corresponding to the diagnosis label, or "None" if not found.
+        TermIndex: The term index of the snapshot.
+    """
+    cached = _term_indexes.get(name)
+    if cached is not None and cached[0] is source:
+        return cached[1]
+
+    term_index = TermIndex(entries(), vector_dims=VECTOR_MATCHER_DIMS)
+    _term_indexes[name] = (source, term_index)
+    return term_index
+
+
+_abbreviation_indexes: Dict[str, Tuple[Any, AbbreviationIndex]] = {}
+
+
+def get_abbreviation_index(
+    name: str, table: List[Dict[str, Any]]
+) -> AbbreviationIndex:
+    """
+    Returns the inverted index of an abbreviation table, building it only
+    when the table has been replaced.
+
+    Args:
+        name (str): The name of the abbreviation table.
+        table (List[Dict[str, Any]]): The abbreviation table.
+
+    Returns:
+        AbbreviationIndex: The inverted index of the table.
+    """
+    if _term_index_file is not None:
+        mapped = _term_index_file.abbreviation_index(name)
+        if mapped is not None:
+            return mapped
+
+    cached = _abbreviation_indexes.get(name)
+    if cached is not None and cached[0] is table:
+        return cached[1]
+
+    abbreviation_index = AbbreviationIndex(table)
+    _abbreviation_indexes[name] = (table, abbreviation_index)
+    return abbreviation_index
+
+
+def get_diagnosis_index() -> Optional[TermIndex]:
     """
-    diagnosis_mapping = fetch_termURL_mappings(diagnosis_url)
-    if diagnosis_mapping:
-        diagnosis = diagnosis.lower()
-        labels = [
-            (str(item.get("Label"))).lower()
+    Returns the term index of the current diagnosis vocabulary.
+
+    Returns:
+        Optional[TermIndex]: The term index, or None if the vocabulary is unavailable.
+    """
+    mapped = _mapped_term_index("diagnosis")
+    if mapped is not None:
+        return mapped
+    diagnosis_mapping = vocabulary_store.get(diagnosis_url)
+    if not diagnosis_mapping:
+        return None
+    return get_term_index(
+        "diagnosis",
+        diagnosis_mapping,
+        lambda: (
+            (item.get("Label"), item.get("TermURL", "None"))
             for item in diagnosis_mapping.get("nb:Diagnosis", [])
-        ]
+        ),
+    )
+
+
+def get_assessment_index() -> Optional[TermIndex]:
+    """
+    Returns the term index of the current assessment vocabulary.
+
+    Returns:
+        Optional[TermIndex]: The term index, or None if the vocabulary is unavailable.
+    """
+    mapped = _mapped_term_index("assessment")
+    if mapped is not None:
+        return mapped
+    assessment_mapping = vocabulary_store.get(assessment_url)
+    if not assessment_mapping:
+        return None
+    return get_term_index(
+        "assessment",
+        assessment_mapping,
+        lambda: (
+            (item.get("Label"), item.get("TermURL"))
+            for item in assessment_mapping.get("nb:Assessment", [])
+        ),
+    )
+
+
+def get_sex_index() -> TermIndex:
+    """
+    Returns the term index of the hardcoded sex mapping.
 
-        # Direct match
-        if diagnosis_mapping:
-            for item in diagnosis_mapping.get("nb:Diagnosis", []):
-                if (str(item.get("Label"))).lower() == diagnosis:
-                    return item.get("TermURL", "None")
+    Returns:
+        TermIndex: The term index.
+    """
+    return _mapped_term_index("sex") or get_term_index(
+        "sex", sex_mapping, sex_mapping.items
+    )
 
-        # Partial match
-        closest_matches = difflib.get_close_matches(
-            diagnosis, labels, n=1, cutoff=0.6
+
+def get_image_modality_index() -> TermIndex:
+    """
+    Returns the term index of the hardcoded image modality mapping.
+
+    Returns:
+        TermIndex: The term index.
+    """
+    return _mapped_term_index("image_modality") or get_term_index(
+        "image_modality",
+        image_modality_mapping,
+        lambda: (
+            (item.get("label"), item.get("termURL"))
+            for item in image_modality_mapping
+        ),
+    )
+
+
+def build_term_indexes() -> Dict[str, int]:
+    """
+    Builds the term and abbreviation indexes of every vocabulary held in
+    memory, so that the first lookups do not pay for it.
+
+    Returns:
+        Dict[str, int]: The number of labels indexed for each vocabulary, 0
+        if the vocabulary is unavailable.
+    """
+    indexes = {
+        "diagnosis": get_diagnosis_index(),
+        "assessment": get_assessment_index(),
+        "sex": get_sex_index(),
+        "image_modality": get_image_modality_index(),
+    }
+    for name, table in abbreviation_tables().items():
+        get_abbreviation_index(name, table)
+    return {
+        name: len(index) if index is not None else 0
+        for name, index in indexes.items()
+    }
+
+
+def abbreviation_tables() -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Returns the abbreviation table of each vocabulary.
+    """
+    return {
+        "diagnosis": abbreviations_diagnosis,
+        "assessment": abbreviations_assessment,
+        "sex": abbreviations_sex,
+        "image_modality": abbreviations_image_modality,
+    }
+
+
+def get_vocabulary_fingerprint() -> Tuple[Any, ...]:
+    """
+    Returns a value that changes whenever any vocabulary or abbreviation
+    table used to resolve terms changes.
+
+    Returns:
+        Tuple[Any, ...]: The versions of the remote vocabularies, a hash of
+        the local mappings and abbreviation tables, and the checksum of the
+        term index file, if any.
+    """
+    global _local_tables_fingerprint
+    local_tables = (
+        sex_mapping,
+        image_modality_mapping,
+        abbreviations_diagnosis,
+        abbreviations_assessment,
+        abbreviations_sex,
+        abbreviations_image_modality,
+    )
+    identity = tuple(map(id, local_tables)) + tuple(map(len, local_tables))
+    if _local_tables_fingerprint[0] != identity:
+        _local_tables_fingerprint = (identity, hash(repr(local_tables)))
+    return (
+        vocabulary_store.version(diagnosis_url),
+        vocabulary_store.version(assessment_url),
+        _local_tables_fingerprint[1],
+        _term_index_file.checksum if _term_index_file is not None else None,
+    )
+
+
+_local_tables_fingerprint: Tuple[Any, int] = (None, 0)
+
+
+async def aload_vocabularies(attributes: Iterable[str]) -> None:
+    """
+    Loads the remote vocabularies needed to resolve the given attributes
+    with the async HTTP client, so that the lookups that follow are served
+    from memory instead of blocking on the network. Vocabularies whose index
+    is memory-mapped from a term index file are not needed.
+
+    Args:
+        attributes (Iterable[str]): Extracted attribute names (e.g. "diagnosis").
+    """
+    urls = {
+        "diagnosis": diagnosis_url,
+        "assessment": assessment_url,
+    }
+    await asyncio.gather(
+        *(
+            vocabulary_store.aget(urls[attribute])
+            for attribute in attributes
+            if attribute in urls and _mapped_term_index(attribute) is None
         )
-        if closest_matches:
-            closest_match = closest_matches[0]
-            for item in diagnosis_mapping.get("nb:Diagnosis", []):
-                if (str(item.get("Label"))).lower() == closest_match:
-                    return item.get("TermURL")
+    )
 
-        # Abbreviation match
-        for item in abbreviations_diagnosis:
-            if diagnosis.lower() in (
-                abbr.lower() for abbr in item["abbreviations"]
-            ):
-                return get_diagnosis_termURL(str(item["label"]).lower())
 
-    return "None"
+def resolve_term(
+    attribute: str,
+    term: str,
+    term_index: Optional[TermIndex],
+    abbreviation_index: AbbreviationIndex,
+) -> str:
+    """
+    Resolves a term against a vocabulary, trying an exact match, then a
+    partial match, then an abbreviation match, and counts which tier
+    resolved it.
 
+    Args:
+        attribute (str): The attribute the term was extracted for.
+        term (str): The term to resolve.
+        term_index (Optional[TermIndex]): The term index of the vocabulary,
+            or None if the vocabulary is unavailable.
+        abbreviation_index (AbbreviationIndex): The abbreviations of the attribute.
 
-def get_assessment_termURL(assessment: str) -> Optional[str]:
+    Returns:
+        str: The TermURL of the term, or "None" if not found.
     """
-    Retrieves the TermURL for a given assessment.
+    term_url, tier = None, "none"
+    if term_index is not None:
+        with stage("term_matching"):
+            term = term.lower()
+            term_url = term_index.get(term)
+            if term_url is not None:
+                tier = "exact"
+            else:
+                closest_label = term_index.closest(term, cutoff=0.6)
+                if closest_label is not None:
+                    term_url, tier = term_index.get(closest_label), "fuzzy"
+                else:
+                    term_url = abbreviation_index.resolve(
+                        term, term_index, cutoff=0.6
+                    )
+                    if term_url is not None:
+                        tier = "abbreviation"
+    term_resolutions.inc(attribute=attribute, tier=tier)
+    return term_url if term_url is not None else "None"
+
+
+def get_diagnosis_termURL(diagnosis: str) -> Optional[str]:
+    """
+    Retrieves the TermURL for a given diagnosis.
 
     Args:
-        assessment (str): The assessment label to search for.
+        diagnosis (str): The diagnosis label to search for.
 
     Returns:
-        str: The TermURL corresponding to the assessment label, or "None" if not found.
+        str: The TermURL corresponding to the diagnosis label, or "None" if not found.
     """
-    assessment_mapping = fetch_termURL_mappings(assessment_url)
-    if assessment_mapping:
-        assessment = assessment.lower()
-        labels = [
-            (str(item.get("Label"))).lower()
-            for item in assessment_mapping.get("nb:Assessment", [])
-        ]
+    return resolve_term(
+        "diagnosis",
+        diagnosis,
+        get_diagnosis_index(),
+        get_abbreviation_index("diagnosis", abbreviations_diagnosis),
+    )
 
-        # Direct match
-        for item in assessment_mapping.get("nb:Assessment", []):
-            if (str(item.get("Label"))).lower() == assessment:
-                return item.get("TermURL")
 
-        # Partial match
-        closest_matches = difflib.get_close_matches(
-            assessment, labels, n=1, cutoff=0.6
-        )
-        if closest_matches:
-            closest_match = closest_matches[0]
-            for item in assessment_mapping.get("nb:Assessment", []):
-                if (str(item.get("Label"))).lower() == closest_match:
-                    return item.get("TermURL")
+def get_assessment_termURL(assessment: str) -> Optional[str]:
+    """
+    Retrieves the TermURL for a given assessment.
 
-        # Abbreviation match
-        for item in abbreviations_assessment:
-            if assessment.lower() in (
-                abbr.lower() for abbr in item["abbreviations"]
-            ):
-                return get_assessment_termURL(str(item["label"]).lower())
+    Args:
+        assessment (str): The assessment label to search for.
 
-    return "None"
+    Returns:
+        str: The TermURL corresponding to the assessment label, or "None" if not found.
+    """
+    return resolve_term(
+        "assessment",
+        assessment,
+        get_assessment_index(),
+        get_abbreviation_index("assessment", abbreviations_assessment),
+    )
 
 
 def get_sex_termURL(sex: str) -> Optional[str]:
@@ -138,26 +421,12 @@ def get_sex_termURL(sex: str) -> Optional[str]:
     Returns:
         str: The TermURL corresponding to the sex label, or "None" if not found.
     """
-    sex = sex.lower()
-    sex_mapping_lower = {k.lower(): v for k, v in sex_mapping.items()}
-
-    # Direct match
-    if sex in sex_mapping_lower:
-        return sex_mapping_lower[sex]
-
-    # Partial match
-    closest_matches = difflib.get_close_matches(
-        sex, sex_mapping_lower.keys(), n=1, cutoff=0.6
+    return resolve_term(
+        "sex",
+        sex,
+        get_sex_index(),
+        get_abbreviation_index("sex", abbreviations_sex),
     )
-    if closest_matches:
-        return sex_mapping_lower[closest_matches[0]]
-
-    # Abbreviation match
-    for item in abbreviations_sex:
-        if sex.lower() in (abbr.lower() for abbr in item["abbreviations"]):
-            return get_sex_termURL(str(item["label"]).lower())
-
-    return "None"
 
 
 def get_image_modality_termURL(image_modality: str) -> Optional[str]:
@@ -170,34 +439,12 @@ def get_image_modality_termURL(image_modality: str) -> Optional[str]:
     Returns:
         str: The TermURL corresponding to the image_modality label, or None if not found.
     """
-    image_modality = image_modality.lower()
-    labels = [
-        (str(item.get("label"))).lower() for item in image_modality_mapping
-    ]
-
-    # Direct match
-    for item in image_modality_mapping:
-        if (str(item.get("label"))).lower() == image_modality:
-            return item.get("termURL")
-
-    # Partial match
-    closest_matches = difflib.get_close_matches(
-        image_modality, labels, n=1, cutoff=0.6
+    return resolve_term(
+        "image_modality",
+        image_modality,
+        get_image_modality_index(),
+        get_abbreviation_index("image_modality", abbreviations_image_modality),
     )
-    if closest_matches:
-        closest_match = closest_matches[0]
-        for item in image_modality_mapping:
-            if (str(item.get("label"))).lower() == closest_match:
-                return item.get("termURL")
-
-    # Abbreviation match
-    for item in abbreviations_image_modality:
-        if image_modality.lower() in (
-            abbr.lower() for abbr in item["abbreviations"]
-        ):
-            return get_image_modality_termURL(str(item["label"]).lower())
-
-    return "None"
 
 
 if __name__ == "__main__":
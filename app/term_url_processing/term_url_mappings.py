@@ -1,7 +1,24 @@
+import os
+
 # URLs for fetching diagnosis and assessment mappings
 diagnosis_url = "https://api.neurobagel.org/attributes/nb%3ADiagnosis"
 assessment_url = "https://api.neurobagel.org/attributes/nb%3AAssessment"
 
+# Remote vocabularies, by the name they have in a vocabulary snapshot
+vocabulary_urls = {
+    "diagnosis": diagnosis_url,
+    "assessment": assessment_url,
+}
+
+# Optional offline snapshot of the remote vocabularies, loaded at startup
+# (see app/term_url_processing/vocabulary_snapshot.py)
+vocabulary_snapshot_path = os.getenv("NB_VOCABULARY_SNAPSHOT")
+
+# Optional term index file, memory-mapped by every worker instead of each
+# one building its own term indexes (see
+# app/term_url_processing/term_index_file.py)
+term_index_path = os.getenv("NB_TERM_INDEX_FILE")
+
 # Hardcoded mappings for sex
 sex_mapping = {
     "male": "snomed:248153007",
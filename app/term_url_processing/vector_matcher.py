@@ -0,0 +1,126 @@
+import zlib
+from typing import Iterable, List, Sequence, Tuple
+import numpy as np
+from app.term_url_processing.term_index import label_trigrams, normalize_label
+
+
+class VectorMatcher:
+    """
+    Cosine similarity search over hashed character trigram vectors.
+
+    Every label is turned into a vector of trigram counts hashed into `dims`
+    buckets and normalized to unit length, and the vectors are stacked into
+    one dense matrix. Scoring a query against the whole vocabulary is then a
+    single matrix-vector product. The matrix takes `4 * dims` bytes per
+    label, so `dims` trades memory against hash collisions.
+    """
+
+    __slots__ = ("labels", "dims", "matrix")
+
+    def __init__(self, labels: Iterable[object], dims: int = 512):
+        """
+        Builds the label matrix.
+
+        Args:
+            labels (Iterable[object]): The labels to match against.
+            dims (int): Number of hash buckets of the trigram vectors.
+        """
+        self.labels: Sequence[str] = tuple(
+            normalize_label(label) for label in labels
+        )
+        self.dims = dims
+
+        rows: List[int] = []
+        buckets: List[int] = []
+        for row, label in enumerate(self.labels):
+            label_buckets = self._buckets(label)
+            rows.extend([row] * len(label_buckets))
+            buckets.extend(label_buckets)
+        matrix = np.zeros((len(self.labels), dims), dtype=np.float32)
+        np.add.at(matrix, (rows, buckets), 1.0)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        self.matrix = matrix
+
+    @classmethod
+    def from_matrix(
+        cls, labels: Sequence[str], matrix: np.ndarray
+    ) -> "VectorMatcher":
+        """
+        Wraps a label matrix built beforehand, e.g. memory-mapped from a
+        term index file (see term_index_file).
+
+        Args:
+            labels (Sequence[str]): The normalized labels, in matrix row order.
+            matrix (np.ndarray): The unit-length trigram vectors of the labels.
+
+        Returns:
+            VectorMatcher: The matcher.
+        """
+        matcher = cls.__new__(cls)
+        matcher.labels = labels
+        matcher.dims = matrix.shape[1]
+        matcher.matrix = matrix
+        return matcher
+
+    def vectorize(self, term: object) -> np.ndarray:
+        """
+        Returns the unit-length trigram vector of a term.
+
+        Args:
+            term (object): The term to vectorize.
+
+        Returns:
+            np.ndarray: A vector of `dims` float32 values.
+        """
+        vector = np.bincount(
+            self._buckets(normalize_label(term)), minlength=self.dims
+        ).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector
+
+    def scores(self, term: object) -> np.ndarray:
+        """
+        Returns the cosine similarity of a term with every label.
+
+        Args:
+            term (object): The term to score.
+
+        Returns:
+            np.ndarray: One similarity in [0, 1] per label, in label order.
+        """
+        return self.matrix @ self.vectorize(term)
+
+    def top_k(self, term: object, k: int = 5) -> List[Tuple[str, float]]:
+        """
+        Returns the labels most similar to a term.
+
+        Args:
+            term (object): The term to match.
+            k (int): Maximum number of labels to return.
+
+        Returns:
+            List[Tuple[str, float]]: Pairs of label and cosine similarity, best
+            first.
+        """
+        if not self.labels or k <= 0:
+            return []
+        scores = self.scores(term)
+        if k < len(scores):
+            positions = np.argpartition(-scores, k - 1)[:k]
+        else:
+            positions = np.arange(len(scores))
+        positions = positions[np.argsort(-scores[positions], kind="stable")]
+        return [
+            (self.labels[position], float(scores[position]))
+            for position in positions
+        ]
+
+    def _buckets(self, label: str) -> List[int]:
+        # A stable hash, so that vectors do not depend on the process
+        return [
+            zlib.crc32(trigram.encode("utf-8")) % self.dims
+            for trigram in label_trigrams(label)
+        ]
@@ -0,0 +1,288 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import IO, Any, Dict, List, Optional, cast
+from app.term_url_processing.term_url_mapper import fetch_termURL_mappings
+from app.term_url_processing.term_url_mappings import (
+    vocabulary_snapshot_path,
+    vocabulary_urls,
+)
+from app.term_url_processing.vocabulary_store import (
+    VocabularyStore,
+    vocabulary_store,
+)
+
+FORMAT_VERSION = 1
+
+
+@dataclass(frozen=True)
+class VocabularyBundle:
+    """
+    An offline snapshot of the remote vocabularies.
+
+    Attributes:
+        vocabularies (Dict[str, Dict[str, Any]]): API responses, by vocabulary name.
+        version (int): Incremented every time the content of the bundle changes.
+        checksum (str): SHA-256 of the canonical JSON of the vocabularies.
+        fetched_at (str): ISO 8601 UTC time the vocabularies were obtained.
+    """
+
+    vocabularies: Dict[str, Dict[str, Any]]
+    version: int
+    checksum: str
+    fetched_at: str
+
+
+def compute_checksum(vocabularies: Dict[str, Dict[str, Any]]) -> str:
+    """
+    Computes the checksum of a set of vocabularies, independent of key order.
+
+    Args:
+        vocabularies (Dict[str, Dict[str, Any]]): API responses, by vocabulary name.
+
+    Returns:
+        str: The prefixed SHA-256 hex digest.
+    """
+    canonical = json.dumps(
+        vocabularies, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return "sha256:" + hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _open(path: str, mode: str, compressed: bool) -> IO[str]:
+    if compressed:
+        return cast(IO[str], gzip.open(path, mode + "t", encoding="utf-8"))
+    return open(path, mode, encoding="utf-8")
+
+
+def load_bundle(path: str) -> VocabularyBundle:
+    """
+    Reads a vocabulary bundle and verifies its checksum.
+
+    Args:
+        path (str): Path of the bundle, gzip-compressed if it ends in .gz.
+
+    Returns:
+        VocabularyBundle: The bundle.
+
+    Raises:
+        ValueError: If the bundle is malformed or does not match its checksum.
+    """
+    with _open(path, "r", compressed=path.endswith(".gz")) as f:
+        content = json.load(f)
+
+    if content.get("format") != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported vocabulary snapshot format: {content.get('format')}"
+        )
+    bundle = VocabularyBundle(
+        vocabularies=content["vocabularies"],
+        version=content["version"],
+        checksum=content["checksum"],
+        fetched_at=content["fetched_at"],
+    )
+    if compute_checksum(bundle.vocabularies) != bundle.checksum:
+        raise ValueError(f"Checksum mismatch in vocabulary snapshot {path}")
+    return bundle
+
+
+def write_bundle(
+    path: str,
+    vocabularies: Dict[str, Dict[str, Any]],
+    previous: Optional[VocabularyBundle] = None,
+    fetched_at: Optional[str] = None,
+) -> VocabularyBundle:
+    """
+    Writes a vocabulary bundle, replacing any existing file atomically.
+
+    Args:
+        path (str): Path of the bundle, gzip-compressed if it ends in .gz.
+        vocabularies (Dict[str, Dict[str, Any]]): API responses, by vocabulary name.
+        previous (Optional[VocabularyBundle]): The bundle being replaced, whose
+            version is kept if the content is unchanged.
+        fetched_at (Optional[str]): ISO 8601 time the vocabularies were obtained,
+            defaulting to now.
+
+    Returns:
+        VocabularyBundle: The written bundle.
+    """
+    checksum = compute_checksum(vocabularies)
+    version = 1
+    if previous is not None:
+        version = previous.version + (previous.checksum != checksum)
+    bundle = VocabularyBundle(
+        vocabularies=vocabularies,
+        version=version,
+        checksum=checksum,
+        fetched_at=fetched_at
+        or datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    )
+
+    temporary_path = f"{path}.tmp"
+    with _open(temporary_path, "w", compressed=path.endswith(".gz")) as f:
+        json.dump(
+            {
+                "format": FORMAT_VERSION,
+                "version": bundle.version,
+                "checksum": bundle.checksum,
+                "fetched_at": bundle.fetched_at,
+                "vocabularies": bundle.vocabularies,
+            },
+            f,
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+    os.replace(temporary_path, path)
+    return bundle
+
+
+def install_bundle(
+    bundle: VocabularyBundle,
+    store: VocabularyStore = vocabulary_store,
+    urls: Dict[str, str] = vocabulary_urls,
+) -> List[str]:
+    """
+    Seeds a vocabulary store with the vocabularies of a bundle, under the
+    URLs they are normally fetched from.
+
+    Args:
+        bundle (VocabularyBundle): The bundle to install.
+        store (VocabularyStore): The store to seed.
+        urls (Dict[str, str]): The URL of each vocabulary, by name.
+
+    Returns:
+        List[str]: The names of the installed vocabularies.
+    """
+    installed = []
+    for name, data in bundle.vocabularies.items():
+        url = urls.get(name)
+        if url is None:
+            print(f"Ignoring unknown vocabulary in snapshot: {name}")
+            continue
+        store.seed(url, data)
+        installed.append(name)
+    return installed
+
+
+def load_vocabulary_snapshot(
+    path: Optional[str] = vocabulary_snapshot_path,
+    store: VocabularyStore = vocabulary_store,
+) -> Optional[VocabularyBundle]:
+    """
+    Loads the configured vocabulary snapshot into the store, if any.
+
+    Args:
+        path (Optional[str]): Path of the bundle, or None if none is configured.
+        store (VocabularyStore): The store to seed.
+
+    Returns:
+        Optional[VocabularyBundle]: The installed bundle, or None if no bundle
+        is configured or it could not be loaded.
+    """
+    if not path:
+        return None
+    try:
+        bundle = load_bundle(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error loading vocabulary snapshot: {e}")
+        return None
+    install_bundle(bundle, store)
+    return bundle
+
+
+def collect_vocabularies(
+    sources: Dict[str, str],
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Gathers every vocabulary, reading the ones with a local source file and
+    fetching the others from the Neurobagel API.
+
+    Args:
+        sources (Dict[str, str]): Local JSON files, by vocabulary name.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: API responses, by vocabulary name.
+
+    Raises:
+        RuntimeError: If a vocabulary could not be fetched.
+    """
+    vocabularies = {}
+    for name, url in vocabulary_urls.items():
+        if name in sources:
+            with open(sources[name], encoding="utf-8") as f:
+                vocabularies[name] = json.load(f)
+            continue
+        data = fetch_termURL_mappings(url)
+        if data is None:
+            raise RuntimeError(f"Could not fetch the {name} vocabulary")
+        vocabularies[name] = data
+    return vocabularies
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Manage the offline vocabulary snapshot."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    refresh_parser = subparsers.add_parser(
+        "refresh",
+        help="Refresh the snapshot from the Neurobagel API or local files.",
+    )
+    refresh_parser.add_argument("path", help="Path of the snapshot.")
+    refresh_parser.add_argument(
+        "--from-file",
+        action="append",
+        default=[],
+        metavar="NAME=PATH",
+        help="Read a vocabulary from a local JSON file instead of the API.",
+    )
+
+    show_parser = subparsers.add_parser(
+        "show", help="Verify a snapshot and print its metadata."
+    )
+    show_parser.add_argument("path", help="Path of the snapshot.")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "show":
+        try:
+            bundle = load_bundle(args.path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Invalid vocabulary snapshot: {e}")
+            return 1
+    else:
+        sources = dict(source.split("=", 1) for source in args.from_file)
+        unknown = set(sources) - set(vocabulary_urls)
+        if unknown:
+            parser.error(f"unknown vocabularies: {', '.join(sorted(unknown))}")
+
+        previous = None
+        if os.path.exists(args.path):
+            try:
+                previous = load_bundle(args.path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Replacing invalid vocabulary snapshot: {e}")
+        try:
+            vocabularies = collect_vocabularies(sources)
+        except (OSError, ValueError, RuntimeError) as e:
+            print(f"Error refreshing vocabulary snapshot: {e}")
+            return 1
+        bundle = write_bundle(args.path, vocabularies, previous)
+
+    print(f"Version: {bundle.version}")
+    print(f"Checksum: {bundle.checksum}")
+    print(f"Fetched at: {bundle.fetched_at}")
+    for name, data in bundle.vocabularies.items():
+        terms = sum(len(v) for v in data.values() if isinstance(v, list))
+        print(f"{name}: {terms} terms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
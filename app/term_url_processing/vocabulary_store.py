@@ -0,0 +1,371 @@
+import os
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Optional
+from app import http_client
+from app.metrics import stage
+from app.singleflight import SingleFlight
+
+
+@dataclass(frozen=True)
+class VocabularySnapshot:
+    """
+    An immutable copy of a vocabulary response as last fetched from upstream.
+
+    Attributes:
+        url (str): The URL the vocabulary was fetched from.
+        data (Dict[str, Any]): The decoded JSON response.
+        etag (Optional[str]): The ETag validator returned by the server.
+        last_modified (Optional[str]): The Last-Modified validator returned by the server.
+        fetched_at (float): Clock time of the last successful fetch or revalidation.
+        version (int): Incremented every time the content actually changes.
+    """
+
+    url: str
+    data: Dict[str, Any]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+    version: int
+
+
+class VocabularyStore:
+    """
+    Process-wide, in-memory store for the remote term vocabularies.
+
+    Vocabularies are fetched once and then served from memory. A snapshot
+    younger than `ttl` seconds is served as is. A snapshot that is older but
+    still within the `stale_ttl` window is served immediately while a
+    background thread revalidates it (stale-while-revalidate). Past that
+    window, the snapshot is revalidated before being served. Revalidation
+    uses the ETag/Last-Modified validators, and the last good snapshot keeps
+    being served whenever the upstream is slow or unavailable.
+
+    Concurrent fetches of the same URL are coalesced into a single request.
+    Snapshots can also be seeded from an offline bundle. An `offline` store
+    never reaches the upstream and only serves seeded snapshots.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300.0,
+        stale_ttl: float = 3600.0,
+        timeout: float = 10.0,
+        failure_backoff: float = 30.0,
+        offline: bool = False,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.failure_backoff = failure_backoff
+        self.offline = offline
+        self._clock = clock
+        self._snapshots: Dict[str, VocabularySnapshot] = {}
+        self._failed_at: Dict[str, float] = {}
+        self._refreshing: Dict[str, threading.Thread] = {}
+        self._url_locks: Dict[str, threading.RLock] = {}
+        self._lock = threading.Lock()
+        self._fetches = SingleFlight("vocabulary_fetch")
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the vocabulary for the given URL, fetching it if needed.
+
+        Args:
+            url (str): The URL of the vocabulary.
+
+        Returns:
+            Optional[Dict[str, Any]]: The vocabulary, or None if it has never
+            been fetched successfully.
+        """
+        snapshot = self.get_snapshot(url)
+        return snapshot.data if snapshot else None
+
+    def get_snapshot(self, url: str) -> Optional[VocabularySnapshot]:
+        """
+        Returns the current snapshot for the given URL, fetching or
+        revalidating it according to its age.
+
+        Args:
+            url (str): The URL of the vocabulary.
+
+        Returns:
+            Optional[VocabularySnapshot]: The snapshot, or None if the
+            vocabulary has never been fetched successfully.
+        """
+        snapshot = self._snapshots.get(url)
+        if snapshot is None:
+            return self._load(url)
+
+        age = self._clock() - snapshot.fetched_at
+        if age < self.ttl or self.offline or self._in_failure_backoff(url):
+            return snapshot
+        if age < self.ttl + self.stale_ttl:
+            self._schedule_refresh(url)
+            return snapshot
+        return self.refresh(url) or snapshot
+
+    def version(self, url: str) -> Optional[int]:
+        """
+        Returns the content version of the vocabulary currently held for a
+        URL, without fetching anything.
+
+        Args:
+            url (str): The URL of the vocabulary.
+
+        Returns:
+            Optional[int]: The snapshot version, or None if nothing is held.
+        """
+        snapshot = self._snapshots.get(url)
+        return snapshot.version if snapshot else None
+
+    def refresh(self, url: str) -> Optional[VocabularySnapshot]:
+        """
+        Revalidates the vocabulary for the given URL against the upstream.
+
+        Args:
+            url (str): The URL of the vocabulary.
+
+        Returns:
+            Optional[VocabularySnapshot]: The new or revalidated snapshot, or
+            None if the upstream could not be reached.
+        """
+        return self._fetches.do(url, lambda: self._refresh(url))
+
+    def _refresh(self, url: str) -> Optional[VocabularySnapshot]:
+        # For its exceptions, the request goes through the shared client
+        import requests
+
+        with self._url_lock(url):
+            previous = self._snapshots.get(url)
+            try:
+                # Shared by every caller, so not bound by any one deadline
+                with stage("vocabulary_fetch"):
+                    response = http_client.get(
+                        url,
+                        headers=self._validators(previous),
+                        timeout=self.timeout,
+                    )
+                snapshot = self._snapshot_from_response(
+                    url, previous, response
+                )
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self._record_failure(url, e)
+                return None
+            return self._store(url, snapshot)
+
+    async def aget(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        Async version of `get`, fetching the vocabulary without blocking
+        the event loop.
+
+        Args:
+            url (str): The URL of the vocabulary.
+
+        Returns:
+            Optional[Dict[str, Any]]: The vocabulary, or None if it has never
+            been fetched successfully.
+        """
+        snapshot = await self.aget_snapshot(url)
+        return snapshot.data if snapshot else None
+
+    async def aget_snapshot(self, url: str) -> Optional[VocabularySnapshot]:
+        """
+        Async version of `get_snapshot`.
+
+        Args:
+            url (str): The URL of the vocabulary.
+
+        Returns:
+            Optional[VocabularySnapshot]: The snapshot, or None if the
+            vocabulary has never been fetched successfully.
+        """
+        snapshot = self._snapshots.get(url)
+        if snapshot is None:
+            if self.offline or self._in_failure_backoff(url):
+                return None
+            return await self.arefresh(url)
+
+        age = self._clock() - snapshot.fetched_at
+        if age < self.ttl or self.offline or self._in_failure_backoff(url):
+            return snapshot
+        if age < self.ttl + self.stale_ttl:
+            self._schedule_refresh(url)
+            return snapshot
+        return await self.arefresh(url) or snapshot
+
+    async def arefresh(self, url: str) -> Optional[VocabularySnapshot]:
+        """
+        Async version of `refresh`, using an async HTTP client.
+
+        Args:
+            url (str): The URL of the vocabulary.
+
+        Returns:
+            Optional[VocabularySnapshot]: The new or revalidated snapshot, or
+            None if the upstream could not be reached.
+        """
+        return await self._fetches.ado(url, lambda: self._arefresh(url))
+
+    async def _arefresh(self, url: str) -> Optional[VocabularySnapshot]:
+        import httpx
+
+        previous = self._snapshots.get(url)
+        try:
+            with stage("vocabulary_fetch"):
+                response = await http_client.aget(
+                    url,
+                    headers=self._validators(previous),
+                    timeout=self.timeout,
+                )
+            snapshot = self._snapshot_from_response(url, previous, response)
+        except (httpx.HTTPError, ValueError) as e:
+            self._record_failure(url, e)
+            return None
+        with self._url_lock(url):
+            return self._store(url, snapshot)
+
+    def seed(
+        self, url: str, data: Dict[str, Any], stale: bool = True
+    ) -> VocabularySnapshot:
+        """
+        Installs a vocabulary obtained without fetching it, e.g. from an
+        offline bundle.
+
+        Args:
+            url (str): The URL the vocabulary is served for.
+            data (Dict[str, Any]): The vocabulary.
+            stale (bool): If True, the vocabulary is served immediately but
+                revalidated in the background on first use.
+
+        Returns:
+            VocabularySnapshot: The installed snapshot.
+        """
+        with self._url_lock(url):
+            previous = self._snapshots.get(url)
+            version = previous.version if previous else 0
+            if previous is None or data != previous.data:
+                version += 1
+            fetched_at = self._clock()
+            if stale:
+                fetched_at -= self.ttl
+            return self._store(
+                url,
+                VocabularySnapshot(
+                    url=url,
+                    data=data,
+                    etag=None,
+                    last_modified=None,
+                    fetched_at=fetched_at,
+                    version=version,
+                ),
+            )
+
+    def clear(self) -> None:
+        """
+        Drops every cached snapshot.
+        """
+        with self._lock:
+            self._snapshots.clear()
+            self._failed_at.clear()
+
+    def wait_for_refreshes(self, timeout: Optional[float] = None) -> None:
+        """
+        Blocks until all pending background refreshes have finished.
+
+        Args:
+            timeout (Optional[float]): Maximum time to wait for each refresh.
+        """
+        for thread in list(self._refreshing.values()):
+            thread.join(timeout)
+
+    def _load(self, url: str) -> Optional[VocabularySnapshot]:
+        if self.offline or self._in_failure_backoff(url):
+            return None
+
+        # Another thread may have loaded it since it was found missing
+        return self._fetches.do(
+            url, lambda: self._snapshots.get(url) or self._refresh(url)
+        )
+
+    def _in_failure_backoff(self, url: str) -> bool:
+        failed_at = self._failed_at.get(url)
+        return (
+            failed_at is not None
+            and self._clock() - failed_at < self.failure_backoff
+        )
+
+    @staticmethod
+    def _validators(previous: Optional[VocabularySnapshot]) -> Dict[str, str]:
+        headers = {}
+        if previous is not None:
+            if previous.etag:
+                headers["If-None-Match"] = previous.etag
+            if previous.last_modified:
+                headers["If-Modified-Since"] = previous.last_modified
+        return headers
+
+    def _snapshot_from_response(
+        self,
+        url: str,
+        previous: Optional[VocabularySnapshot],
+        response: Any,
+    ) -> VocabularySnapshot:
+        # Works with both requests and httpx responses
+        if response.status_code == 304 and previous is not None:
+            return replace(previous, fetched_at=self._clock())
+
+        response.raise_for_status()
+        data = response.json()
+        version = previous.version if previous else 0
+        if previous is None or data != previous.data:
+            version += 1
+        return VocabularySnapshot(
+            url=url,
+            data=data,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            fetched_at=self._clock(),
+            version=version,
+        )
+
+    def _store(
+        self, url: str, snapshot: VocabularySnapshot
+    ) -> VocabularySnapshot:
+        self._snapshots[url] = snapshot
+        self._failed_at.pop(url, None)
+        return snapshot
+
+    def _record_failure(self, url: str, error: Exception) -> None:
+        print(f"Error fetching mapping data: {error}")
+        self._failed_at[url] = self._clock()
+
+    def _schedule_refresh(self, url: str) -> None:
+        with self._lock:
+            if url in self._refreshing:
+                return
+            thread = threading.Thread(
+                target=self._background_refresh, args=(url,), daemon=True
+            )
+            self._refreshing[url] = thread
+        thread.start()
+
+    def _background_refresh(self, url: str) -> None:
+        try:
+            self.refresh(url)
+        finally:
+            with self._lock:
+                self._refreshing.pop(url, None)
+
+    def _url_lock(self, url: str) -> threading.RLock:
+        with self._lock:
+            return self._url_locks.setdefault(url, threading.RLock())
+
+
+vocabulary_store = VocabularyStore(
+    ttl=float(os.getenv("NB_VOCABULARY_TTL", 300)),
+    stale_ttl=float(os.getenv("NB_VOCABULARY_STALE_TTL", 3600)),
+    offline=os.getenv("NB_VOCABULARY_OFFLINE", "false").lower() == "true",
+)
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Dict, Optional
+from starlette.concurrency import run_in_threadpool
+from app.term_url_processing.term_index_file import (
+    prepare_term_index_file,
+)
+from app.term_url_processing.term_url_mappings import term_index_path
+from app.term_url_processing.term_url_mapper import (
+    aload_vocabularies,
+    build_term_indexes,
+)
+
+if TYPE_CHECKING:
+    from app.llm_processing.extractions import ExtractionEngine
+
+WARMUP_ENABLED = os.getenv("NB_WARMUP", "true").lower() != "false"
+WARMUP_TIMEOUT = float(os.getenv("NB_WARMUP_TIMEOUT", 600))
+# Seconds between attempts to load a model that Ollama cannot serve yet,
+# e.g. while it is still starting or pulling the model
+WARMUP_RETRY_INTERVAL = 5.0
+
+# Needs the LLM, a diagnosis and an assessment, so that every stage runs
+WARMUP_QUERY = "subjects diagnosed with parkinson's disease assessed with the balloon analogue risk task"
+
+
+class WarmupState:
+    """
+    Progress of the startup warm-up, reported by the /ready endpoint.
+
+    The status goes from "pending" to "warming", then to "ready" or
+    "failed". Each step records its status, its duration and its result or
+    error.
+    """
+
+    def __init__(self) -> None:
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.steps: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    async def run_step(self, name: str, step: Awaitable[Any]) -> Any:
+        """
+        Runs a warm-up step, recording its outcome.
+
+        Args:
+            name (str): The name of the step.
+            step (Awaitable[Any]): The step to run.
+
+        Returns:
+            Any: The result of the step.
+        """
+        self.steps[name] = {"status": "running"}
+        start = time.perf_counter()
+        try:
+            result = await step
+        except BaseException as e:
+            self.steps[name] = {
+                "status": "failed",
+                "seconds": round(time.perf_counter() - start, 3),
+                "error": str(e) or type(e).__name__,
+            }
+            raise
+        self.steps[name] = {
+            "status": "done",
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        # Summaries only, the state is reported as JSON
+        if isinstance(result, dict):
+            self.steps[name]["result"] = result
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot: Dict[str, Any] = {"status": self.status, "steps": self.steps}
+        if self.error is not None:
+            snapshot["error"] = self.error
+        return snapshot
+
+
+warmup_state = WarmupState()
+
+
+def build_extraction_engine() -> "ExtractionEngine":
+    """
+    Imports the LLM stack and builds the shared extraction engine.
+
+    Returns:
+        ExtractionEngine: The shared extraction engine.
+    """
+    from app.llm_processing.extractions import get_extraction_engine
+
+    return get_extraction_engine()
+
+
+async def load_model(engine: "ExtractionEngine") -> None:
+    """
+    Loads the model of the engine into Ollama's memory, with the engine's
+    keep-alive, waiting for Ollama to be able to serve it.
+
+    Args:
+        engine (ExtractionEngine): The engine whose model to load.
+    """
+    import requests
+    from app.llm_processing.chat_ollama import PooledChatOllama
+
+    if not isinstance(engine.llm, PooledChatOllama):
+        return
+    while True:
+        try:
+            await run_in_threadpool(engine.llm.load)
+            return
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Waiting for the model {engine.model}: {e}")
+            await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+
+
+async def warm_up(
+    state: WarmupState = warmup_state,
+    engine: Optional["ExtractionEngine"] = None,
+    timeout: Optional[float] = WARMUP_TIMEOUT,
+) -> None:
+    """
+    Imports the LLM stack, loads the model and the vocabularies, builds the
+    term indexes and runs a dummy extraction, so that the first requests are
+    served warm.
+
+    Failures are recorded in the state rather than raised.
+
+    Args:
+        state (WarmupState): Where to record the progress.
+        engine (Optional[ExtractionEngine]): The engine to warm up, defaults
+            to the shared one.
+        timeout (Optional[float]): Seconds the warm-up may take.
+    """
+    state.status = "warming"
+    try:
+        await asyncio.wait_for(_run_steps(state, engine), timeout)
+    except Exception as e:
+        state.status = "failed"
+        state.error = str(e) or type(e).__name__
+        print(f"Warm-up failed: {state.error}")
+        return
+    state.status = "ready"
+
+
+async def _run_steps(
+    state: WarmupState, engine: Optional["ExtractionEngine"]
+) -> None:
+    if engine is None:
+        # In a thread, as importing LangChain takes a while
+        engine = await state.run_step(
+            "engine", run_in_threadpool(build_extraction_engine)
+        )
+    await asyncio.gather(
+        state.run_step("model", load_model(engine)),
+        state.run_step(
+            "vocabularies", aload_vocabularies(("diagnosis", "assessment"))
+        ),
+    )
+    await state.run_step("term_indexes", run_in_threadpool(build_term_indexes))
+    if term_index_path:
+        # The first worker to start writes the file the others map
+        await state.run_step(
+            "term_index_file", run_in_threadpool(prepare_term_index_file)
+        )
+    # Bypasses the caches, which would otherwise answer every later warm-up
+    await state.run_step("extraction", engine.awarm_up(WARMUP_QUERY))
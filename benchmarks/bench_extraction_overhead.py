@@ -0,0 +1,104 @@
+"""
+Measures the per-request CPU time and memory allocations of the extraction
+pipeline when the LangChain chain is rebuilt on every call, as
+extract_information used to do, and when it is reused through an
+ExtractionEngine. A fake chat model stands in for Ollama so that only the
+pipeline overhead is measured.
+
+Usage:
+    python -m benchmarks.bench_extraction_overhead --requests 500
+"""
+
+import argparse
+import time
+import tracemalloc
+from typing import Callable, Dict
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.prompts import PromptTemplate
+from app.llm_processing.chat_ollama import PooledChatOllama
+from app.llm_processing.extractions import (
+    ExtractionEngine,
+    Parameters,
+    format_response,
+)
+
+RESPONSE = '{"sex": "male", "is_control": true}'
+QUERY = "male healthy control subjects"
+
+
+def rebuild_per_request(llm: FakeListChatModel) -> dict:
+    """
+    The pipeline construction extract_information did on every call.
+    """
+    PooledChatOllama(model="mistral")
+    parser = JsonOutputParser(pydantic_object=Parameters)
+    prompt = PromptTemplate(
+        template="Just extract the information as specified.\n{format_instructions}\n{context}\nIf not mentioned, put null.",
+        input_variables=["context"],
+        partial_variables={
+            "format_instructions": parser.get_format_instructions()
+        },
+    )
+    chain = prompt | llm | parser
+    return format_response(chain.invoke({"context": QUERY}))
+
+
+def measure(call: Callable[[], dict], requests: int) -> Dict[str, float]:
+    """
+    Measures the average CPU time and allocated memory of a call.
+
+    Args:
+        call (Callable[[], dict]): The extraction to measure.
+        requests (int): Number of calls to average over.
+
+    Returns:
+        Dict[str, float]: CPU microseconds per request and peak traced memory.
+    """
+    call()  # warm-up
+    start = time.process_time()
+    for _ in range(requests):
+        call()
+    cpu_seconds = time.process_time() - start
+
+    tracemalloc.start()
+    for _ in range(requests):
+        call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "cpu_us_per_request": cpu_seconds / requests * 1e6,
+        "peak_kib": peak / 1024,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    llm = FakeListChatModel(responses=[RESPONSE])
+    engine = ExtractionEngine(llm=llm)
+
+    results = {
+        "rebuilt per request": measure(
+            lambda: rebuild_per_request(llm), args.requests
+        ),
+        "shared engine": measure(lambda: engine.extract(QUERY), args.requests),
+    }
+    for name, result in results.items():
+        print(
+            f"{name:>20} | {result['cpu_us_per_request']:8.1f} us CPU/request"
+            f" | peak {result['peak_kib']:8.1f} KiB"
+        )
+    before, after = results.values()
+    print(
+        f"CPU saved per request: "
+        f"{before['cpu_us_per_request'] - after['cpu_us_per_request']:.1f} us"
+        f" ({before['cpu_us_per_request'] / after['cpu_us_per_request']:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Offline benchmark suite for the query-to-URL pipeline.
+
+A deterministic fake chat model with a configurable latency stands in for
+Ollama, and synthetic vocabularies of configurable size are installed in
+the vocabulary store in place of api.neurobagel.org, so that nothing leaves
+the machine. The suite measures:
+
+- get_api_url throughput and latency, with the query cache off and on,
+- each get_*_termURL resolver for exact, misspelled, abbreviated and
+  unknown terms, at several vocabulary sizes,
+- end-to-end requests per second through the FastAPI app.
+
+Results are saved as JSON. When a baseline is given, every metric is
+compared against it and the run fails if one regressed beyond the
+tolerance.
+
+Usage:
+    python -m benchmarks.bench_pipeline --output results.json
+    python -m benchmarks.bench_pipeline --baseline benchmarks/baseline.json
+    python -m benchmarks.bench_pipeline --save-baseline baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+import httpx
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from app.api.query_cache import query_cache
+from app.api.url_generator import get_api_url
+from app.llm_processing.extractions import (
+    ExtractionEngine,
+    set_extraction_engine,
+)
+from app.term_url_processing.term_url_mapper import (
+    get_assessment_termURL,
+    get_diagnosis_termURL,
+    get_image_modality_termURL,
+    get_sex_termURL,
+)
+from app.term_url_processing.term_url_mappings import (
+    assessment_url,
+    diagnosis_url,
+)
+from app.term_url_processing.vocabulary_store import vocabulary_store
+from benchmarks.bench_term_index import make_vocabulary
+
+BASE_API_URL = "https://api.neurobagel.org/query/?"
+QUERY_PATTERN = re.compile(r"diagnosed with (.+?) assessed with (.+?)\n")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model answering after a fixed latency with the
+    diagnosis and assessment named in the benchmark queries.
+    """
+
+    latency: float = 0.01
+
+    def _respond(self, messages: List[Any]) -> ChatResult:
+        match = QUERY_PATTERN.search(messages[-1].content)
+        response = (
+            {"diagnosis": match.group(1), "assessment": match.group(2)}
+            if match
+            else {}
+        )
+        message = AIMessage(content=json.dumps(response))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return self._respond(messages)
+
+    async def _agenerate(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ):
+        await asyncio.sleep(self.latency)
+        return self._respond(messages)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+
+def install_vocabularies(size: int) -> Dict[str, List[str]]:
+    """
+    Installs synthetic diagnosis and assessment vocabularies in the
+    vocabulary store, which is switched to offline mode.
+
+    Args:
+        size (int): Number of labels of each vocabulary.
+
+    Returns:
+        Dict[str, List[str]]: The labels of each vocabulary.
+    """
+    vocabulary_store.offline = True
+    labels = {}
+    for name, url, key, seed in (
+        ("diagnosis", diagnosis_url, "nb:Diagnosis", 0),
+        ("assessment", assessment_url, "nb:Assessment", 1),
+    ):
+        vocabulary = make_vocabulary(size, seed=seed)
+        vocabulary_store.seed(
+            url,
+            {
+                key: [
+                    {"Label": label, "TermURL": term_url}
+                    for label, term_url in vocabulary
+                ]
+            },
+            stale=False,
+        )
+        labels[name] = [label for label, _ in vocabulary]
+    return labels
+
+
+def make_queries(
+    labels: Dict[str, List[str]], count: int, seed: int = 2
+) -> List[str]:
+    """
+    Generates queries mixing rule-extracted fields with vocabulary terms.
+    """
+    rng = random.Random(seed)
+    return [
+        f"{rng.choice(['male', 'female'])} subjects aged"
+        f" {rng.randint(10, 40)} to {rng.randint(41, 90)} years"
+        f" diagnosed with {rng.choice(labels['diagnosis'])}"
+        f" assessed with {rng.choice(labels['assessment'])}"
+        for _ in range(count)
+    ]
+
+
+def latency_stats(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "per_second": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+def bench_get_api_url(queries: List[str]) -> Dict[str, float]:
+    """
+    Measures get_api_url sequentially, without and with the query cache.
+    """
+    results = {}
+    max_entries = query_cache.max_entries
+    for name, cache_size in (("uncached", 0), ("cached", max_entries)):
+        query_cache.clear()
+        query_cache.max_entries = cache_size
+        get_api_url(queries[0])  # warm-up, and fills the cache when on
+        latencies = []
+        start = time.perf_counter()
+        for query in queries if cache_size == 0 else queries[:1] * 100:
+            call_start = time.perf_counter()
+            get_api_url(query)
+            latencies.append(time.perf_counter() - call_start)
+        elapsed = time.perf_counter() - start
+        for key, value in latency_stats(latencies, elapsed).items():
+            results[f"get_api_url_{name}_{key}"] = value
+    query_cache.max_entries = max_entries
+    query_cache.clear()
+    return results
+
+
+def bench_resolvers(
+    labels: Dict[str, List[str]], calls: int, repeat: int = 3
+) -> Dict[str, float]:
+    """
+    Measures every resolver on exact, misspelled, abbreviated and unknown
+    terms, keeping the fastest of `repeat` runs.
+    """
+    rng = random.Random(3)
+
+    def misspell(label: str) -> str:
+        position = rng.randrange(len(label))
+        return label[:position] + label[position + 1 :]
+
+    resolvers: Dict[str, Callable[[str], Optional[str]]] = {
+        "diagnosis": get_diagnosis_termURL,
+        "assessment": get_assessment_termURL,
+        "sex": get_sex_termURL,
+        "image_modality": get_image_modality_termURL,
+    }
+    terms = {
+        "diagnosis": labels["diagnosis"],
+        "assessment": labels["assessment"],
+        "sex": ["male", "female", "other"],
+        "image_modality": ["T1 weighted", "T2 weighted", "flow weighted"],
+    }
+    abbreviations = {
+        "diagnosis": "ADHD",
+        "assessment": "BIS",
+        "sex": "M",
+        "image_modality": "EEG",
+    }
+
+    results = {}
+    for name, resolve in resolvers.items():
+        cases = {
+            "exact": lambda: rng.choice(terms[name]),
+            "fuzzy": lambda: misspell(rng.choice(terms[name])),
+            "abbreviation": lambda: abbreviations[name],
+            "unknown": lambda: f"unknown term {rng.randrange(1000)}",
+        }
+        for case, make_term in cases.items():
+            inputs = [make_term() for _ in range(calls)]
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for term in inputs:
+                    resolve(term)
+                timings.append(time.perf_counter() - start)
+            # The fastest run is the least disturbed by the rest of the host
+            results[f"resolve_{name}_{case}_us"] = min(timings) / calls * 1e6
+    return results
+
+
+async def bench_app(queries: List[str], concurrency: int) -> Dict[str, float]:
+    """
+    Measures end-to-end requests through the FastAPI app, with the given
+    number of concurrent clients.
+    """
+    from app.main import app
+
+    query_cache.clear()
+    transport = httpx.ASGITransport(app=app)  # type: ignore[arg-type]
+    latencies: List[float] = []
+    pending = list(queries)
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://benchmark"
+    ) as client:
+
+        async def worker() -> None:
+            while pending:
+                query = pending.pop()
+                start = time.perf_counter()
+                response = await client.post(
+                    "/generate_url/", json={"query": query}
+                )
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    stats = latency_stats(latencies, elapsed)
+    return {f"app_requests_{key}": value for key, value in stats.items()}
+
+
+def compare(
+    results: Dict[str, float], baseline: Dict[str, float], tolerance: float
+) -> List[str]:
+    """
+    Compares the metrics of a run against a baseline.
+
+    Throughputs (`*_per_second`) regress when they drop, and latencies
+    regress when they rise, by more than `tolerance` (a fraction).
+
+    Returns:
+        List[str]: The metrics that regressed.
+    """
+    regressions = []
+    for name, value in sorted(results.items()):
+        reference = baseline.get(name)
+        if not reference:
+            print(f"  {name:<46} {value:12.3f}   (no baseline)")
+            continue
+        change = (value - reference) / reference
+        higher_is_better = name.endswith("_per_second")
+        regressed = (
+            change < -tolerance if higher_is_better else change > tolerance
+        )
+        if regressed:
+            regressions.append(name)
+        print(
+            f"  {name:<46} {value:12.3f} {change:+8.1%}"
+            f"{'   REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--resolver-calls", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--output", help="Where to save the results.")
+    parser.add_argument("--baseline", help="Results to compare against.")
+    parser.add_argument(
+        "--save-baseline", help="Save the results as baseline."
+    )
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args()
+
+    os.environ.setdefault("NB_API_QUERY_URL", BASE_API_URL)
+    set_extraction_engine(
+        ExtractionEngine(llm=FakeChatModel(latency=args.latency))
+    )
+
+    metrics: Dict[str, float] = {}
+    for size in args.sizes:
+        labels = install_vocabularies(size)
+        for name, value in bench_resolvers(
+            labels, args.resolver_calls, args.repeat
+        ).items():
+            metrics[f"{size}_{name}"] = value
+
+    # The pipeline is measured against the largest vocabulary
+    queries = make_queries(labels, args.queries)
+    metrics.update(bench_get_api_url(queries))
+    metrics.update(asyncio.run(bench_app(queries, args.concurrency)))
+    set_extraction_engine(None)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "baseline", "save_baseline")
+        },
+        "metrics": metrics,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+                f.write("\n")
+
+    baseline: Dict[str, float] = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["metrics"]
+    regressions = compare(metrics, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} metrics regressed beyond the tolerance")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+Compares term lookups through a TermIndex with the per-call difflib scan the
+term URL mapper used to do, on synthetic vocabularies of increasing size.
+
+Usage:
+    python -m benchmarks.bench_term_index --sizes 1000 10000 100000
+"""
+
+import argparse
+import difflib
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+from app.term_url_processing.term_index import TermIndex
+
+SYLLABLES = [
+    "neuro",
+    "cardio",
+    "psych",
+    "derm",
+    "gastro",
+    "hepat",
+    "nephr",
+    "oste",
+    "arthr",
+    "my",
+    "enceph",
+    "mening",
+    "lymph",
+    "angi",
+    "thromb",
+    "leuk",
+    "itis",
+    "osis",
+    "algia",
+    "pathy",
+    "oma",
+    "emia",
+    "plasia",
+    "trophy",
+]
+WORDS = [
+    "disorder",
+    "disease",
+    "syndrome",
+    "injury",
+    "of",
+    "brain",
+    "chronic",
+    "acute",
+    "primary",
+    "secondary",
+    "scale",
+    "task",
+    "questionnaire",
+    "inventory",
+    "test",
+    "memory",
+    "anxiety",
+    "risk",
+    "visual",
+    "spinal",
+]
+
+
+def make_vocabulary(size: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """
+    Generates a synthetic vocabulary of unique labels.
+
+    Args:
+        size (int): Number of labels to generate.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        List[Tuple[str, str]]: Pairs of label and TermURL.
+    """
+    rng = random.Random(seed)
+    labels: Dict[str, str] = {}
+    while len(labels) < size:
+        term = "".join(rng.choices(SYLLABLES, k=rng.randint(2, 3)))
+        words = rng.choices(WORDS, k=rng.randint(1, 3))
+        labels.setdefault(" ".join([term, *words]), f"snomed:{len(labels)}")
+    return list(labels.items())
+
+
+def make_queries(
+    vocabulary: List[Tuple[str, str]], count: int, seed: int = 1
+) -> List[str]:
+    """
+    Generates a mix of exact, misspelled and unknown queries.
+
+    Args:
+        vocabulary (List[Tuple[str, str]]): The vocabulary to draw labels from.
+        count (int): Number of queries to generate.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        List[str]: The queries.
+    """
+    rng = random.Random(seed)
+    queries = []
+    for i in range(count):
+        label = rng.choice(vocabulary)[0]
+        if i % 3 == 0:
+            queries.append(label.upper())
+        elif i % 3 == 1:
+            position = rng.randrange(len(label))
+            queries.append(label[:position] + label[position + 1 :])
+        else:
+            queries.append("unknown term " + str(i))
+    return queries
+
+
+def difflib_match(
+    vocabulary: List[Tuple[str, str]], query: str
+) -> Optional[str]:
+    """
+    The lookup the term URL mapper did on every call before the TermIndex.
+    """
+    query = query.lower()
+    labels = [label.lower() for label, _ in vocabulary]
+    for label, term_url in vocabulary:
+        if label.lower() == query:
+            return term_url
+    closest_matches = difflib.get_close_matches(query, labels, n=1, cutoff=0.6)
+    if closest_matches:
+        for label, term_url in vocabulary:
+            if label.lower() == closest_matches[0]:
+                return term_url
+    return None
+
+
+def run(size: int, queries_count: int) -> Dict[str, float]:
+    """
+    Benchmarks both lookups on a vocabulary of the given size.
+
+    Args:
+        size (int): Number of labels in the vocabulary.
+        queries_count (int): Number of queries to run.
+
+    Returns:
+        Dict[str, float]: Build time, per-query latencies, speedup and agreement.
+    """
+    vocabulary = make_vocabulary(size)
+    queries = make_queries(vocabulary, queries_count)
+
+    start = time.perf_counter()
+    term_index = TermIndex(vocabulary)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index_results = [term_index.match(query) for query in queries]
+    index_seconds = (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    difflib_results = [difflib_match(vocabulary, query) for query in queries]
+    difflib_seconds = (time.perf_counter() - start) / len(queries)
+
+    agreement = sum(
+        a == b for a, b in zip(index_results, difflib_results)
+    ) / len(queries)
+    return {
+        "size": size,
+        "build_ms": build_seconds * 1000,
+        "difflib_ms_per_query": difflib_seconds * 1000,
+        "index_ms_per_query": index_seconds * 1000,
+        "speedup": difflib_seconds / index_seconds,
+        "agreement": agreement,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    parser.add_argument("--queries", type=int, default=30)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        result = run(size, args.queries)
+        print(
+            f"{result['size']:>7} labels | build {result['build_ms']:8.1f} ms"
+            f" | difflib {result['difflib_ms_per_query']:9.3f} ms/query"
+            f" | index {result['index_ms_per_query']:7.3f} ms/query"
+            f" | speedup {result['speedup']:7.1f}x"
+            f" | agreement {result['agreement']:.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
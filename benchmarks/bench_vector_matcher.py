@@ -0,0 +1,154 @@
+"""
+Compares fuzzy label matching with difflib, the trigram inverted index and
+the NumPy hashed trigram vectors, for latency and for agreement with difflib.
+Agreement is measured on the fuzzy lookups of the term URL mapper tests and
+on synthetic vocabularies of increasing size.
+
+Usage:
+    python -m benchmarks.bench_vector_matcher --sizes 1000 10000 --dims 512
+"""
+
+import argparse
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from app.term_url_processing.term_index import TermIndex
+from app.term_url_processing.vector_matcher import VectorMatcher
+from benchmarks.bench_term_index import (
+    difflib_match,
+    make_queries,
+    make_vocabulary,
+)
+
+# Vocabularies and fuzzy queries of tests/test_term_url_mapper.py
+TEST_CASES: List[Tuple[List[str], List[str]]] = [
+    (
+        [
+            "attention deficit hyperactivity disorder",
+            "concussion injury of brain",
+            "Obsessive-compulsive disorder",
+            "Parkinson's disease",
+            "Fibromyalgia",
+        ],
+        ["Concussion injury Of brain", "adhd", "Parkinsons", "fibromalgia"],
+    ),
+    (
+        [
+            "zuckerman sensation seeking scale",
+            "big five questionnaire",
+            "balloon analogue risk task",
+        ],
+        ["zuckerman scale", "balloon analogue", "unknown"],
+    ),
+    (
+        ["arterial spin labeling", "flow weighted", "Electroencephalogram"],
+        ["arterial labeling", "flow weighted", "unknown image modality"],
+    ),
+    (["male", "female", "other"], ["fem", "M", "unknown"]),
+]
+
+
+def cosine_match(
+    matcher: VectorMatcher,
+    term_urls: Dict[str, str],
+    query: str,
+    cutoff: float,
+) -> Optional[str]:
+    """
+    Pure cosine matching: the most similar label, if similar enough.
+    """
+    top = matcher.top_k(query, 1)
+    if top and top[0][1] >= cutoff:
+        return term_urls[top[0][0]]
+    return None
+
+
+def measure(
+    matchers: Dict[str, Callable[[str], Optional[str]]],
+    queries: List[str],
+) -> Dict[str, Tuple[float, List[Optional[str]]]]:
+    """
+    Runs every matcher over the queries.
+
+    Returns:
+        Dict[str, Tuple[float, List[Optional[str]]]]: Milliseconds per query
+        and results of each matcher.
+    """
+    results = {}
+    for name, match in matchers.items():
+        start = time.perf_counter()
+        matches = [match(query) for query in queries]
+        elapsed = time.perf_counter() - start
+        results[name] = (elapsed / len(queries) * 1000, matches)
+    return results
+
+
+def build_matchers(
+    vocabulary: List[Tuple[str, str]], dims: int, cosine_cutoff: float
+) -> Dict[str, Callable[[str], Optional[str]]]:
+    trigram_index = TermIndex(vocabulary)
+    vector_index = TermIndex(vocabulary, vector_dims=dims)
+    matcher = VectorMatcher((label for label, _ in vocabulary), dims=dims)
+    term_urls = {label.lower(): term_url for label, term_url in vocabulary}
+    return {
+        "difflib": lambda query: difflib_match(vocabulary, query),
+        "trigram index": trigram_index.match,
+        "vector index": vector_index.match,
+        "cosine only": lambda query: term_urls.get(query.lower())
+        or cosine_match(matcher, term_urls, query, cosine_cutoff),
+    }
+
+
+def report(title: str, results: Dict[str, Tuple[float, list]]) -> None:
+    _, reference = results["difflib"]
+    print(title)
+    for name, (ms_per_query, matches) in results.items():
+        agreement = sum(a == b for a, b in zip(matches, reference)) / len(
+            reference
+        )
+        print(
+            f"  {name:>13} | {ms_per_query:9.3f} ms/query"
+            f" | agreement with difflib {agreement:.0%}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--dims", type=int, default=512)
+    parser.add_argument("--cosine-cutoff", type=float, default=0.5)
+    args = parser.parse_args()
+
+    test_results: Dict[str, Tuple[float, list]] = {}
+    test_queries = sum(len(queries) for _, queries in TEST_CASES)
+    for labels, queries in TEST_CASES:
+        vocabulary = [(label, f"termURL:{label}") for label in labels]
+        results = measure(
+            build_matchers(vocabulary, args.dims, args.cosine_cutoff), queries
+        )
+        for name, (ms_per_query, matches) in results.items():
+            total, all_matches = test_results.get(name, (0.0, []))
+            test_results[name] = (
+                total + ms_per_query * len(queries) / test_queries,
+                all_matches + matches,
+            )
+    report("term URL mapper test cases", test_results)
+
+    for size in args.sizes:
+        vocabulary = make_vocabulary(size)
+        queries = make_queries(vocabulary, args.queries)
+        start = time.perf_counter()
+        matcher = VectorMatcher((label for label, _ in vocabulary), args.dims)
+        build_ms = (time.perf_counter() - start) * 1000
+        results = measure(
+            build_matchers(vocabulary, args.dims, args.cosine_cutoff), queries
+        )
+        report(
+            f"{size} labels (matrix {matcher.matrix.nbytes / 2**20:.1f} MiB,"
+            f" built in {build_ms:.0f} ms)",
+            results,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
 #!/bin/bash
 
-# Start the Ollama services first
+MODEL="${OLLAMA_MODEL:-mistral}"
+
+# Start the Ollama server first, and wait until it accepts requests
 ollama serve &
-ollama pull mistral &
-ollama run mistral &
+until ollama list > /dev/null 2>&1; do
+    sleep 1
+done
+
+# Pull the model in the background. The application loads it as part of its
+# warm-up once it is available, and only reports ready (/ready) after that
+ollama pull "$MODEL" &
 
 # Start the FastAPI application
 uvicorn app.main:app --host 0.0.0.0 --port 8000
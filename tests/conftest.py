@@ -0,0 +1,12 @@
+import pytest
+from app.api.query_cache import query_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_query_cache():
+    """
+    Keeps responses cached by one test from leaking into the next.
+    """
+    query_cache.clear()
+    yield
+    query_cache.clear()
@@ -0,0 +1,75 @@
+from unittest.mock import patch
+from app.term_url_processing.abbreviation_index import AbbreviationIndex
+from app.term_url_processing.term_index import TermIndex
+from app.term_url_processing.term_url_mapper import (
+    get_abbreviation_index,
+    get_assessment_termURL,
+)
+from app.term_url_processing.vocabulary_store import vocabulary_store
+
+TABLE = [
+    {
+        "label": "behavioral approach/inhibition systems",
+        "abbreviations": ["BIS"],
+    },
+    {"label": "Barratt Impulsiveness Scale", "abbreviations": ["BIS", "BIS"]},
+    {"label": "DOSPERT", "abbreviations": ["DO", "DOTS"]},
+]
+
+
+def test_labels_keep_table_order() -> None:
+    """
+    Colliding abbreviations keep every label once, in table order.
+    """
+    abbreviation_index = AbbreviationIndex(TABLE)
+    assert abbreviation_index.labels("bis") == (
+        "behavioral approach/inhibition systems",
+        "barratt impulsiveness scale",
+    )
+    assert abbreviation_index.labels("DOTS") == ("dospert",)
+    assert abbreviation_index.labels("unknown") == ()
+
+
+def test_collision_resolves_to_first_known_label() -> None:
+    """
+    An ambiguous abbreviation resolves to the first label in the vocabulary.
+    """
+    abbreviation_index = AbbreviationIndex(TABLE)
+    both = TermIndex(
+        [
+            ("Barratt Impulsiveness Scale", "nb:Barratt"),
+            ("behavioral approach/inhibition systems", "nb:BAS"),
+        ]
+    )
+    only_barratt = TermIndex([("Barratt Impulsiveness Scale", "nb:Barratt")])
+    assert abbreviation_index.resolve("BIS", both) == "nb:BAS"
+    assert abbreviation_index.resolve("BIS", only_barratt) == "nb:Barratt"
+    assert abbreviation_index.resolve("XYZ", both) is None
+
+
+def test_abbreviation_index_is_built_once() -> None:
+    """
+    The index of a table is reused until the table is replaced.
+    """
+    assert get_abbreviation_index("test", TABLE) is get_abbreviation_index(
+        "test", TABLE
+    )
+    assert get_abbreviation_index("test", TABLE) is not (
+        get_abbreviation_index("test", list(TABLE))
+    )
+
+
+def test_abbreviation_does_not_refetch_vocabulary() -> None:
+    """
+    Resolving an abbreviation reads the vocabulary only once.
+    """
+    vocabulary = {
+        "nb:Assessment": [
+            {"TermURL": "nb:Barratt", "Label": "Barratt Impulsiveness Scale"}
+        ]
+    }
+    with patch.object(
+        vocabulary_store, "get", return_value=vocabulary
+    ) as mock_get:
+        assert get_assessment_termURL("BIS") == "nb:Barratt"
+    mock_get.assert_called_once()
@@ -0,0 +1,100 @@
+import json
+from typing import List
+from langchain_core.language_models.chat_models import SimpleChatModel
+from app.term_url_processing.abbreviations.abbreviations_generator import (
+    generate_abbreviations,
+    parse_abbreviations,
+)
+
+
+class InitialsChatModel(SimpleChatModel):
+    """
+    Fake chat model answering with the initials of the quoted term, and
+    recording the terms it was asked about.
+    """
+
+    model: str = "initials"
+    fail_on: List[str] = []
+    terms: List[str] = []
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        term = messages[-1].content.split('Input: "')[1].split('"')[0]
+        self.terms.append(term)
+        if term in self.fail_on:
+            raise ValueError("Model unavailable")
+        initials = "".join(word[0] for word in term.split()).upper()
+        return f"'{initials}', '{initials}s'."
+
+    @property
+    def _llm_type(self) -> str:
+        return "initials"
+
+
+def read_output(path) -> list:
+    return json.loads(path.read_text().split(" = ", 1)[1])
+
+
+def test_parse_abbreviations() -> None:
+    """
+    Quotes, trailing periods and empty items are dropped.
+    """
+    assert parse_abbreviations("'DM', 'DM2', 'DM1'.") == ["DM", "DM2", "DM1"]
+    assert parse_abbreviations("") == []
+
+
+def test_generation_is_resumed_from_checkpoint(tmp_path, capsys) -> None:
+    """
+    Re-runs only generate terms that are new or failed previously, and keep
+    the output in input order.
+    """
+    output = tmp_path / "abbreviations_test.py"
+    llm = InitialsChatModel(fail_on=["Bipolar disorder"])
+
+    stats = generate_abbreviations(
+        ["Major depressive disorder", "Bipolar disorder", ""],
+        str(output),
+        workers=2,
+        llm=llm,
+    )
+    assert stats["generated"] == 1 and stats["failed"] == 1
+    assert (
+        "Terms left out of the output, re-run to retry: 'Bipolar disorder'"
+        in capsys.readouterr().out
+    )
+    assert read_output(output) == [
+        {
+            "label": "Major depressive disorder",
+            "abbreviations": ["MDD", "MDDs"],
+        }
+    ]
+    checkpoint = tmp_path / "abbreviations_test.checkpoint.jsonl"
+    assert len(checkpoint.read_text().splitlines()) == 1
+
+    llm = InitialsChatModel()
+    stats = generate_abbreviations(
+        ["Bipolar disorder", "Major depressive disorder", "Fibromyalgia"],
+        str(output),
+        workers=2,
+        llm=llm,
+    )
+    assert sorted(llm.terms) == ["Bipolar disorder", "Fibromyalgia"]
+    assert stats["reused"] == 1 and stats["generated"] == 2
+    assert [item["label"] for item in read_output(output)] == [
+        "Bipolar disorder",
+        "Major depressive disorder",
+        "Fibromyalgia",
+    ]
+
+
+def test_changed_model_regenerates_terms(tmp_path) -> None:
+    """
+    Checkpointed results of another model are not reused.
+    """
+    output = tmp_path / "abbreviations_test.py"
+    generate_abbreviations(
+        ["Fibromyalgia"], str(output), llm=InitialsChatModel()
+    )
+
+    llm = InitialsChatModel(model="other")
+    generate_abbreviations(["Fibromyalgia"], str(output), llm=llm)
+    assert llm.terms == ["Fibromyalgia"]
@@ -0,0 +1,138 @@
+import asyncio
+import pytest
+from typing import Tuple
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from app.admission import (
+    BATCH,
+    INTERACTIVE,
+    AdmissionController,
+    Overloaded,
+    admission_controller,
+)
+from app.llm_processing.extractions import (
+    ExtractionEngine,
+    set_extraction_engine,
+)
+from app.main import app
+
+client = TestClient(app)
+
+
+def test_interactive_calls_are_admitted_before_batch_ones() -> None:
+    """
+    Calls beyond the concurrency limit wait, and a freed slot goes to the
+    interactive lane first.
+    """
+    controller = AdmissionController(max_concurrency=1)
+    admitted = []
+
+    async def call(lane: str, name: str) -> None:
+        async with controller.admit(lane):
+            admitted.append(name)
+            await asyncio.sleep(0)
+
+    async def main() -> None:
+        await controller.acquire(INTERACTIVE)
+        tasks = [
+            asyncio.create_task(call(BATCH, "batch")),
+            asyncio.create_task(call(INTERACTIVE, "interactive")),
+        ]
+        await asyncio.sleep(0)
+        assert controller.waiting() == 2
+        controller.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert admitted == ["interactive", "batch"]
+    assert controller.active == 0
+
+
+def test_full_lane_is_rejected_and_long_waits_give_up() -> None:
+    """
+    A call arriving at a full lane is refused with 429, and one that waits
+    longer than its lane allows gives up with 503, both with a Retry-After.
+    """
+    controller = AdmissionController(
+        max_concurrency=1,
+        queue_sizes={INTERACTIVE: 1},
+        max_waits={INTERACTIVE: 0.01},
+    )
+
+    async def main() -> Tuple[Overloaded, Overloaded]:
+        await controller.acquire(INTERACTIVE)
+        waiting = asyncio.create_task(controller.acquire(INTERACTIVE))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as rejected:
+            await controller.acquire(INTERACTIVE)
+        with pytest.raises(Overloaded) as timed_out:
+            await waiting
+        return rejected.value, timed_out.value
+
+    rejected, timed_out = asyncio.run(main())
+    assert rejected.status_code == 429
+    assert timed_out.status_code == 503
+    assert rejected.retry_after >= 1
+    assert controller.waiting() == 0
+
+
+def test_cancelled_call_leaves_the_queue() -> None:
+    """
+    A call cancelled while waiting, e.g. at its deadline, gives up its
+    place without taking a slot.
+    """
+    controller = AdmissionController(max_concurrency=1)
+
+    async def main() -> None:
+        await controller.acquire(INTERACTIVE)
+        waiting = asyncio.create_task(controller.acquire(INTERACTIVE))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert controller.waiting() == 0
+        controller.release()
+
+    asyncio.run(main())
+    assert controller.active == 0
+
+
+def test_overloaded_requests_are_refused_with_retry_after(
+    monkeypatch,
+) -> None:
+    """
+    /generate_url/ answers 429 with a Retry-After when the LLM is saturated,
+    without retrying, and a stream is refused before it starts.
+    """
+    monkeypatch.setenv(
+        "NB_API_QUERY_URL", "https://api.neurobagel.org/query/?"
+    )
+    full = AdmissionController(max_concurrency=0, queue_sizes={INTERACTIVE: 0})
+    set_extraction_engine(
+        ExtractionEngine(
+            llm=FakeListChatModel(responses=['{"diagnosis": "adhd"}']),
+            admission=full,
+        )
+    )
+    try:
+        response = client.post(
+            "/generate_url/", json={"query": "subjects with adhd"}
+        )
+    finally:
+        set_extraction_engine(None)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.headers["X-Retry-Count"] == "0"
+
+    with patch.object(
+        admission_controller,
+        "check",
+        side_effect=Overloaded("busy", status_code=429, retry_after=3),
+    ):
+        response = client.post(
+            "/generate_url/",
+            json={"query": "subjects with adhd"},
+            headers={"Accept": "text/event-stream"},
+        )
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3"
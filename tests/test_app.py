@@ -1,5 +1,17 @@
+import asyncio
+import json
+import time
+from typing import Dict
+import httpx
 import pytest
 from fastapi.testclient import TestClient
+from langchain_core.language_models import SimpleChatModel
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from app.api.query_cache import query_cache
+from app.llm_processing.extractions import (
+    ExtractionEngine,
+    set_extraction_engine,
+)
 from app.main import app
 from unittest.mock import patch
 
@@ -45,13 +57,232 @@ def test_root():
     ],
 )
 @patch(
-    "app.router.routes.get_api_url",
+    "app.router.routes.aget_api_url",
 )
 def test_generate_url(
-    mock_get_api_url, query, expected_status_code, expected_response
+    mock_aget_api_url, query, expected_status_code, expected_response
 ):
-    mock_get_api_url.return_value = expected_response
+    mock_aget_api_url.return_value = expected_response
     response = client.post("/generate_url/", json={"query": query})
 
     assert response.status_code == expected_status_code
     assert response.json() == {"response": expected_response}
+
+
+class SlowChatModel(FakeListChatModel):
+    """
+    Fake chat model that takes `latency` seconds to answer, like a real LLM,
+    and counts its calls and how many of them overlap.
+    """
+
+    latency: float = 0.2
+    calls: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+
+    async def _agenerate(self, *args, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        return await super()._agenerate(*args, **kwargs)
+
+
+def test_generate_url_overlaps_concurrent_requests(monkeypatch):
+    """
+    Concurrent requests overlap their LLM waits instead of being served one
+    at a time, so throughput scales with the number of in-flight requests.
+    The queries are distinct, so that neither the response cache nor
+    single-flight can serve them without the LLM.
+    """
+    monkeypatch.setenv(
+        "NB_API_QUERY_URL", "https://api.neurobagel.org/query/?"
+    )
+    query_cache.clear()
+    latency = 0.2
+    llm = SlowChatModel(
+        responses=['{"image_modal": "T2 weighted"}'], latency=latency
+    )
+    set_extraction_engine(ExtractionEngine(llm=llm))
+
+    async def send(sites: str) -> float:
+        transport = httpx.ASGITransport(app=app)  # type: ignore[arg-type]
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as async_client:
+            start = time.perf_counter()
+            responses = await asyncio.gather(
+                *(
+                    async_client.post(
+                        "/generate_url/",
+                        json={
+                            "query": f"subjects with T2 weighted scans "
+                            f"from site {site}"
+                        },
+                    )
+                    for site in sites
+                )
+            )
+            elapsed = time.perf_counter() - start
+        assert all(
+            response.json()
+            == {
+                "response": "https://api.neurobagel.org/query/?image_modal=nidm:T2Weighted"
+            }
+            for response in responses
+        )
+        return elapsed
+
+    try:
+        single = asyncio.run(send("a"))
+        concurrent = asyncio.run(send("bcdefghi"))
+    finally:
+        set_extraction_engine(None)
+        query_cache.clear()
+
+    assert llm.calls == 9
+    assert llm.max_in_flight == 8
+    # Served one at a time, 8 requests would take 8 times the LLM latency
+    assert concurrent < 3 * latency
+    assert 8 / concurrent > 3 * (1 / single)
+
+
+class KeywordChatModel(SimpleChatModel):
+    """
+    Fake chat model answering with the response of the first keyword found
+    in the prompt, and counting its calls.
+    """
+
+    responses: Dict[str, str]
+    calls: int = 0
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        prompt = messages[-1].content
+        for keyword, response in self.responses.items():
+            if keyword in prompt:
+                return response
+        raise ValueError("Unexpected prompt")
+
+    @property
+    def _llm_type(self) -> str:
+        return "keyword"
+
+
+@pytest.fixture
+def keyword_llm(monkeypatch):
+    monkeypatch.setenv(
+        "NB_API_QUERY_URL", "https://api.neurobagel.org/query/?"
+    )
+    llm = KeywordChatModel(
+        responses={
+            "T1 weighted scans": '{"image_modal": "T1 weighted"}',
+            "T2 weighted scans": '{"image_modal": "T2 weighted"}',
+            "garbled request": "not json",
+        }
+    )
+    set_extraction_engine(ExtractionEngine(llm=llm))
+    yield llm
+    set_extraction_engine(None)
+
+
+BATCH_QUERIES = [
+    "subjects with T1 weighted scans",
+    "subjects with T2 weighted scans",
+    "Subjects with T1 weighted scans?",
+    "garbled request",
+    "male healthy control subjects",
+]
+
+
+def test_generate_urls_dedupes_and_keeps_order(keyword_llm):
+    """
+    The batch endpoint returns one result per query, in order, resolves
+    duplicate queries once and reports per-item errors.
+    """
+    response = client.post("/generate_urls/", json={"queries": BATCH_QUERIES})
+
+    assert response.status_code == 200
+    results = response.json()["responses"]
+    assert [result["query"] for result in results] == BATCH_QUERIES
+    assert results[0]["response"] == (
+        "https://api.neurobagel.org/query/?image_modal=nidm:T1Weighted"
+    )
+    assert results[1]["response"] == (
+        "https://api.neurobagel.org/query/?image_modal=nidm:T2Weighted"
+    )
+    assert results[2] == {**results[0], "query": BATCH_QUERIES[2]}
+    assert "error" in results[3]
+    assert results[4]["response"] == (
+        "https://api.neurobagel.org/query/?sex=snomed:248153007&is_control=true"
+    )
+    # The duplicate query and the rule-covered query never reach the LLM
+    assert keyword_llm.calls == 3
+
+
+def test_generate_urls_streams_ndjson(keyword_llm):
+    """
+    Batches are streamed back as NDJSON when the client asks for it.
+    """
+    response = client.post(
+        "/generate_urls/",
+        json={"queries": BATCH_QUERIES},
+        headers={"Accept": "application/x-ndjson"},
+    )
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["query"] for line in lines] == BATCH_QUERIES
+
+
+def parse_events(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append(
+            (event.removeprefix("event: "), json.loads(data[len("data: ") :]))
+        )
+    return events
+
+
+def test_generate_url_streams_server_sent_events(keyword_llm):
+    """
+    Fields and TermURLs are streamed as server-sent events before the URL.
+    """
+    response = client.post(
+        "/generate_url/",
+        json={"query": "female subjects with T2 weighted scans"},
+        headers={"Accept": "text/event-stream"},
+    )
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert parse_events(response.text) == [
+        ("field", {"name": "image_modal", "value": "t2 weighted"}),
+        ("term_url", {"name": "image_modal", "term_url": "nidm:T2Weighted"}),
+        ("field", {"name": "sex", "value": "female"}),
+        ("term_url", {"name": "sex", "term_url": "snomed:248152002"}),
+        (
+            "url",
+            {
+                "response": "https://api.neurobagel.org/query/?"
+                "sex=snomed:248152002&image_modal=nidm:T2Weighted"
+            },
+        ),
+    ]
+
+
+def test_generate_url_stream_reports_errors(keyword_llm):
+    """
+    Errors raised after the stream has started are sent as an error event.
+    """
+    response = client.post(
+        "/generate_url/",
+        json={"query": "garbled request"},
+        headers={"Accept": "text/event-stream"},
+    )
+
+    assert response.status_code == 200
+    assert [event for event, _ in parse_events(response.text)] == ["error"]
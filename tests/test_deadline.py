@@ -0,0 +1,165 @@
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from tenacity import Retrying
+from app.deadline import (
+    DeadlineExceeded,
+    RequestBudget,
+    request_budget,
+    resolve_timeout,
+)
+from app.api.url_generator import stream_api_url
+from app.llm_processing.extractions import (
+    ExtractionEngine,
+    aextract_information,
+    set_extraction_engine,
+)
+from app.main import app
+
+client = TestClient(app)
+
+
+class SlowChatModel(FakeListChatModel):
+    latency: float = 5.0
+
+    async def _agenerate(self, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        return await super()._agenerate(*args, **kwargs)
+
+    async def _astream(self, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        async for chunk in super()._astream(*args, **kwargs):
+            yield chunk
+
+
+@pytest.fixture
+def slow_llm(monkeypatch):
+    monkeypatch.setenv(
+        "NB_API_QUERY_URL", "https://api.neurobagel.org/query/?"
+    )
+    set_extraction_engine(
+        ExtractionEngine(
+            llm=SlowChatModel(responses=['{"image_modal": "T1 weighted"}'])
+        )
+    )
+    yield
+    set_extraction_engine(None)
+
+
+def test_retries_are_drawn_from_shared_budget() -> None:
+    """
+    Retries stop once the request's retry budget is spent, whichever stage
+    they come from.
+    """
+    budget = RequestBudget(timeout=None, max_retries=2)
+    attempts = []
+
+    def failing_stage() -> None:
+        attempts.append(time.monotonic())
+        raise ValueError("failure")
+
+    with pytest.raises(ValueError):
+        for attempt in Retrying(**budget.retry_policy()):
+            with attempt:
+                failing_stage()
+
+    # The budget is already spent, so a later stage gets a single attempt
+    with pytest.raises(ValueError):
+        for attempt in Retrying(**budget.retry_policy()):
+            with attempt:
+                failing_stage()
+
+    assert len(attempts) == 4
+    assert budget.retries == 2
+
+
+def test_llm_call_is_cancelled_at_deadline(slow_llm) -> None:
+    """
+    The LLM call is cancelled as soon as the request deadline is reached.
+    """
+
+    async def extract() -> None:
+        with request_budget(timeout=0.2):
+            await aextract_information("subjects with T1 weighted scans")
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(extract())
+    assert time.monotonic() - start < 1
+
+
+def test_stream_is_cut_off_at_deadline(slow_llm) -> None:
+    """
+    A streamed response stops generating once the request deadline is
+    reached.
+    """
+
+    async def stream() -> list:
+        with request_budget(timeout=0.2):
+            return [
+                event
+                async for event in stream_api_url(
+                    "subjects with T1 weighted scans"
+                )
+            ]
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(stream())
+    assert time.monotonic() - start < 1
+
+
+def test_request_timeout_header(slow_llm) -> None:
+    """
+    A client can shorten the deadline with the X-Request-Timeout header and
+    gets a 504 when it is exceeded.
+    """
+    response = client.post(
+        "/generate_url/",
+        json={"query": "subjects with T1 weighted scans"},
+        headers={"X-Request-Timeout": "0.2"},
+    )
+
+    assert response.status_code == 504
+    assert response.headers["X-Retry-Count"] == "0"
+
+
+def test_retry_count_is_reported(monkeypatch) -> None:
+    """
+    The number of retries a request needed is reported in a header.
+    """
+    monkeypatch.setenv(
+        "NB_API_QUERY_URL", "https://api.neurobagel.org/query/?"
+    )
+    set_extraction_engine(
+        ExtractionEngine(
+            llm=FakeListChatModel(
+                responses=["not json", '{"image_modal": "T1 weighted"}']
+            )
+        )
+    )
+    try:
+        response = client.post(
+            "/generate_url/", json={"query": "subjects with T1 weighted scans"}
+        )
+    finally:
+        set_extraction_engine(None)
+
+    assert response.json() == {
+        "response": "https://api.neurobagel.org/query/?image_modal=nidm:T1Weighted"
+    }
+    assert response.headers["X-Retry-Count"] == "1"
+
+
+@pytest.mark.parametrize(
+    "requested, expected",
+    [(None, 30.0), (0, 30.0), (0.05, 1.0), (5, 5.0), (1000, 120.0)],
+)
+def test_resolve_timeout(requested, expected) -> None:
+    """
+    Requested timeouts are honoured within the configured minimum and
+    maximum.
+    """
+    assert resolve_timeout(requested) == expected
@@ -0,0 +1,113 @@
+import asyncio
+import itertools
+import pytest
+from unittest.mock import patch
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from app.llm_processing.extraction_cache import (
+    SQLiteExtractionCache,
+    extraction_cache_key,
+)
+from app.llm_processing.extractions import ExtractionEngine
+
+
+@pytest.fixture
+def cache_url(tmp_path) -> str:
+    return f"sqlite:///{tmp_path / 'extractions.db'}"
+
+
+def make_engine(cache_url: str, response: str, **kwargs) -> ExtractionEngine:
+    return ExtractionEngine(
+        llm=FakeListChatModel(responses=[response]),
+        cache=SQLiteExtractionCache(cache_url),
+        **kwargs,
+    )
+
+
+def test_extractions_survive_restarts(cache_url) -> None:
+    """
+    An extraction made by one engine is served from the cache to another
+    one, e.g. after a restart or in another worker, for any spelling of the
+    query.
+    """
+    first = make_engine(cache_url, '{"diagnosis": "ADHD"}')
+    assert first.extract("Subjects with ADHD") == {
+        "diagnosis": "adhd",
+        "is_control": False,
+    }
+    first.close()
+
+    restarted = make_engine(cache_url, '{"diagnosis": "not cached"}')
+    assert restarted.extract("subjects with adhd?") == {
+        "diagnosis": "adhd",
+        "is_control": False,
+    }
+    assert asyncio.run(restarted.aextract("subjects  with ADHD")) == {
+        "diagnosis": "adhd",
+        "is_control": False,
+    }
+    assert asyncio.run(
+        restarted.aextract_batch(["subjects with adhd", "subjects with ocd"])
+    ) == [
+        {"diagnosis": "adhd", "is_control": False},
+        {"diagnosis": "not cached", "is_control": False},
+    ]
+    assert restarted.cache is not None
+    assert len(restarted.cache) == 2
+
+
+def test_prompt_changes_miss_the_cache(cache_url) -> None:
+    """
+    Extractions made with another model or prompt are not reused.
+    """
+    make_engine(cache_url, '{"diagnosis": "adhd"}').extract("adhd")
+    other_prompt = make_engine(
+        cache_url, '{"diagnosis": "ocd"}', output_format="json"
+    )
+    other_model = make_engine(cache_url, '{"diagnosis": "ocd"}', model="phi3")
+
+    assert other_prompt.extract("adhd")["diagnosis"] == "ocd"
+    assert other_model.extract("adhd")["diagnosis"] == "ocd"
+    assert extraction_cache_key("ADHD?", "mistral", "a") == (
+        extraction_cache_key("adhd", "mistral", "a")
+    )
+
+
+def test_least_recently_read_entries_are_evicted(cache_url) -> None:
+    """
+    Beyond its size, the cache drops the entries read least recently.
+    """
+    cache = SQLiteExtractionCache(cache_url, max_entries=2)
+    clock = itertools.count(start=0, step=100)
+    with patch(
+        "app.llm_processing.extraction_cache.time.time",
+        side_effect=lambda: next(clock),
+    ):
+        cache.set("a", {"sex": "male"})
+        cache.set("b", {"sex": "female"})
+        assert cache.get("a") == {"sex": "male"}
+        cache.set("c", {"sex": "other"})
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == {"sex": "male"}
+
+
+def test_eviction_trims_a_batch_below_the_size(cache_url) -> None:
+    """
+    Once full, the cache evicts the least recently read entries down to 90%
+    of its size, rather than one entry on every write.
+    """
+    cache = SQLiteExtractionCache(cache_url, max_entries=20)
+    clock = itertools.count(start=0, step=100)
+    with patch(
+        "app.llm_processing.extraction_cache.time.time",
+        side_effect=lambda: next(clock),
+    ):
+        for position in range(20):
+            cache.set(str(position), {"min_age": position})
+        assert len(cache) == 20
+        cache.set("20", {"min_age": 20})
+
+    assert len(cache) == 18
+    assert [cache.get(str(position)) for position in range(3)] == [None] * 3
+    assert cache.get("3") == {"min_age": 3}
@@ -1,8 +1,24 @@
+import asyncio
+import httpx
+import inspect
+import json
 import pytest
 import warnings
 from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
-from app.llm_processing.extractions import extract_information, main
+from langchain_community.chat_models import ChatOllama
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from app.llm_processing.chat_ollama import PooledChatOllama
+from app.llm_processing.extractions import (
+    ExtractionEngine,
+    extract_information,
+    get_extraction_engine,
+    main,
+    set_extraction_engine,
+)
 
 
 @pytest.mark.parametrize(
@@ -74,3 +90,264 @@ def test_main_interactive():
                 call.args[0] for call in mock_print.call_args_list
             ]
             assert actual_printed_outputs == expected_outputs
+
+
+def make_engine(*responses: str) -> ExtractionEngine:
+    return ExtractionEngine(llm=FakeListChatModel(responses=list(responses)))
+
+
+def test_engine_reuses_chain() -> None:
+    """
+    The chain is built once and every extraction goes through it.
+    """
+    engine = make_engine('{"sex": "Male", "is_control": true}')
+    chain = engine.chain
+
+    assert engine.extract("male healthy control subjects") == {
+        "sex": "male",
+        "is_control": True,
+    }
+    assert engine.extract("male healthy control subjects") == {
+        "sex": "male",
+        "is_control": True,
+    }
+    assert engine.chain is chain
+
+
+def test_engine_is_thread_safe() -> None:
+    """
+    A single engine can serve concurrent extractions.
+    """
+    engine = make_engine('{"min_age": "20", "diagnosis": "ADHD"}')
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(engine.extract, ["query"] * 32))
+
+    assert (
+        results
+        == [{"min_age": 20.0, "diagnosis": "adhd", "is_control": False}] * 32
+    )
+
+
+def test_extract_information_uses_shared_engine() -> None:
+    """
+    extract_information goes through the process-wide engine.
+    """
+    set_extraction_engine(make_engine('{"min_num_imaging_sessions": "2"}'))
+    try:
+        assert get_extraction_engine() is get_extraction_engine()
+        assert extract_information("two imaging sessions") == {
+            "min_num_imaging_sessions": 2
+        }
+    finally:
+        set_extraction_engine(None)
+
+
+def test_pooled_chat_ollama_reuses_session() -> None:
+    """
+    Generations are sent through the model's persistent HTTP session.
+    """
+    llm = PooledChatOllama(model="mistral")
+    with patch.object(llm._session, "post") as mock_post:
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.iter_lines.return_value = iter([])
+        llm._create_stream("http://localhost:11434/api/chat", {"messages": []})
+        llm._create_stream("http://localhost:11434/api/chat", {"messages": []})
+
+    assert mock_post.call_count == 2
+
+
+def test_pooled_chat_ollama_reuses_async_client() -> None:
+    """
+    Async generations are sent through the LLM client of the event loop,
+    rather than a new session each.
+    """
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        message = {"message": {"role": "assistant", "content": "{}"}}
+        return httpx.Response(
+            200,
+            content=json.dumps({**message, "done": False})
+            + "\n"
+            + json.dumps({**message, "done": True}),
+        )
+
+    llm = PooledChatOllama(model="mistral")
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    async def generate():
+        await llm.ainvoke("first")
+        await llm.ainvoke("second")
+
+    with patch(
+        "app.http_client.get_llm_client", return_value=client
+    ) as mock_client:
+        asyncio.run(generate())
+
+    assert mock_client.call_count == 2
+    assert [request.url.path for request in requests] == ["/api/chat"] * 2
+    assert json.loads(requests[1].content)["model"] == "mistral"
+
+
+@pytest.mark.parametrize("name", ["_create_stream", "_acreate_stream"])
+def test_pooled_chat_ollama_overrides_match_upstream(name: str) -> None:
+    """
+    The private ChatOllama methods overridden by PooledChatOllama keep the
+    signature it was written against, so a new langchain-community release
+    changing them fails here rather than in production.
+    """
+    assert inspect.signature(getattr(ChatOllama, name)).parameters == (
+        inspect.signature(getattr(PooledChatOllama, name)).parameters
+    )
+
+
+@pytest.mark.parametrize(
+    "payload,stop,kwargs",
+    [
+        ({"messages": [{"role": "user", "content": "hi"}]}, None, {}),
+        ({"prompt": "hi"}, ["}"], {"num_predict": 8, "seed": 1}),
+        ({"messages": []}, None, {"options": {"temperature": 0}}),
+    ],
+)
+def test_pooled_chat_ollama_requests_match_upstream(
+    payload, stop, kwargs
+) -> None:
+    """
+    PooledChatOllama sends the same headers and body as the upstream
+    `_create_stream` it replaces.
+    """
+    llm = PooledChatOllama(
+        model="mistral", format="json", headers={"X-Test": "1"}
+    )
+    with patch("langchain_community.llms.ollama.requests.post") as mock_post:
+        mock_post.return_value.status_code = 200
+        ChatOllama._create_stream(
+            llm, "http://localhost:11434/api/chat", payload, stop, **kwargs
+        )
+
+    headers, request_payload = llm._request(payload, stop, **kwargs)
+    assert mock_post.call_args.kwargs["headers"] == headers
+    assert mock_post.call_args.kwargs["json"] == request_payload
+
+
+class CountingChatModel(FakeListChatModel):
+    """
+    Fake chat model streaming its response one character at a time, and
+    counting the characters streamed so far.
+    """
+
+    streamed: int = 0
+
+    async def _astream(self, *args, **kwargs):
+        async for chunk in super()._astream(*args, **kwargs):
+            self.streamed += 1
+            yield chunk
+
+
+def test_engine_streams_fields_as_they_are_decoded() -> None:
+    """
+    Each LLM field is yielded before the LLM has finished generating, and
+    the rule fields it left empty follow.
+    """
+    response = '{"diagnosis": "ADHD", "assessment": "BAS", "sex": null}'
+    llm = CountingChatModel(responses=[response])
+    engine = ExtractionEngine(llm=llm)
+
+    async def collect():
+        return [
+            (field, value, llm.streamed)
+            async for field, value in engine.astream_extract(
+                "adhd subjects over 20 years old assessed with BAS"
+            )
+        ]
+
+    events = asyncio.run(collect())
+    assert [(field, value) for field, value, _ in events] == [
+        ("diagnosis", "ADHD"),
+        ("assessment", "BAS"),
+        ("sex", None),
+        ("min_age", "20"),
+    ]
+    assert events[0][2] < len(response)
+
+
+def test_closing_the_stream_stops_generation() -> None:
+    """
+    The LLM stops generating once the consumer closes the stream.
+    """
+    response = '{"diagnosis": "ADHD", "assessment": "BAS", "sex": "male"}'
+    llm = CountingChatModel(responses=[response])
+    engine = ExtractionEngine(llm=llm, rule_fast_path=False)
+
+    async def first_field():
+        stream = engine.astream_extract("query")
+        field = await stream.__anext__()
+        await stream.aclose()
+        return field
+
+    assert asyncio.run(first_field()) == ("diagnosis", "ADHD")
+    assert llm.streamed < len(response)
+
+
+def test_json_output_format_uses_compact_prompt() -> None:
+    """
+    The JSON output formats constrain Ollama's generation, cap its token
+    budget and replace the format instructions with a compact prompt.
+    """
+    json_engine = ExtractionEngine(output_format="json")
+    assert isinstance(json_engine.llm, PooledChatOllama)
+    assert json_engine.llm.format == "json"
+    assert json_engine.llm.num_predict == 256
+    assert json_engine.llm.num_ctx == 1024
+
+    compact = json_engine.prompt.format(context="adhd subjects")
+    full = ExtractionEngine().prompt.format(context="adhd subjects")
+    assert "Query: adhd subjects" in compact
+    assert '"properties"' not in compact
+    assert len(compact) < len(full) / 2
+
+    schema_engine = ExtractionEngine(output_format="schema", num_predict=64)
+    assert isinstance(schema_engine.llm, PooledChatOllama)
+    assert isinstance(schema_engine.llm.format, dict)
+    assert "diagnosis" in schema_engine.llm.format["properties"]
+    assert schema_engine.llm.num_predict == 64
+
+    with pytest.raises(ValueError):
+        ExtractionEngine(output_format="yaml")
+
+
+class TokenReportingChatModel(FakeListChatModel):
+    """
+    Fake chat model reporting token counts the way Ollama does.
+    """
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = AIMessage(content=self.responses[0])
+        return ChatResult(
+            generations=[
+                ChatGeneration(
+                    message=message,
+                    generation_info={"prompt_eval_count": 40, "eval_count": 8},
+                )
+            ]
+        )
+
+
+def test_engine_records_token_counts() -> None:
+    """
+    The prompt and completion tokens reported by the model are recorded.
+    """
+    engine = ExtractionEngine(
+        llm=TokenReportingChatModel(responses=['{"diagnosis": "adhd"}'])
+    )
+    with patch("app.llm_processing.chat_ollama.record_tokens") as mock_record:
+        assert engine.extract("adhd subjects") == {
+            "diagnosis": "adhd",
+            "is_control": False,
+        }
+        asyncio.run(engine.aextract("adhd subjects"))
+
+    assert mock_record.call_count == 2
+    mock_record.assert_called_with(40, 8)
@@ -0,0 +1,74 @@
+import asyncio
+from unittest.mock import patch
+from requests.adapters import HTTPAdapter
+from app import http_client
+
+
+def test_session_is_shared_and_configured() -> None:
+    """
+    Every sync request goes through one pooled session with retries,
+    compression and default timeouts.
+    """
+    session = http_client.get_session()
+    assert http_client.get_session() is session
+
+    adapter = session.get_adapter("https://api.neurobagel.org/")
+    assert isinstance(adapter, HTTPAdapter)
+    assert adapter.max_retries.total == http_client.MAX_RETRIES
+    assert 503 in adapter.max_retries.status_forcelist
+    assert (
+        adapter.poolmanager.connection_pool_kw["maxsize"]
+        == http_client.MAX_CONNECTIONS
+    )
+    assert "gzip" in session.headers["Accept-Encoding"]
+
+    with patch.object(session, "get") as mock_get:
+        http_client.get("https://api.neurobagel.org/attributes")
+        http_client.get("https://api.neurobagel.org/attributes", timeout=1)
+
+    assert mock_get.call_args_list[0].kwargs["timeout"] == (
+        http_client.CONNECT_TIMEOUT,
+        http_client.READ_TIMEOUT,
+    )
+    assert mock_get.call_args_list[1].kwargs["timeout"] == 1
+
+
+def test_async_client_is_shared_within_a_loop() -> None:
+    """
+    Async requests of one event loop share a client, which is closed with
+    the session.
+    """
+
+    async def clients():
+        first = http_client.get_async_client()
+        second = http_client.get_async_client()
+        limits = first._transport._pool._max_connections
+        await http_client.aclose()
+        return first, second, limits
+
+    first, second, limits = asyncio.run(clients())
+    assert first is second
+    assert first.is_closed
+    assert limits == http_client.MAX_CONNECTIONS
+
+
+def test_llm_client_is_separate_and_uncapped() -> None:
+    """
+    LLM generations get a client of their own, which does not cap the
+    number of connections, so that long generations neither wait for nor
+    starve the Neurobagel API requests.
+    """
+
+    async def clients():
+        llm_client = http_client.get_llm_client()
+        api_client = http_client.get_async_client()
+        same = http_client.get_llm_client()
+        limits = llm_client._transport._pool._max_connections
+        await http_client.aclose()
+        return llm_client, api_client, same, limits
+
+    llm_client, api_client, same, limits = asyncio.run(clients())
+    assert llm_client is same
+    assert llm_client is not api_client
+    assert llm_client.is_closed
+    assert limits > http_client.MAX_CONNECTIONS * 1000
@@ -0,0 +1,75 @@
+import json
+import subprocess
+import sys
+from typing import Dict
+import pytest
+
+# Packages only needed once a query reaches the LLM or the network
+HEAVY_PACKAGES = (
+    "langchain",
+    "langchain_core",
+    "langchain_community",
+    "requests",
+    "httpx",
+    "numpy",
+)
+
+# Import time of app.main, without FastAPI itself, in milliseconds
+IMPORT_TIME_BUDGET_MS = 300
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """
+    Imports a module in a fresh interpreter with `-X importtime`.
+
+    Returns:
+        Dict[str, int]: The cumulative import time of every module, in
+        microseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize(
+    "module",
+    ["app.main", "app.term_url_processing.vocabulary_snapshot"],
+)
+def test_heavy_packages_are_imported_on_first_use(module: str) -> None:
+    """
+    The service and the CLI helpers start without the LLM stack and the
+    HTTP clients.
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import json, sys, {module}; "
+            "print(json.dumps(list(sys.modules)))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    loaded = {name.split(".")[0] for name in json.loads(result.stdout)}
+    assert loaded.isdisjoint(HEAVY_PACKAGES)
+
+
+def test_import_time_budget() -> None:
+    """
+    Importing app.main, apart from FastAPI, stays within its budget. The
+    fastest of three runs is kept, to tolerate a busy machine.
+    """
+    elapsed_ms = []
+    for _ in range(3):
+        times = import_times("app.main")
+        elapsed_ms.append((times["app.main"] - times["fastapi"]) / 1000)
+    assert min(elapsed_ms) < IMPORT_TIME_BUDGET_MS
@@ -0,0 +1,123 @@
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from app.main import app
+from app.metrics import (
+    MetricsRegistry,
+    record_tokens,
+    stage,
+    term_resolutions,
+)
+from app.term_url_processing.term_url_mapper import get_sex_termURL
+
+client = TestClient(app)
+
+
+def test_histogram_exposition() -> None:
+    """
+    Histograms are rendered with cumulative buckets, a sum and a count.
+    """
+    registry = MetricsRegistry()
+    histogram = registry.histogram(
+        "test_seconds", "Test histogram.", ("stage",), buckets=(0.1, 1.0)
+    )
+    histogram.observe(0.05, stage="llm")
+    histogram.observe(0.5, stage="llm")
+
+    assert registry.render().splitlines() == [
+        "# HELP test_seconds Test histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="llm",le="0.1"} 1',
+        'test_seconds_bucket{stage="llm",le="1.0"} 2',
+        'test_seconds_bucket{stage="llm",le="+Inf"} 2',
+        'test_seconds_sum{stage="llm"} 0.55',
+        'test_seconds_count{stage="llm"} 2',
+    ]
+
+
+def test_counter_and_stats_exposition() -> None:
+    """
+    Counters escape their label values, and stats snapshots are read at
+    scrape time.
+    """
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "Test counter.", ("term",))
+    counter.inc(term='say "hi"\n')
+    stats = {"hits": 1}
+    registry.register_stats(
+        lambda: stats, {"test_hits_total": ("hits", "counter", "Hits.")}
+    )
+    stats["hits"] = 3
+
+    lines = registry.render().splitlines()
+    assert 'test_total{term="say \\"hi\\"\\n"} 1.0' in lines
+    assert "test_hits_total 3" in lines
+
+
+def test_resolution_tiers_are_counted() -> None:
+    """
+    Every term lookup is counted under the tier that resolved it.
+    """
+    before = {
+        tier: term_resolutions.value(attribute="sex", tier=tier)
+        for tier in ("exact", "fuzzy", "abbreviation", "none")
+    }
+    for sex in ("male", "fem", "M", "unknown"):
+        get_sex_termURL(sex)
+
+    for tier in ("exact", "fuzzy", "abbreviation", "none"):
+        assert term_resolutions.value(attribute="sex", tier=tier) == (
+            before[tier] + 1
+        )
+
+
+def test_metrics_endpoint_and_server_timing() -> None:
+    """
+    Stage timings are summarized in the Server-Timing header, and exposed
+    with the other metrics on /metrics.
+    """
+
+    async def slow_api_url(query: str) -> str:
+        with stage("llm"):
+            return "https://api.neurobagel.org/query/?sex=snomed:248153007"
+
+    with patch("app.router.routes.aget_api_url", side_effect=slow_api_url):
+        response = client.post("/generate_url/", json={"query": "men"})
+
+    server_timing = response.headers["Server-Timing"]
+    assert server_timing.startswith("llm;dur=")
+    assert "total;dur=" in server_timing
+
+    metrics = client.get("/metrics")
+    assert metrics.headers["content-type"].startswith("text/plain")
+    for name in (
+        'nb_stage_duration_seconds_count{stage="llm"}',
+        'nb_http_request_duration_seconds_count{method="POST",'
+        'path="/generate_url/",status="200"}',
+        "nb_query_cache_hit_ratio",
+        "nb_retries_total",
+        'nb_rule_fast_path_queries_total{coverage="full"}',
+    ):
+        assert name in metrics.text
+
+
+def test_llm_tokens_header() -> None:
+    """
+    The LLM tokens used by a request are summed in the X-LLM-Tokens header.
+    """
+
+    async def two_llm_calls(query: str) -> str:
+        record_tokens(40, 8)
+        record_tokens(2, 1)
+        return "https://api.neurobagel.org/query/?"
+
+    with patch("app.router.routes.aget_api_url", side_effect=two_llm_calls):
+        response = client.post("/generate_url/", json={"query": "men"})
+    assert response.headers["X-LLM-Tokens"] == "prompt=42, completion=9"
+
+    with patch(
+        "app.router.routes.aget_api_url",
+        return_value="https://api.neurobagel.org/query/?",
+    ):
+        response = client.post("/generate_url/", json={"query": "men"})
+    assert "X-LLM-Tokens" not in response.headers
+    assert 'nb_llm_tokens_count{kind="prompt"}' in client.get("/metrics").text
@@ -0,0 +1,140 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock, patch
+from app.llm_processing.chat_ollama import PooledChatOllama
+from app.llm_processing.ollama_pool import OllamaPool, ollama_base_urls
+
+BACKENDS = ["http://ollama-1:11434", "http://ollama-2:11434"]
+
+
+def test_requests_go_to_the_least_loaded_backend() -> None:
+    """
+    Each request goes to the backend with the fewest requests in flight,
+    and to the fastest one on a tie.
+    """
+    pool = OllamaPool(BACKENDS)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert {first.base_url, second.base_url} == set(BACKENDS)
+
+    pool.release(first, 2.0)
+    pool.release(second, 1.0)
+    assert pool.acquire() is second
+
+    stats = {backend["base_url"]: backend for backend in pool.snapshot()}
+    assert stats[second.base_url]["outstanding"] == 1
+    assert stats[first.base_url]["mean_latency"] == 2.0
+
+
+def test_failing_backend_is_ejected_then_readmitted() -> None:
+    """
+    Consecutive failures eject a backend, which gets another chance once
+    its ejection has ended, and is healthy again after a success.
+    """
+    pool = OllamaPool(BACKENDS, failure_threshold=2, ejection_seconds=30)
+    failing = pool.backends[0]
+    for _ in range(2):
+        pool.release(pool.acquire(), 0.1, ConnectionError("refused"))
+        # The other backend is idle again
+        assert pool.backends[1].outstanding == 0
+
+    assert not failing.healthy
+    assert all(pool.acquire() is pool.backends[1] for _ in range(3))
+
+    failing.ejected_until = 0.0
+    backend = pool.acquire()
+    assert backend is failing
+    pool.release(backend, 0.1)
+    assert failing.healthy
+
+
+def test_all_backends_ejected_still_serves() -> None:
+    """
+    With every backend ejected, requests go to the one whose ejection ends
+    first instead of failing outright.
+    """
+    pool = OllamaPool(BACKENDS, failure_threshold=1)
+    for backend in pool.backends:
+        pool.release(pool.acquire(), 0.1, ConnectionError("refused"))
+    pool.backends[1].ejected_until -= 10
+
+    assert pool.acquire() is pool.backends[1]
+
+
+def test_health_checks_eject_and_readmit() -> None:
+    """
+    A backend that does not answer, or has not pulled the model, is
+    ejected by the health checks, and re-admitted once it is back.
+    """
+    pool = OllamaPool(BACKENDS, model="mistral")
+    up = MagicMock()
+    up.json.return_value = {"models": [{"name": "mistral:latest"}]}
+    without_model = MagicMock()
+    without_model.json.return_value = {"models": [{"name": "llama3:latest"}]}
+
+    with patch(
+        "app.http_client.aget", side_effect=[up, without_model]
+    ) as mock_get:
+        assert asyncio.run(pool.check_all()) == [True, False]
+    assert mock_get.call_args_list[0].args[0] == f"{BACKENDS[0]}/api/tags"
+    assert not pool.backends[1].healthy
+
+    with patch("app.http_client.aget", side_effect=ConnectionError("down")):
+        asyncio.run(pool.check(pool.backends[0]))
+    assert not pool.backends[0].healthy
+
+    with patch("app.http_client.aget", return_value=up):
+        asyncio.run(pool.check_all())
+    assert all(backend.healthy for backend in pool.backends)
+
+
+def test_chat_ollama_spreads_generations_across_the_pool() -> None:
+    """
+    Generations are sent to the backends of the pool, and only count as
+    outstanding until their stream is consumed.
+    """
+    pool = OllamaPool(BACKENDS)
+    llm = PooledChatOllama(pool=pool, model="mistral", base_url=BACKENDS[0])
+    with patch.object(llm._session, "post") as mock_post:
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.iter_lines.return_value = iter(["{}"])
+        first = llm._create_stream(f"{BACKENDS[0]}/api/chat", {"messages": []})
+        second = llm._create_stream(
+            f"{BACKENDS[0]}/api/chat", {"messages": []}
+        )
+        list(first)
+        list(second)
+
+    assert {call.kwargs["url"] for call in mock_post.call_args_list} == {
+        f"{base_url}/api/chat" for base_url in BACKENDS
+    }
+    assert [backend.outstanding for backend in pool.backends] == [0, 0]
+    assert [backend.requests for backend in pool.backends] == [1, 1]
+
+
+@pytest.mark.parametrize(
+    "environment, expected",
+    [
+        ({}, ["http://localhost:11434"]),
+        ({"OLLAMA_BASE_URL": BACKENDS[0]}, BACKENDS[:1]),
+        (
+            {
+                "OLLAMA_BASE_URL": "http://ignored:11434",
+                "OLLAMA_BASE_URLS": ",".join(BACKENDS),
+            },
+            BACKENDS,
+        ),
+    ],
+)
+def test_backends_are_configured_from_the_environment(
+    monkeypatch, environment, expected
+) -> None:
+    """
+    OLLAMA_BASE_URLS lists the backends, OLLAMA_BASE_URL configures a single
+    one.
+    """
+    monkeypatch.delenv("OLLAMA_BASE_URL", raising=False)
+    monkeypatch.delenv("OLLAMA_BASE_URLS", raising=False)
+    for name, value in environment.items():
+        monkeypatch.setenv(name, value)
+    assert ollama_base_urls() == expected
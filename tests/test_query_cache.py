@@ -0,0 +1,83 @@
+import pytest
+from app.api.query_cache import QueryCache, normalize_query
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("Male healthy control subjects", "male healthy control subjects"),
+        (
+            "  male   HEALTHY\tcontrol subjects?! ",
+            "male healthy control subjects",
+        ),
+        ("subjects with ADHD.", "subjects with adhd"),
+        (
+            "Parkinson’s disease, aged 2.5 to 10",
+            "parkinson's disease aged 2.5 to 10",
+        ),
+        ("T2–weighted", "t2-weighted"),
+    ],
+)
+def test_normalize_query(query: str, expected: str) -> None:
+    """
+    Queries differing only in case, whitespace or punctuation share a key.
+    """
+    assert normalize_query(query) == expected
+
+
+def test_lru_eviction_and_stats() -> None:
+    """
+    The least recently used entry is evicted beyond max_entries.
+    """
+    cache = QueryCache(max_entries=2, clock=FakeClock())
+    cache.set("query a", "url a")
+    cache.set("query b", "url b")
+    assert cache.get("Query A?") == "url a"
+    cache.set("query c", "url c")
+
+    assert cache.get("query b") is None
+    assert cache.get("query c") == "url c"
+    assert cache.stats() == {
+        "size": 2,
+        "max_entries": 2,
+        "hits": 2,
+        "misses": 1,
+        "hit_rate": 2 / 3,
+        "evictions": 1,
+        "invalidations": 0,
+    }
+
+
+def test_entries_expire() -> None:
+    """
+    Entries older than the TTL are misses.
+    """
+    clock = FakeClock()
+    cache = QueryCache(ttl=10, clock=clock)
+    cache.set("query", "url")
+
+    clock.now = 10
+    assert cache.get("query") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_vocabulary_change_invalidates_entries() -> None:
+    """
+    A change of the vocabulary fingerprint drops every entry.
+    """
+    fingerprint = {"version": 1}
+    cache = QueryCache(fingerprint=lambda: fingerprint["version"])
+    cache.set("query", "url")
+    assert cache.get("query") == "url"
+
+    fingerprint["version"] = 2
+    assert cache.get("query") is None
+    assert cache.stats()["invalidations"] == 1
@@ -0,0 +1,151 @@
+import pytest
+from unittest.mock import patch
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from app.llm_processing.extractions import ExtractionEngine
+from app.llm_processing.rule_extractor import (
+    RuleCoverageStats,
+    extract_with_rules,
+)
+
+
+@pytest.mark.parametrize(
+    "query, expected_parameters, expected_covered",
+    [
+        (
+            "How many subjects between 20 and 80 yrs old who have at least 3 phenotypic sessions and 2 imaging sessions?",
+            {
+                "min_age": "20",
+                "max_age": "80",
+                "min_num_phenotypic_sessions": "3",
+                "min_num_imaging_sessions": "2",
+            },
+            True,
+        ),
+        (
+            "male healthy control subjects",
+            {"sex": "male", "is_control": True},
+            True,
+        ),
+        (
+            "women over 60 years old",
+            {"sex": "female", "min_age": "60"},
+            True,
+        ),
+        ("women older than 60", {"sex": "female", "min_age": "60"}, True),
+        ("subjects 65 and older", {"min_age": "65"}, True),
+        (
+            "subjects with maximum age 6 and minimum age 20",
+            {"min_age": "20", "max_age": "6"},
+            True,
+        ),
+        (
+            "men aged 20 to 40 with two imaging sessions",
+            {
+                "sex": "male",
+                "min_age": "20",
+                "max_age": "40",
+                "min_num_imaging_sessions": "2",
+            },
+            True,
+        ),
+        (
+            "female subjects suffering from social phobia with 1 phenotypic session",
+            {"sex": "female", "min_num_phenotypic_sessions": "1"},
+            False,
+        ),
+        ("males and females under 30 years", {"max_age": "30"}, False),
+        ("subjects with ADHD", {}, False),
+        # Numbers that are not ages, and negated terms, are left to the LLM
+        ("subjects with IQ over 100", {}, False),
+        ("women over 60", {"sex": "female"}, False),
+        ("subjects who are not male", {}, False),
+        (
+            "female subjects who are not healthy controls",
+            {"sex": "female"},
+            False,
+        ),
+        ("no more than 2 imaging sessions", {}, False),
+    ],
+)
+def test_extract_with_rules(
+    query: str, expected_parameters: dict, expected_covered: bool
+) -> None:
+    """
+    Patterns fill the numeric, sex and control fields, and a query is only
+    covered if nothing but filler words is left.
+    """
+    rule_extraction = extract_with_rules(query)
+    assert rule_extraction.parameters == expected_parameters
+    assert rule_extraction.covered == expected_covered
+
+
+def test_covered_query_skips_llm() -> None:
+    """
+    A fully covered query is answered without calling the LLM, in the same
+    shape as the post-processed LLM output.
+    """
+    engine = ExtractionEngine(llm=FakeListChatModel(responses=["{}"]))
+
+    with patch.object(engine, "chain") as mock_chain:
+        result = engine.extract(
+            "How many subjects between 20 and 80 yrs old who have at least 3 phenotypic sessions and 2 imaging sessions?"
+        )
+
+    mock_chain.invoke.assert_not_called()
+    assert result == {
+        "max_age": 80.0,
+        "min_age": 20.0,
+        "min_num_imaging_sessions": 2,
+        "min_num_phenotypic_sessions": 3,
+    }
+
+
+def test_partially_covered_query_lets_llm_correct_rules() -> None:
+    """
+    A partially covered query goes to the LLM whole, and the rule-based
+    fields only fill the fields the LLM left empty.
+    """
+    query = "female subjects suffering from social phobia with 1 phenotypic session"
+    engine = ExtractionEngine(
+        llm=FakeListChatModel(
+            responses=[
+                '{"diagnosis": "Social phobia", "sex": null}',
+                '{"diagnosis": "Social phobia", "sex": "other", '
+                '"min_num_phenotypic_sessions": "None"}',
+            ]
+        )
+    )
+
+    with patch.object(engine, "chain", wraps=engine.chain) as mock_chain:
+        filled = engine.extract(query)
+        corrected = engine.extract(query)
+
+    assert mock_chain.invoke.call_args.args[0] == {"context": query}
+    assert filled == {
+        "sex": "female",
+        "diagnosis": "social phobia",
+        "is_control": False,
+        "min_num_phenotypic_sessions": 1,
+    }
+    assert corrected == {**filled, "sex": "other"}
+
+
+def test_coverage_stats() -> None:
+    """
+    Coverage statistics count fully, partially and not covered queries.
+    """
+    stats = RuleCoverageStats()
+    for query in [
+        "male healthy control subjects",
+        "female subjects with ADHD",
+        "subjects with ADHD",
+    ]:
+        stats.record(extract_with_rules(query))
+
+    assert stats.snapshot() == {
+        "full": 1,
+        "partial": 1,
+        "none": 1,
+        "llm_skipped_rate": 1 / 3,
+        "fields": {"sex": 2, "is_control": 1},
+    }
@@ -0,0 +1,194 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, patch
+import pytest
+from app.api.url_generator import aget_api_url, extraction_flights
+from app.deadline import DeadlineExceeded, current_budget, request_budget
+from app.singleflight import SingleFlight, singleflight_calls
+
+
+def test_concurrent_calls_share_one_execution() -> None:
+    """
+    Threads calling with the same key while it is in flight share its
+    result, and the next call runs the work again.
+    """
+    flights = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work() -> str:
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(flights.do, "key", work)
+        started.wait()
+        waiters = [executor.submit(flights.do, "key", work) for _ in range(3)]
+        while flights.coalesced < 3:
+            time.sleep(0.001)
+        release.set()
+        results = [future.result() for future in [leader, *waiters]]
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert flights.do("key", lambda: "again") == "again"
+    assert (flights.executed, flights.coalesced) == (2, 3)
+    assert singleflight_calls.value(group="test", outcome="coalesced") >= 3
+
+
+def test_errors_are_shared_and_not_kept() -> None:
+    """
+    Every waiter gets the exception of the failed call, and the key is free
+    again afterwards.
+    """
+    flights = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing() -> str:
+        started.set()
+        release.wait()
+        raise ValueError("upstream down")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flights.do, "key", failing)
+        started.wait()
+        waiter = executor.submit(flights.do, "key", failing)
+        while flights.coalesced < 1:
+            time.sleep(0.001)
+        release.set()
+        for future in (leader, waiter):
+            with pytest.raises(ValueError):
+                future.result()
+
+    assert flights.do("key", lambda: "recovered") == "recovered"
+
+
+def test_async_calls_share_one_task() -> None:
+    """
+    Coroutines awaiting the same key share one task, including its errors.
+    """
+    flights = SingleFlight("test")
+    mock_work = AsyncMock(side_effect=["result", ValueError("failed")])
+
+    async def work() -> str:
+        await asyncio.sleep(0.01)
+        return await mock_work()
+
+    async def run():
+        results = await asyncio.gather(
+            *(flights.ado("key", work) for _ in range(3))
+        )
+        errors = await asyncio.gather(
+            *(flights.ado("key", work) for _ in range(2)),
+            return_exceptions=True,
+        )
+        return results, errors
+
+    results, errors = asyncio.run(run())
+    assert results == ["result"] * 3
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert mock_work.await_count == 2
+    assert (flights.executed, flights.coalesced) == (2, 3)
+
+
+def test_cancelling_a_waiter_does_not_cancel_the_others() -> None:
+    """
+    A cancelled caller stops waiting while the others still get the result,
+    and the work is only cancelled once every caller has gone.
+    """
+    flights = SingleFlight("test")
+    cancelled = []
+
+    async def work() -> str:
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+        return "result"
+
+    async def run():
+        first = asyncio.ensure_future(flights.ado("key", work))
+        second = asyncio.ensure_future(flights.ado("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "result"
+        assert first.cancelled()
+        assert not cancelled
+
+        abandoned = asyncio.ensure_future(flights.ado("other", work))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        await asyncio.sleep(0.01)
+        assert cancelled == [1]
+
+    asyncio.run(run())
+
+
+def test_short_deadline_does_not_fail_the_other_callers() -> None:
+    """
+    A caller whose deadline is reached stops waiting with DeadlineExceeded,
+    while the shared work runs without its deadline for the other callers.
+    """
+    flights = SingleFlight("test")
+    deadlines = []
+
+    async def work() -> str:
+        budget = current_budget()
+        assert budget is not None
+        deadlines.append(budget.timeout)
+        await asyncio.sleep(0.1)
+        return "result"
+
+    async def call(timeout: float) -> str:
+        with request_budget(timeout=timeout):
+            return await flights.ado("key", work)
+
+    async def run():
+        return await asyncio.gather(
+            call(0.01), call(5), return_exceptions=True
+        )
+
+    short, long = asyncio.run(run())
+    assert isinstance(short, DeadlineExceeded)
+    assert long == "result"
+    assert deadlines == [None]
+
+
+def test_identical_queries_share_one_extraction(monkeypatch) -> None:
+    """
+    Concurrent requests for the same normalized query call the LLM once.
+    """
+    monkeypatch.setenv(
+        "NB_API_QUERY_URL", "https://api.neurobagel.org/query/?"
+    )
+
+    async def slow_extraction(query: str) -> dict:
+        await asyncio.sleep(0.01)
+        return {"sex": "male"}
+
+    async def run():
+        return await asyncio.gather(
+            aget_api_url("Male subjects"),
+            aget_api_url("male subjects?"),
+            aget_api_url("male  subjects"),
+        )
+
+    coalesced = extraction_flights.coalesced
+    with patch(
+        "app.api.url_generator.aextract_information",
+        side_effect=slow_extraction,
+    ) as mock_extract:
+        urls = asyncio.run(run())
+
+    assert (
+        urls == ["https://api.neurobagel.org/query/?sex=snomed:248153007"] * 3
+    )
+    assert mock_extract.call_count == 1
+    assert extraction_flights.coalesced == coalesced + 2
@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from app.llm_processing.extractions import ExtractionEngine
+from app.llm_processing.template_cache import (
+    TemplateCache,
+    learn_template,
+    query_template,
+)
+
+
+def make_engine(*responses: str) -> ExtractionEngine:
+    return ExtractionEngine(
+        llm=FakeListChatModel(responses=list(responses)),
+        rule_fast_path=False,
+        template_cache=TemplateCache(),
+    )
+
+
+def test_queries_differing_in_numbers_skip_the_llm() -> None:
+    """
+    The numbers of a query fitting a known template are substituted into
+    the fields they fed, without calling the LLM.
+    """
+    engine = make_engine(
+        '{"min_age": "20", "max_age": "80", "diagnosis": "ADHD", '
+        '"min_num_imaging_sessions": "3"}',
+        '{"diagnosis": "not cached"}',
+    )
+    assert engine.extract(
+        "Subjects with ADHD between 20 and 80 yrs old, 3 imaging sessions"
+    ) == {
+        "max_age": 80.0,
+        "min_age": 20.0,
+        "diagnosis": "adhd",
+        "is_control": False,
+        "min_num_imaging_sessions": 3,
+    }
+    assert asyncio.run(
+        engine.aextract(
+            "subjects with adhd between 30 and 60 yrs old 2 imaging sessions"
+        )
+    ) == {
+        "max_age": 60.0,
+        "min_age": 30.0,
+        "diagnosis": "adhd",
+        "is_control": False,
+        "min_num_imaging_sessions": 2,
+    }
+    assert query_template("aged 7.5 with t1w scans") == (
+        "aged # with t1w scans",
+        ["7.5"],
+    )
+
+
+@pytest.mark.parametrize(
+    "query,extraction",
+    [
+        # The same number in two slots
+        ("between 20 and 20 years", {"min_age": 20.0, "max_age": 20.0}),
+        # A field that no slot fed
+        ("older than 20", {"min_age": 21.0}),
+        # A slot that fed no field
+        ("adhd study 2 aged 30", {"min_age": 30.0, "diagnosis": "adhd"}),
+        # A slot that fed a text field
+        (
+            "type 2 diabetes over 40",
+            {"min_age": 40.0, "diagnosis": "type 2 diabetes"},
+        ),
+        # No numbers at all
+        ("subjects with adhd", {"diagnosis": "adhd"}),
+    ],
+)
+def test_ambiguous_templates_are_not_cached(query, extraction) -> None:
+    """
+    Templates whose numbers cannot be traced to exactly the numeric fields
+    they fed are left to the LLM.
+    """
+    _, slots = query_template(query)
+    assert learn_template(slots, extraction) is None
+
+    cache = TemplateCache()
+    cache.set(query, extraction)
+    assert len(cache) == 0
+
+
+def test_numbers_not_fitting_the_template_fall_back_to_the_llm() -> None:
+    """
+    A minimum age above the maximum, or a decimal number of sessions, is
+    extracted by the LLM rather than substituted.
+    """
+    engine = make_engine(
+        '{"min_age": "20", "max_age": "80", "min_num_phenotypic_sessions": 1}',
+        '{"min_age": "60", "max_age": "90"}',
+        '{"min_num_phenotypic_sessions": 2}',
+    )
+    engine.extract("from 20 to 80, 1 phenotypic session")
+
+    assert engine.extract("from 90 to 60, 2 phenotypic session") == {
+        "min_age": 60.0,
+        "max_age": 90.0,
+    }
+    assert engine.extract("from 20 to 80, 2.5 phenotypic session") == {
+        "min_num_phenotypic_sessions": 2,
+    }
+    assert engine.extract("from 21 to 81, 4 phenotypic session") == {
+        "max_age": 81.0,
+        "min_age": 21.0,
+        "min_num_phenotypic_sessions": 4,
+    }
@@ -0,0 +1,108 @@
+import difflib
+import pytest
+from app.term_url_processing.term_index import TermIndex
+
+LABELS = [
+    "attention deficit hyperactivity disorder",
+    "concussion injury of brain",
+    "Obsessive-compulsive disorder",
+    "Parkinson's disease",
+    "Fibromyalgia",
+    "zuckerman sensation seeking scale",
+    "big five questionnaire",
+    "balloon analogue risk task",
+    "Arterial Spin Labeling",
+    "Electroencephalogram",
+]
+
+
+@pytest.fixture
+def term_index() -> TermIndex:
+    return TermIndex(
+        (label, f"termURL:{position}") for position, label in enumerate(LABELS)
+    )
+
+
+def test_exact_lookup(term_index: TermIndex) -> None:
+    """
+    Exact lookups ignore case and return the TermURL of the label.
+    """
+    assert term_index.get("FIBROMYALGIA") == "termURL:4"
+    assert "parkinson's disease" in term_index
+    assert term_index.get("unknown") is None
+
+
+def test_duplicate_labels_keep_first_term_url() -> None:
+    """
+    The first entry wins when several entries share a normalized label.
+    """
+    term_index = TermIndex([("Label", "first"), ("label", "second")])
+    assert term_index.get("label") == "first"
+    assert len(term_index) == 1
+
+
+@pytest.mark.parametrize(
+    "term",
+    [
+        "Concussion injury Of brain",
+        "Parkinsons",
+        "fibromalgia",
+        "zuckerman scale",
+        "balloon analogue",
+        "arterial labeling",
+        "electroencefalogram",
+        "unknown",
+        "",
+    ],
+)
+def test_closest_agrees_with_difflib(term_index: TermIndex, term: str) -> None:
+    """
+    Fuzzy matching gives the same answer as difflib.get_close_matches.
+    """
+    labels = [label.lower() for label in LABELS]
+    expected = difflib.get_close_matches(term.lower(), labels, n=1, cutoff=0.6)
+    assert term_index.closest(term) == (expected[0] if expected else None)
+
+
+def test_candidates_are_capped() -> None:
+    """
+    Fuzzy matching only scores the labels sharing the most trigrams.
+    """
+    term_index = TermIndex(
+        ((f"disorder {i}", str(i)) for i in range(500)), max_candidates=8
+    )
+    candidates = term_index.candidates("disorder 42")
+    assert len(candidates) == 8
+    assert candidates[0] == "disorder 42"
+    assert term_index.match("disorder 42x") == "42"
+
+
+def test_long_labels_do_not_crowd_out_close_matches() -> None:
+    """
+    Long labels containing the words of the query are not selected over a
+    short label closely matching it, so the match still agrees with difflib.
+    """
+    labels = [
+        f"depression disorder variant number {i} of the chronic depressive type"
+        for i in range(200)
+    ] + ["depresion"]
+    term_index = TermIndex((label, label) for label in labels)
+
+    expected = difflib.get_close_matches("depression", labels, cutoff=0.6)
+    assert expected == ["depresion"]
+    assert term_index.closest("depression") == "depresion"
+
+
+def test_vector_candidates_agree_with_difflib(term_index: TermIndex) -> None:
+    """
+    Selecting candidates with trigram vectors gives the same matches.
+    """
+    vector_index = TermIndex(
+        (
+            (label, f"termURL:{position}")
+            for position, label in enumerate(LABELS)
+        ),
+        vector_dims=256,
+    )
+    for query in ["parkinsons", "fibromalgia", "zuckerman scale", "EEG"]:
+        assert vector_index.match(query) == term_index.match(query)
@@ -0,0 +1,138 @@
+import pytest
+from unittest.mock import patch
+from app.term_url_processing import term_url_mapper
+from app.term_url_processing.abbreviation_index import AbbreviationIndex
+from app.term_url_processing.term_index import TermIndex
+from app.term_url_processing.term_index_file import (
+    TermIndexFile,
+    load_term_index_file,
+    main,
+    write_term_index_file,
+)
+
+LABELS = [
+    "attention deficit hyperactivity disorder",
+    "Obsessive-compulsive disorder",
+    "Parkinson's disease",
+    "Fibromyalgia",
+    "Électroencéphalogramme",
+    "balloon analogue risk task",
+]
+ABBREVIATIONS = [
+    {
+        "label": "attention deficit hyperactivity disorder",
+        "abbreviations": ["ADHD"],
+    },
+    {
+        "label": "obsessive-compulsive disorder",
+        "abbreviations": ["OCD", "TOC"],
+    },
+    {"label": "Parkinson's disease", "abbreviations": ["PD"]},
+]
+TERMS = ["fibromalgia", "parkinsons", "obsessive disorder", "ballon task", "x"]
+
+
+@pytest.fixture
+def built() -> TermIndex:
+    entries = [
+        (label, f"termURL:{position}") for position, label in enumerate(LABELS)
+    ]
+    return TermIndex(entries + [("no term url", None)], vector_dims=256)
+
+
+@pytest.fixture
+def mapped(tmp_path, built) -> TermIndexFile:
+    path = str(tmp_path / "terms.idx")
+    write_term_index_file(
+        path,
+        {"diagnosis": built},
+        {"diagnosis": AbbreviationIndex(ABBREVIATIONS)},
+        vector_dims=256,
+    )
+    return TermIndexFile(path)
+
+
+def test_mapped_index_answers_like_the_built_one(built, mapped) -> None:
+    """
+    Every lookup against the mapped file gives the same answer as against
+    the index it was written from.
+    """
+    term_index = mapped.term_index("diagnosis")
+    assert len(term_index) == len(built)
+    assert dict(term_index.items()) == dict(built.items())
+    assert term_index.get("no term url") is None
+    assert term_index.get("ÉLECTROENCÉPHALOGRAMME") == "termURL:4"
+    for term in TERMS:
+        assert term_index.candidates(term) == built.candidates(term)
+        assert term_index.closest(term) == built.closest(term)
+        assert term_index.match(term) == built.match(term)
+
+    abbreviation_index = mapped.abbreviation_index("diagnosis")
+    assert abbreviation_index.labels("toc") == (
+        "obsessive-compulsive disorder",
+    )
+    assert abbreviation_index.resolve("PD", term_index) == "termURL:2"
+    assert mapped.term_index("assessment") is None
+
+
+def test_mapped_file_replaces_the_vocabularies(mapped) -> None:
+    """
+    Once the file is in use, terms are resolved without fetching the
+    vocabularies, and the cache fingerprint follows the file.
+    """
+    fingerprint = term_url_mapper.get_vocabulary_fingerprint()
+    term_url_mapper.use_term_index_file(mapped)
+    try:
+        with patch.object(
+            term_url_mapper.vocabulary_store, "get"
+        ) as vocabulary_get:
+            assert (
+                term_url_mapper.get_diagnosis_termURL("fibromalgia")
+                == "termURL:3"
+            )
+            assert term_url_mapper.get_diagnosis_termURL("ADHD") == (
+                "termURL:0"
+            )
+        vocabulary_get.assert_not_called()
+        assert term_url_mapper.get_vocabulary_fingerprint() != fingerprint
+    finally:
+        term_url_mapper.use_term_index_file(None)
+
+
+def test_missing_or_corrupt_file_is_ignored(tmp_path) -> None:
+    """
+    Without a readable file, terms keep being resolved from the
+    vocabularies.
+    """
+    path = tmp_path / "terms.idx"
+    assert load_term_index_file(str(path)) is None
+    path.write_bytes(b"not a term index file")
+    assert load_term_index_file(str(path)) is None
+    assert term_url_mapper.get_term_index_file() is None
+
+
+def test_truncated_or_altered_file_is_rejected(mapped, capsys) -> None:
+    """
+    A file cut short or altered after it was written is not mapped, and the
+    CLI reports it as invalid.
+    """
+    with open(mapped.path, "rb") as f:
+        data = f.read()
+
+    truncated = f"{mapped.path}.truncated"
+    with open(truncated, "wb") as f:
+        f.write(data[: len(data) - 100])
+    altered = f"{mapped.path}.altered"
+    with open(altered, "wb") as f:
+        f.write(data[:-1] + bytes([data[-1] ^ 1]))
+
+    for path in (truncated, altered):
+        with pytest.raises(ValueError):
+            TermIndexFile(path)
+        assert load_term_index_file(path) is None
+        assert main(["show", path]) == 1
+    assert "Invalid term index file" in capsys.readouterr().out
+
+    assert load_term_index_file(mapped.path) is not None
+    assert "created at" in capsys.readouterr().out
+    term_url_mapper.use_term_index_file(None)
@@ -9,6 +9,7 @@ from app.term_url_processing.term_url_mapper import (
     get_sex_termURL,
     get_image_modality_termURL,
 )
+from app.term_url_processing.vocabulary_store import vocabulary_store
 
 
 def test_fetch_termURL_mappings_success() -> None:
@@ -24,7 +25,7 @@ def test_fetch_termURL_mappings_success() -> None:
         {"TermURL": "termURL2", "Label": "label2"},
     ]
 
-    with patch("requests.get") as mock_get:
+    with patch("requests.Session.get") as mock_get:
         mock_get.return_value.status_code = 200
         mock_get.return_value.json.return_value = mock_response_data
 
@@ -41,7 +42,7 @@ def test_fetch_termURL_mappings_http_error() -> None:
     """
     url = "http://example.com/api/mappings"
 
-    with patch("requests.get") as mock_get:
+    with patch("requests.Session.get") as mock_get:
         mock_get.return_value.raise_for_status.side_effect = RequestException(
             "HTTP Error"
         )
@@ -84,9 +85,8 @@ def test_get_diagnosis_termURL(diagnosis: str, expected_termURL: str) -> None:
         ]
     }
 
-    with patch(
-        "app.term_url_processing.term_url_mapper.fetch_termURL_mappings",
-        return_value=mock_diagnosis_response,
+    with patch.object(
+        vocabulary_store, "get", return_value=mock_diagnosis_response
     ):
         diagnosis_termURL = get_diagnosis_termURL(diagnosis)
         assert diagnosis_termURL == expected_termURL
@@ -124,9 +124,8 @@ def test_get_assessment_termURL(
         ]
     }
 
-    with patch(
-        "app.term_url_processing.term_url_mapper.fetch_termURL_mappings",
-        return_value=mock_assessment_response,
+    with patch.object(
+        vocabulary_store, "get", return_value=mock_assessment_response
     ):
         assessment_termURL = get_assessment_termURL(assessment)
         assert assessment_termURL == expected_termURL
@@ -1,5 +1,6 @@
 import pytest
 from unittest.mock import patch
+from app.api.query_cache import query_cache
 from app.api.url_generator import get_api_url, main
 
 
@@ -139,3 +140,23 @@ def test_main_interactive():
                     call.args[0] for call in mock_print.call_args_list
                 ]
                 assert actual_printed_outputs == expected_outputs
+
+
+def test_get_api_url_caches_responses():
+    """
+    Repeated queries are answered from the query cache without the LLM.
+    """
+    with patch.dict(
+        "os.environ",
+        {"NB_API_QUERY_URL": "https://api.neurobagel.org/query/?"},
+    ):
+        with patch(
+            "app.api.url_generator.extract_information",
+            return_value={"sex": "male", "is_control": True},
+        ) as mock_extract_information:
+            first = get_api_url("male healthy control subjects")
+            second = get_api_url("  Male healthy control subjects? ")
+
+    assert first == second
+    assert mock_extract_information.call_count == 1
+    assert query_cache.stats()["hits"] == 1
@@ -0,0 +1,28 @@
+import numpy as np
+from app.term_url_processing.vector_matcher import VectorMatcher
+
+LABELS = ["Parkinson's disease", "Fibromyalgia", "flow weighted"]
+
+
+def test_top_k_ranks_by_cosine_similarity() -> None:
+    """
+    The most similar labels come first, with their cosine similarity.
+    """
+    matcher = VectorMatcher(LABELS, dims=256)
+
+    top = matcher.top_k("FIBROMYALGIA", k=2)
+    assert top[0][0] == "fibromyalgia"
+    assert np.isclose(top[0][1], 1.0)
+    assert top[0][1] > top[1][1]
+    assert len(matcher.top_k("fibro", k=10)) == len(LABELS)
+
+
+def test_matrix_rows_are_unit_vectors() -> None:
+    """
+    Every label is stored as a unit-length vector of the configured size.
+    """
+    matcher = VectorMatcher(LABELS, dims=128)
+
+    assert matcher.matrix.shape == (3, 128)
+    assert np.allclose(np.linalg.norm(matcher.matrix, axis=1), 1.0)
+    assert VectorMatcher([]).top_k("anything") == []
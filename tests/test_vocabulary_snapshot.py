@@ -0,0 +1,96 @@
+import json
+import pytest
+from unittest.mock import patch
+from app.term_url_processing.vocabulary_snapshot import (
+    install_bundle,
+    load_bundle,
+    load_vocabulary_snapshot,
+    main,
+    write_bundle,
+)
+from app.term_url_processing.vocabulary_store import VocabularyStore
+
+DIAGNOSIS_URL = "http://example.com/attributes/nb%3ADiagnosis"
+VOCABULARIES = {
+    "diagnosis": {
+        "nb:Diagnosis": [
+            {"TermURL": "snomed:49049000", "Label": "Parkinson's"}
+        ]
+    }
+}
+
+
+@pytest.mark.parametrize("filename", ["snapshot.json", "snapshot.json.gz"])
+def test_bundle_round_trip(tmp_path, filename: str) -> None:
+    """
+    A written bundle loads back with the same content and metadata.
+    """
+    path = str(tmp_path / filename)
+    written = write_bundle(path, VOCABULARIES, fetched_at="2024-01-01T00:00")
+
+    loaded = load_bundle(path)
+    assert loaded == written
+    assert loaded.version == 1
+    assert loaded.checksum.startswith("sha256:")
+
+
+def test_corrupted_bundle_is_rejected(tmp_path) -> None:
+    """
+    A bundle whose content no longer matches its checksum is not loaded.
+    """
+    path = tmp_path / "snapshot.json"
+    write_bundle(str(path), VOCABULARIES)
+    content = json.loads(path.read_text())
+    content["vocabularies"]["diagnosis"]["nb:Diagnosis"] = []
+    path.write_text(json.dumps(content))
+
+    with pytest.raises(ValueError):
+        load_bundle(str(path))
+    assert load_vocabulary_snapshot(str(path), VocabularyStore()) is None
+
+
+def test_version_changes_only_with_content(tmp_path) -> None:
+    """
+    Rewriting identical vocabularies keeps the version.
+    """
+    path = str(tmp_path / "snapshot.json")
+    first = write_bundle(path, VOCABULARIES)
+    assert write_bundle(path, VOCABULARIES, first).version == 1
+    assert write_bundle(path, {"diagnosis": {}}, first).version == 2
+
+
+def test_installed_bundle_is_served_without_network(tmp_path) -> None:
+    """
+    An offline store serves the seeded vocabularies and never fetches.
+    """
+    path = str(tmp_path / "snapshot.json")
+    write_bundle(path, VOCABULARIES)
+    store = VocabularyStore(offline=True)
+
+    with patch("requests.Session.get") as mock_get:
+        install_bundle(
+            load_bundle(path), store, urls={"diagnosis": DIAGNOSIS_URL}
+        )
+        assert store.get(DIAGNOSIS_URL) == VOCABULARIES["diagnosis"]
+        assert store.get("http://example.com/other") is None
+    mock_get.assert_not_called()
+
+
+def test_refresh_from_local_files(tmp_path) -> None:
+    """
+    The CLI builds a snapshot from local files instead of the API.
+    """
+    sources = []
+    for name in ("diagnosis", "assessment"):
+        source = tmp_path / f"{name}.json"
+        source.write_text(json.dumps({f"nb:{name}": []}))
+        sources += ["--from-file", f"{name}={source}"]
+    path = str(tmp_path / "snapshot.json.gz")
+
+    with patch("requests.Session.get") as mock_get:
+        assert main(["refresh", path, *sources]) == 0
+    mock_get.assert_not_called()
+
+    bundle = load_bundle(path)
+    assert bundle.vocabularies["assessment"] == {"nb:assessment": []}
+    assert main(["show", path]) == 0
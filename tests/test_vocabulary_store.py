@@ -0,0 +1,203 @@
+import asyncio
+from typing import Dict
+from unittest.mock import AsyncMock, MagicMock, patch
+from requests.exceptions import RequestException
+from app.deadline import request_budget
+from app.term_url_processing.vocabulary_store import VocabularyStore
+
+URL = "http://example.com/attributes/nb%3ADiagnosis"
+VOCABULARY = {
+    "nb:Diagnosis": [{"TermURL": "snomed:49049000", "Label": "Parkinson's"}]
+}
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_response(status_code=200, data=None, headers=None) -> MagicMock:
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = data
+    response.headers = headers or {}
+    if status_code >= 400:
+        response.raise_for_status.side_effect = RequestException(
+            f"HTTP {status_code}"
+        )
+    return response
+
+
+def test_vocabulary_is_fetched_once() -> None:
+    """
+    Repeated lookups within the TTL are served from memory.
+    """
+    store = VocabularyStore(ttl=60, clock=FakeClock())
+
+    with patch(
+        "requests.Session.get", return_value=make_response(data=VOCABULARY)
+    ) as mock_get:
+        assert store.get(URL) == VOCABULARY
+        assert store.get(URL) == VOCABULARY
+
+    assert mock_get.call_count == 1
+
+
+def test_stale_snapshot_is_served_while_revalidating() -> None:
+    """
+    A stale snapshot is returned immediately and revalidated in the
+    background with the ETag and Last-Modified validators.
+    """
+    clock = FakeClock()
+    store = VocabularyStore(ttl=60, stale_ttl=600, clock=clock)
+    validators = {"ETag": '"v1"', "Last-Modified": "Mon, 01 Jan 2024"}
+
+    with patch(
+        "requests.Session.get",
+        return_value=make_response(data=VOCABULARY, headers=validators),
+    ):
+        first = store.get_snapshot(URL)
+    assert first is not None
+
+    clock.now = 120
+    with patch(
+        "requests.Session.get", return_value=make_response(status_code=304)
+    ) as mock_get:
+        assert store.get(URL) == VOCABULARY
+        store.wait_for_refreshes()
+
+    request_headers = mock_get.call_args.kwargs["headers"]
+    assert request_headers == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Mon, 01 Jan 2024",
+    }
+    snapshot = store.get_snapshot(URL)
+    assert snapshot is not None
+    assert snapshot.fetched_at == 120
+    assert snapshot.version == first.version
+
+
+def test_changed_vocabulary_bumps_version() -> None:
+    """
+    A revalidation that returns new content replaces the snapshot.
+    """
+    clock = FakeClock()
+    store = VocabularyStore(ttl=60, stale_ttl=0, clock=clock)
+    updated: Dict[str, list] = {"nb:Diagnosis": []}
+
+    with patch(
+        "requests.Session.get", return_value=make_response(data=VOCABULARY)
+    ):
+        store.get(URL)
+
+    clock.now = 120
+    with patch(
+        "requests.Session.get", return_value=make_response(data=updated)
+    ):
+        assert store.get(URL) == updated
+
+    snapshot = store.get_snapshot(URL)
+    assert snapshot is not None and snapshot.version == 2
+
+
+def test_last_good_snapshot_is_served_when_upstream_is_down() -> None:
+    """
+    The last good snapshot keeps being served if revalidation fails.
+    """
+    clock = FakeClock()
+    store = VocabularyStore(ttl=60, stale_ttl=0, clock=clock)
+
+    with patch(
+        "requests.Session.get", return_value=make_response(data=VOCABULARY)
+    ):
+        store.get(URL)
+
+    clock.now = 120
+    with patch("requests.Session.get", side_effect=RequestException("down")):
+        assert store.get(URL) == VOCABULARY
+
+
+def test_failed_first_load_backs_off() -> None:
+    """
+    A vocabulary that could never be fetched returns None, and the upstream
+    is not hammered again until the failure backoff has elapsed.
+    """
+    clock = FakeClock()
+    store = VocabularyStore(failure_backoff=30, clock=clock)
+
+    with patch(
+        "requests.Session.get", side_effect=RequestException("down")
+    ) as mock_get:
+        assert store.get(URL) is None
+        assert store.get(URL) is None
+        assert mock_get.call_count == 1
+
+        clock.now = 31
+        assert store.get(URL) is None
+        assert mock_get.call_count == 2
+
+
+def test_async_fetch_shares_snapshots() -> None:
+    """
+    Vocabularies fetched with the async client are shared with sync lookups.
+    """
+    store = VocabularyStore(ttl=60, clock=FakeClock())
+
+    with patch(
+        "httpx.AsyncClient.get",
+        new_callable=AsyncMock,
+        return_value=make_response(data=VOCABULARY),
+    ) as mock_get:
+        assert asyncio.run(store.aget(URL)) == VOCABULARY
+        assert asyncio.run(store.aget(URL)) == VOCABULARY
+
+    assert mock_get.await_count == 1
+    with patch("requests.Session.get") as mock_requests_get:
+        assert store.get(URL) == VOCABULARY
+    mock_requests_get.assert_not_called()
+
+
+def test_concurrent_async_fetches_share_one_request() -> None:
+    """
+    Concurrent fetches of the same vocabulary send a single request.
+    """
+    store = VocabularyStore(ttl=60, clock=FakeClock())
+
+    async def slow_get(*args, **kwargs):
+        await asyncio.sleep(0.01)
+        return make_response(data=VOCABULARY)
+
+    async def fetch_all():
+        return await asyncio.gather(*(store.aget(URL) for _ in range(5)))
+
+    with patch("httpx.AsyncClient.get", side_effect=slow_get) as mock_get:
+        assert asyncio.run(fetch_all()) == [VOCABULARY] * 5
+
+    assert mock_get.call_count == 1
+
+
+def test_request_deadline_does_not_bound_shared_fetch() -> None:
+    """
+    Fetches use the timeout of the store rather than the deadline of the
+    request that started them, so a client asking for a short deadline
+    cannot make the fetch fail for every other request and back off.
+    """
+    store = VocabularyStore(timeout=10, clock=FakeClock())
+
+    with request_budget(timeout=0.05):
+        with patch(
+            "requests.Session.get", return_value=make_response(data=VOCABULARY)
+        ) as mock_get:
+            assert store.get(URL) == VOCABULARY
+        with patch(
+            "httpx.AsyncClient.get",
+            new_callable=AsyncMock,
+            return_value=make_response(data=VOCABULARY),
+        ) as mock_aget:
+            assert asyncio.run(store.arefresh(URL)) is not None
+
+    assert mock_get.call_args.kwargs["timeout"] == 10
+    assert mock_aget.call_args.kwargs["timeout"] == 10
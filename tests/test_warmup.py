@@ -0,0 +1,139 @@
+import asyncio
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from app.llm_processing.chat_ollama import PooledChatOllama
+from app.llm_processing.extraction_cache import SQLiteExtractionCache
+from app.llm_processing.extractions import ExtractionEngine
+from app.llm_processing.rule_extractor import coverage_stats
+from app.llm_processing.template_cache import TemplateCache
+from app.main import app
+from app.warmup import WarmupState, warm_up, warmup_state
+
+client = TestClient(app)
+
+
+def test_warm_up_runs_every_step() -> None:
+    """
+    The warm-up loads the vocabularies, builds the term indexes and runs a
+    dummy extraction before reporting ready.
+    """
+    state = WarmupState()
+    engine = ExtractionEngine(
+        llm=FakeListChatModel(responses=['{"diagnosis": "parkinsons"}'])
+    )
+
+    with patch(
+        "app.warmup.aload_vocabularies", return_value=None
+    ) as mock_load, patch(
+        "app.warmup.build_term_indexes", return_value={"sex": 3}
+    ):
+        asyncio.run(warm_up(state, engine))
+
+    assert state.ready
+    mock_load.assert_called_once_with(("diagnosis", "assessment"))
+    assert [name for name in state.steps] == [
+        "model",
+        "vocabularies",
+        "term_indexes",
+        "extraction",
+    ]
+    assert state.steps["term_indexes"]["result"] == {"sex": 3}
+    assert state.steps["extraction"]["result"]["diagnosis"] == "parkinsons"
+
+
+def test_warm_up_bypasses_the_caches(tmp_path) -> None:
+    """
+    Every warm-up sends the dummy extraction to the LLM, without storing it
+    in the extraction caches or counting it in the fast path coverage.
+    """
+    engine = ExtractionEngine(
+        llm=FakeListChatModel(
+            responses=['{"diagnosis": "parkinsons"}', '{"diagnosis": "ms"}']
+        ),
+        cache=SQLiteExtractionCache(f"sqlite:///{tmp_path / 'cache.db'}"),
+        template_cache=TemplateCache(),
+    )
+    coverage = coverage_stats.snapshot()
+    results = []
+
+    with patch("app.warmup.aload_vocabularies", return_value=None), patch(
+        "app.warmup.build_term_indexes", return_value={}
+    ):
+        for _ in range(2):
+            state = WarmupState()
+            asyncio.run(warm_up(state, engine))
+            assert state.ready
+            results.append(state.steps["extraction"]["result"]["diagnosis"])
+
+    assert results == ["parkinsons", "ms"]
+    assert engine.cache is not None and len(engine.cache) == 0
+    assert (
+        engine.template_cache is not None and len(engine.template_cache) == 0
+    )
+    assert coverage_stats.snapshot() == coverage
+
+
+def test_failed_warm_up_is_reported() -> None:
+    """
+    A failing step leaves the service not ready, with the error reported.
+    """
+    state = WarmupState()
+    engine = ExtractionEngine(llm=FakeListChatModel(responses=["not json"]))
+
+    with patch("app.warmup.aload_vocabularies", return_value=None), patch(
+        "app.warmup.build_term_indexes", return_value={}
+    ):
+        asyncio.run(warm_up(state, engine))
+
+    assert state.status == "failed"
+    assert state.steps["extraction"]["status"] == "failed"
+    assert state.error
+
+
+def test_warm_up_times_out() -> None:
+    """
+    A warm-up outliving its timeout is reported as failed.
+    """
+    state = WarmupState()
+    engine = ExtractionEngine(llm=FakeListChatModel(responses=["{}"]))
+
+    async def hanging_load(*args, **kwargs) -> None:
+        await asyncio.sleep(5)
+
+    with patch("app.warmup.aload_vocabularies", side_effect=hanging_load):
+        asyncio.run(warm_up(state, engine, timeout=0.05))
+
+    assert state.status == "failed"
+    assert state.error == "TimeoutError"
+
+
+def test_model_is_loaded_with_keep_alive() -> None:
+    """
+    Loading the model sends an empty generation with the keep-alive.
+    """
+    llm = PooledChatOllama(model="mistral", keep_alive="1h")
+    with patch.object(llm._session, "post") as mock_post:
+        mock_post.return_value.status_code = 200
+        llm.load()
+
+    assert mock_post.call_args.kwargs["url"].endswith("/api/generate")
+    assert mock_post.call_args.kwargs["json"] == {
+        "model": "mistral",
+        "keep_alive": "1h",
+    }
+
+
+def test_ready_and_health_endpoints() -> None:
+    """
+    /ready is unavailable until the warm-up is done, while /health always
+    answers.
+    """
+    with patch.object(warmup_state, "status", "warming"):
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "warming"
+        assert client.get("/health").json() == {"status": "ok"}
+
+    with patch.object(warmup_state, "status", "ready"):
+        assert client.get("/ready").status_code == 200